@@ -27,15 +27,26 @@ def extract_features(image):
     return blur, color, centroid
 
 
-def verify_packaging(scan_path, template_path):
-    scan_img = cv2.imread(scan_path)
+def template_features(template_path):
+    """Features of a packaging template, in the reference.json shape (JSON-serialisable), or None."""
     template_img = cv2.imread(template_path)
+    if template_img is None:
+        return None
+    blur, color, centroid = extract_features(template_img)
+    return {"blur": float(blur), "color": color.tolist(), "centroid": centroid.tolist()}
+
+
+def verify_packaging_features(scan_path, template):
+    """verify_packaging against precomputed template features (see template_features)."""
+    scan_img = cv2.imread(scan_path)
 
-    if scan_img is None or template_img is None:
+    if scan_img is None or template is None:
         return False
 
     scan_blur, scan_color, scan_centroid = extract_features(scan_img)
-    template_blur, template_color, template_centroid = extract_features(template_img)
+    template_blur = template["blur"]
+    template_color = np.asarray(template["color"])
+    template_centroid = np.asarray(template["centroid"])
 
     # Blur check
     if scan_blur < template_blur * TOLERANCES["blur"]:
@@ -50,3 +61,7 @@ def verify_packaging(scan_path, template_path):
         return False
 
     return True
+
+
+def verify_packaging(scan_path, template_path):
+    return verify_packaging_features(scan_path, template_features(template_path))
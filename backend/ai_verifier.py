@@ -3,4 +3,9 @@ import os
 
 sys.path.append(os.path.abspath("../ai-auth"))
 
-from verify import verify_packaging
+from verify import template_features, verify_packaging, verify_packaging_features
+from tracing import traced
+
+verify_packaging = traced("ai.verify_packaging")(verify_packaging)
+verify_packaging_features = traced("ai.verify_packaging")(verify_packaging_features)
+template_features = traced("ai.template_features")(template_features)
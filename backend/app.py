@@ -1,8 +1,14 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, abort, g, redirect, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
+from werkzeug.utils import safe_join
 import os
 import re
+import json
+import shutil
 import uuid
+import zipfile
+from collections.abc import Mapping
+from datetime import datetime, timedelta
 import qrcode
 import psycopg2
 from PIL import Image
@@ -13,23 +19,42 @@ from db import (
     insert_product,
     get_product_by_id,
     get_product_by_pan_code,
+    get_products_for_scans,
+    scan_event_summary,
+)
+from scan_writer import (
+    writer as scan_writer,
     get_pharmacist_scan,
     record_pharmacist_scan,
+    record_pharmacist_scans,
     get_any_consumer_scan,
     record_consumer_scan,
+    record_event,
 )
-from qr_overlay import replace_qr
-from qr_extractor import extract_qr_data
-from ai_verifier import verify_packaging
+from qr_overlay import compositor
+from ai_verifier import verify_packaging_features
 from code_generator import generate_unique_code
 from id_generation import generate_hidden_code_image
 from revealer import reveal_channels
-from extractor import extract_code_safe
+from scan_decoder import DECODE_TIMEOUT, decode_scan, decode_scans, is_valid_strip_code
+from extractor import BAND_WIDTH
+from product_ids import is_valid_qr_payload, new_product_id
+from qr_signing import QR_SIGNING, REQUIRE_SIGNED_QR, sign_qr_payload, verify_signature
+from storage import ARTIFACT_ROOT, get_storage
+from artifacts import render_mode, get_cache, content_etag, webp_variant, ARTIFACT_WEBP
+import tracing
+from bloom import issued
+from verdict_cache import verdicts
+from template_registry import chain_hashes, templates
 from blockchain import (
     register_product,
     verify_product,
+    verify_products,
     get_manufacturer,
     get_product_state,
+    get_products_chain_info,
+    get_template_hash,
+    register_template_hash,
 )
 
 
@@ -45,11 +70,6 @@ load_dotenv()
 # 🔷 Utility
 # =====================================================
 
-def is_valid_product_id(product_id):
-    pattern = r"^MEDICINEX-[a-f0-9]{8}$"
-    return re.match(pattern, product_id) is not None
-
-
 def _normalize_pan_code(code):
     """Normalize strip/PAN code for comparison and DB lookup."""
     if not code:
@@ -57,6 +77,51 @@ def _normalize_pan_code(code):
     return str(code).strip().upper()
 
 
+def _scan_code(factor, decoded):
+    """Key a decoded scan by its code: the product id for QR, the normalized strip code for strip."""
+    if factor == "qr":
+        return str(decoded).strip()
+    if factor == "strip":
+        return _normalize_pan_code(decoded)
+    return None
+
+
+def _verify_qr(factor, decoded):
+    """
+    Signature fast path for QR scans (no I/O). Returns (decoded, rejected): for QR, decoded becomes the
+    product id carried by the payload; rejected is a COUNTERFEIT verdict when the QR must not proceed.
+    """
+    if factor != "qr":
+        return decoded, None
+    status, product_id, _ = verify_signature(decoded)
+    if status == "invalid":
+        return product_id or decoded, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "QR signature is not valid",
+            "Product ID": product_id,
+            "Flag": "Forged QR - not signed by a registered manufacturer",
+        }
+    if status == "unsigned" and REQUIRE_SIGNED_QR:
+        return product_id, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "QR code is not signed",
+            "Product ID": product_id,
+            "Flag": "Unsigned QR",
+        }
+    return product_id, None
+
+
+DECODE_TIMED_OUT = "Decoding timed out because the server is busy; retry the scan"
+
+
+def _decode_timed_out():
+    """503 for a scan whose decode ran out of time (scan_decoder.DECODE_TIMEOUT); says nothing about the pack."""
+    response = jsonify({"error": DECODE_TIMED_OUT})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+
 def _is_likely_qr_or_strip_only(scan_path, min_side=400):
     """True if image is small (QR-only or strip-only crop). Such uploads skip AI and go straight to blockchain."""
     try:
@@ -71,49 +136,105 @@ def _is_likely_qr_or_strip_only(scan_path, min_side=400):
 # 🔷 App Setup
 # =====================================================
 
-app = Flask(__name__)
-CORS(app)
-
-# Init DB when possible. App still runs if PostgreSQL is down.
-try:
-    init_db()
-    print("DB: connected")
-except psycopg2.OperationalError as e:
-    print("DB not available:", str(e))
-
 # Folder structure inside backend/
 UPLOAD_FOLDER = "uploads"
 TEMPLATE_FOLDER = "templates"
 TEMP_FOLDER = "temp"
-GENERATED_DIR = "generated"
-GENERATED_QR = os.path.join(GENERATED_DIR, "qr")
-GENERATED_PACKAGED = os.path.join(GENERATED_DIR, "packaged")
-GENERATED_HIDDEN = os.path.join(GENERATED_DIR, "hidden")
-GENERATED_REVEALS = os.path.join(GENERATED_DIR, "reveals")
+# Generated artifacts live in the storage backend (storage.py), addressed by their /generated/<key> path
+GENERATED_DIR = ARTIFACT_ROOT
+
+api = Blueprint("api", __name__)
+
+
+def create_app():
+    """
+    Build the Flask app. Runs no migrations and opens no DB or chain connections, so a pre-forking
+    server can import it once in the master; run `python manage.py migrate` once per deploy instead.
+    """
+    for folder in (UPLOAD_FOLDER, TEMPLATE_FOLDER, TEMP_FOLDER, GENERATED_DIR):
+        os.makedirs(folder, exist_ok=True)
+
+    app = Flask(__name__)
+    # X-Sendfile offload for artifacts (send_file then sends headers only)
+    app.config["USE_X_SENDFILE"] = ARTIFACT_SENDFILE == "x-sendfile"
+    CORS(app)
+    # Per-stage timings: breakdown log line per request, optional Server-Timing header, /metrics
+    tracing.init_app(app)
+    app.register_blueprint(api)
+    if not REQUIRE_SIGNED_QR:
+        # A bare product id still verifies, so anyone who reads one issued QR can print copies of it
+        print("Warning: REQUIRE_SIGNED_QR is off, unsigned QR codes are accepted. "
+              "Set REQUIRE_SIGNED_QR=1 once QR codes printed before signing are out of circulation.")
+    return app
+
+
+def _save_scan(file):
+    """Save an uploaded scan under a unique name (concurrent uploads often share names like image.jpg)."""
+    scan_path = os.path.join(TEMP_FOLDER, f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}")
+    file.save(scan_path)
+    return scan_path
+
+
+def _remove_scan(scan_path):
+    try:
+        if scan_path and os.path.exists(scan_path):
+            os.remove(scan_path)
+    except Exception:
+        pass
+
 
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(TEMPLATE_FOLDER, exist_ok=True)
-os.makedirs(TEMP_FOLDER, exist_ok=True)
-os.makedirs(GENERATED_QR, exist_ok=True)
-os.makedirs(GENERATED_PACKAGED, exist_ok=True)
-os.makedirs(GENERATED_HIDDEN, exist_ok=True)
-os.makedirs(GENERATED_REVEALS, exist_ok=True)
+CODE_REQUIRED = 'Send the decoded QR payload as "qr" or the strip code as "strip"'
+
+
+def _submitted_code(data):
+    """
+    (factor, code) for a code-only verification body, shaped like decode_scan's result: (None, None) for a
+    malformed code, which gets the same verdict as an image with no readable code. None if neither was sent.
+    """
+    if not isinstance(data, Mapping):
+        return None
+    qr = str(data.get("qr") or "").strip()
+    strip = _normalize_pan_code(data.get("strip"))
+    if qr:
+        return ("qr", qr) if is_valid_qr_payload(qr) else (None, None)
+    if strip:
+        return ("strip", strip) if is_valid_strip_code(strip) else (None, None)
+    return None
 
 
 # =====================================================
 # 🔷 Health Check
 # =====================================================
 
-@app.route("/", methods=["GET"])
+@api.route("/", methods=["GET"])
 def home():
     return "Authentimed Backend Running (Sepolia Mode)"
 
 
+# =====================================================
+# 🔷 Client Config
+# =====================================================
+
+# Largest side the frontends downscale scan images to before upload. Never below the canonical strip
+# band width, so a strip-only crop is not shrunk under the resolution the extractor was designed for.
+MAX_IMAGE_DIMENSION = max(int(os.getenv("MAX_IMAGE_DIMENSION", "1600")), BAND_WIDTH)
+
+
+@api.route("/config", methods=["GET"])
+def client_config():
+    response = jsonify({"max_image_dimension": MAX_IMAGE_DIMENSION})
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
+
+
 # =====================================================
 # 🔷 Manufacturer: Generate Product
 # =====================================================
 
-@app.route("/manufacturer/generate", methods=["POST"])
+LOT_PATTERN = re.compile(r"^[0-9A-Z-]{1,20}$")
+
+
+@api.route("/manufacturer/generate", methods=["POST"])
 
 
 def generate_product():
@@ -121,43 +242,83 @@ def generate_product():
         owner_address = os.getenv("OWNER_ADDRESS")
         manufacturer = owner_address
 
-        # Save uploaded template if provided
+        # Save uploaded template if provided; it becomes this manufacturer's current version
+        template = None
         if "file" in request.files and request.files["file"].filename:
             f = request.files["file"]
             template_path = os.path.join(TEMPLATE_FOLDER, f"{owner_address}.png")
             f.save(template_path)
             print("Template saved at:", template_path)
+            template = templates.register(manufacturer, template_path)
 
-        # Template must exist (either just saved or already on disk)
-        template_path = os.path.join(TEMPLATE_FOLDER, f"{owner_address}.png")
+        # Template must be registered (either just uploaded or earlier)
+        template = template or templates.current(manufacturer)
         print("OWNER_ADDRESS:", owner_address)
-        print("Looking for template at:", template_path)
-        print("Exists:", os.path.exists(template_path))
+        print("Template:", template and f"v{template['version']} {template['sha256'][:12]}")
 
-        if not os.path.exists(template_path):
+        if not template or not os.path.exists(template["path"]):
             return jsonify({"error": "Template not registered. Upload a packaging template image."}), 400
 
-        product_id = f"MEDICINEX-{uuid.uuid4().hex[:8]}"
-
-        qr_path = os.path.join(GENERATED_QR, f"{product_id}.png")
-        img = qrcode.make(product_id)
-        img.save(qr_path)
-
-        output_path = os.path.join(GENERATED_PACKAGED, f"{product_id}_packaged.png")
-        replace_qr(template_path, qr_path, output_path)
-
-        # Embedded (PAN) strip code: unique in DB, encode to hidden image
+        # Anchor the template on chain, so verification can tell if the local copy was swapped
+        if manufacturer and chain_hashes.get(manufacturer, get_template_hash) != template["sha256"]:
+            tx_result = register_template_hash(template["sha256"])
+            print("Template hash TX Result:", tx_result)
+            if not tx_result["success"]:
+                return jsonify({"error": f"Template hash not registered on chain: {tx_result['error']}"}), 400
+            chain_hashes.set(manufacturer, template["sha256"])
+
+        # Immutable copy of the template this product is printed with (re-rendering needs it)
+        template_path = template["path"]
+        template_sha256 = template["sha256"]
+
+        lot = (request.form.get("lot") or "").strip().upper() or None
+        if lot and not LOT_PATTERN.match(lot):
+            return jsonify({"error": "Lot must be 1-20 characters: A-Z, 0-9 or -"}), 400
+
+        product_id = new_product_id()
+        # What the QR encodes: the product id signed with this manufacturer's key (the lot is kept in the DB only)
+        qr_payload = sign_qr_payload(product_id, manufacturer) if QR_SIGNING else product_id
+        packaged_key = f"packaged/{product_id}_packaged.png"
+        hidden_key = f"hidden/{product_id}_hidden.png"
+
+        # Embedded (PAN) strip code: unique in DB
         pan_code = generate_unique_code()
-        hidden_path = os.path.join(GENERATED_HIDDEN, f"{product_id}_hidden.png")
-        generate_hidden_code_image(code=pan_code, output_path=hidden_path)
 
-        # Store all reveals for this product in a folder: reveals/{product_id}/
-        reveals_dir = os.path.join(GENERATED_REVEALS, product_id)
-        os.makedirs(reveals_dir, exist_ok=True)
-        reveal_paths = reveal_channels(hidden_path, output_dir=reveals_dir, prefix="")
+        # In render mode nothing is written here; serve_generated renders artifacts from the DB row
+        if not render_mode():
+            # Build everything in a scratch dir, then hand each file to the storage backend
+            staging = os.path.join(TEMP_FOLDER, f"gen_{uuid.uuid4().hex}")
+            os.makedirs(staging)
+            try:
+                qr_path = os.path.join(staging, "qr.png")
+                img = qrcode.make(qr_payload)
+                img.save(qr_path)
+
+                # Template is decoded once and cached; the QR is rendered straight into the composite
+                output_path = os.path.join(staging, "packaged.png")
+                compositor.write(template_path, qr_payload, output_path)
+
+                # Encode strip code to hidden image
+                hidden_path = os.path.join(staging, "hidden.png")
+                generate_hidden_code_image(code=pan_code, output_path=hidden_path)
+
+                # Reveals for this product: reveals/{product_id}/{color}_reveal.png
+                reveal_channels(hidden_path, output_dir=staging, prefix="")
+
+                storage = get_storage()
+                storage.put_file(f"qr/{product_id}.png", qr_path, move=True)
+                storage.put_file(packaged_key, output_path, move=True)
+                storage.put_file(hidden_key, hidden_path, move=True)
+                for color in ("red", "blue", "green"):
+                    storage.put_file(f"reveals/{product_id}/{color}_reveal.png",
+                                     os.path.join(staging, f"{color}_reveal.png"), move=True)
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
 
         # Store product_id <-> pan_code in DB first (so verification can look up even if chain fails)
-        insert_product(product_id, pan_code)
+        insert_product(product_id, pan_code, manufacturer=manufacturer, template_sha256=template_sha256,
+                       lot=lot, qr_payload=qr_payload)
+        issued.add(product_id, pan_code)
 
         tx_result = register_product(product_id)
         print("TX Result:", tx_result)
@@ -165,27 +326,26 @@ def generate_product():
         if not tx_result["success"]:
             return jsonify({"error": tx_result["error"]}), 400
 
-        def rel(full_path, subdir):
-            return f"/generated/{subdir}/{os.path.basename(full_path)}"
-
-        def rel_reveal(basename):
-            return f"/generated/reveals/{product_id}/{basename}"
+        def rel(key):
+            return f"/generated/{key}"
 
         images_payload = {
-            "packaged": rel(output_path, "packaged"),
-            "hidden": rel(hidden_path, "hidden"),
-            "red_reveal": rel_reveal("red_reveal.png"),
-            "blue_reveal": rel_reveal("blue_reveal.png"),
-            "green_reveal": rel_reveal("green_reveal.png"),
+            "packaged": rel(packaged_key),
+            "hidden": rel(hidden_key),
+            "red_reveal": rel(f"reveals/{product_id}/red_reveal.png"),
+            "blue_reveal": rel(f"reveals/{product_id}/blue_reveal.png"),
+            "green_reveal": rel(f"reveals/{product_id}/green_reveal.png"),
         }
 
         return jsonify({
             "Product ID": product_id,
             "Strip code": pan_code,
             "Manufacturer ID": manufacturer,
+            "Lot": lot,
+            "QR Signed": qr_payload != product_id,
             "Status": "Registered On-Chain",
             "Linked": "QR and strip code are mapped for this product (one identity).",
-            "Packaged Image": rel(output_path, "packaged"),
+            "Packaged Image": rel(packaged_key),
             "images": images_payload,
         }), 200
 
@@ -202,258 +362,640 @@ def generate_product():
 # 🔷 Pharmacist Verification (QR or strip, like consumer; one scan per product; connected code = flagged)
 # =====================================================
 
-@app.route("/pharmacist/verify", methods=["POST"])
+def _pharmacist_verdict(factor, decoded, scan_path=None):
+    """
+    Verdict for one pharmacist scan, as returned by /pharmacist/verify and /pharmacist/verify/code.
+    factor/decoded are what decode_scan returns (or _submitted_code for codes decoded on the client);
+    scan_path is the pack image for the packaging check, None when only the code was sent.
+    """
+    decoded, rejected = _verify_qr(factor, decoded)
+    scan_code = _scan_code(factor, decoded)
+    g.scan_event = ("pharmacist", factor, scan_code)
+    if rejected:
+        return verdicts.count(factor, scan_code, rejected)
+    # Codes already known to be counterfeit or used skip the DB and chain
+    cached = verdicts.get("pharmacist", factor, scan_code)
+    if cached:
+        return cached
+    product_id = None
+    if factor == "qr":
+        product_id = decoded
+    elif factor == "strip":
+        norm_code = _normalize_pan_code(decoded)
+        # Codes the issued-codes filter has never seen skip the DB
+        product_row = get_product_by_pan_code(norm_code) if issued.might_contain_code(norm_code) else None
+        if product_row:
+            product_id = product_row.get("product_id")
+    if not product_id:
+        return verdicts.remember("pharmacist", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "No valid QR or strip code found in image",
+        })
+
+    # Mandatory: cross-verify with products table — only manufacturer-issued codes are valid
+    # Product ID and strip code are linked; same product whether QR or strip was scanned
+    product_id_clean = str(product_id).strip()
+    product = get_product_by_id(product_id_clean) if issued.might_contain_product(product_id_clean) else None
+    if not product or (product.get("product_id") or "").strip() != product_id_clean:
+        return verdicts.remember("pharmacist", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Product not issued by manufacturer (not in products table)",
+            "Product ID": product_id_clean,
+            "Flag": "Unknown product - QR/strip not from our system",
+        })
+    product_id = (product.get("product_id") or product_id_clean).strip()
+    strip_code = product.get("pan_code") or product.get("PAN_CODE")
+
+    # Cross-verify: must be registered on blockchain
+    manufacturer = get_manufacturer(product_id)
+    if manufacturer == "0x0000000000000000000000000000000000000000":
+        # Not cached: registration may still be confirming
+        return verdicts.count(factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Not registered on blockchain",
+            "Product ID": product_id,
+            "Strip code": strip_code,
+            "Flag": "Product not on chain",
+        })
+
+    # Run AI only for full-pack image (QR path). Strip-only or QR-only crop (or no image) → skip AI, go to blockchain
+    if factor == "strip" or scan_path is None:
+        run_ai = False  # strip image is never the full pack; skip AI
+    else:
+        run_ai = not _is_likely_qr_or_strip_only(scan_path)
+    if run_ai:
+        # The template version this product was printed with, as long as it is the one anchored on chain
+        template, trusted = templates.anchored(manufacturer, product.get("template_sha256"),
+                                               chain_hashes.get(manufacturer, get_template_hash))
+        if not trusted:
+            return {
+                "Final Verdict": "UNVERIFIED",
+                "Message": "Packaging template does not match the hash registered on chain",
+                "Product ID": product_id,
+                "Strip code": strip_code,
+            }
+        if template:
+            ai_pass = verify_packaging_features(scan_path, template["features"])
+            if not ai_pass:
+                # Not cached: the verdict is about this image, not the code
+                return verdicts.count(factor, scan_code, {
+                    "Final Verdict": "COUNTERFEIT",
+                    "Reason": "Packaging check failed (AI): image does not match template",
+                    "Product ID": product_id,
+                    "Strip code": strip_code,
+                })
+
+    # One scan per product: if already verified (e.g. via QR), scanning connected strip (or vice versa) is flagged
+    duplicate = {
+        "Final Verdict": "COUNTERFEIT",
+        "Reason": "Already verified; scanning connected code (QR or strip) again is not allowed",
+        "Product ID": product_id,
+        "Strip code": strip_code,
+        "Flag": "Duplicate pharmacist scan",
+    }
+    existing = get_pharmacist_scan(product_id)
+    if existing:
+        verdicts.put_product("pharmacist", product_id, strip_code, duplicate)
+        return verdicts.count(factor, scan_code, duplicate)
+
+    state = get_product_state(product_id)
+    if state != 1:
+        return verdicts.remember("pharmacist", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Invalid product state",
+            "Product ID": product_id,
+            "Strip code": strip_code,
+        })
+
+    tx_result = verify_product(product_id)
+    if not tx_result["success"]:
+        return {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": tx_result.get("error", "Chain error"),
+            "Product ID": product_id,
+            "Strip code": strip_code,
+        }
+
+    if not record_pharmacist_scan(product_id):
+        # A concurrent request in this process claimed the first scan
+        return verdicts.count(factor, scan_code, duplicate)
+    # Any later pharmacist scan of this product (QR or strip) is a duplicate
+    verdicts.put_product("pharmacist", product_id, strip_code, duplicate)
+
+    return {
+        "Final Verdict": "GENUINE",
+        "Scan Status": "First pharmacist scan",
+        "Product ID": product_id,
+        "Strip code": strip_code,
+        "Factor": factor,
+    }
+
+
+@api.route("/pharmacist/verify", methods=["POST"])
 def pharmacist_verify():
     try:
         if "file" not in request.files or not request.files["file"].filename:
             return jsonify({"error": "No file uploaded"}), 400
 
-        file = request.files["file"]
-        scan_path = os.path.join(TEMP_FOLDER, file.filename)
-        file.save(scan_path)
-
-        # Accept either QR or strip (like consumer); one verification per product — if already scanned via one, the other is flagged
-        product_id = (extract_qr_data(scan_path) or "").strip()
-        if product_id and is_valid_product_id(product_id):
-            factor = "qr"
-        else:
-            product_id = None
-            extracted = extract_code_safe(scan_path)
-            if extracted and len(extracted) == 10:
-                norm_code = _normalize_pan_code(extracted)
-                product_row = get_product_by_pan_code(norm_code)
-                if product_row:
-                    product_id = product_row.get("product_id")
-                    factor = "strip"
-        if not product_id:
-            os.remove(scan_path)
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "No valid QR or strip code found in image",
-            }), 200
-
-        # Mandatory: cross-verify with products table — only manufacturer-issued codes are valid
-        # Product ID and strip code are linked; same product whether QR or strip was scanned
-        product_id_clean = str(product_id).strip()
-        product = get_product_by_id(product_id_clean)
-        if not product or (product.get("product_id") or "").strip() != product_id_clean:
-            os.remove(scan_path)
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "Product not issued by manufacturer (not in products table)",
-                "Product ID": product_id_clean,
-                "Flag": "Unknown product - QR/strip not from our system",
-            }), 200
-        product_id = (product.get("product_id") or product_id_clean).strip()
-        strip_code = product.get("pan_code") or product.get("PAN_CODE")
-
-        # Cross-verify: must be registered on blockchain
-        manufacturer = get_manufacturer(product_id)
-        if manufacturer == "0x0000000000000000000000000000000000000000":
-            os.remove(scan_path)
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "Not registered on blockchain",
-                "Product ID": product_id,
-                "Strip code": strip_code,
-                "Flag": "Product not on chain",
-            }), 200
-
-        # Run AI only for full-pack image (QR path). Strip-only or QR-only crop → skip AI, go to blockchain
-        if factor == "strip":
-            run_ai = False  # strip image is never the full pack; skip AI
-        else:
-            run_ai = not _is_likely_qr_or_strip_only(scan_path)
-        if run_ai:
-            template_path = os.path.join(TEMPLATE_FOLDER, f"{manufacturer}.png")
-            if not os.path.exists(template_path):
-                template_files = os.listdir(TEMPLATE_FOLDER)
-                template_path = os.path.join(TEMPLATE_FOLDER, template_files[-1]) if template_files else None
-            if template_path and os.path.exists(template_path):
-                ai_pass = verify_packaging(scan_path, template_path)
-                if not ai_pass:
-                    os.remove(scan_path)
-                    return jsonify({
-                        "Final Verdict": "COUNTERFEIT",
-                        "Reason": "Packaging check failed (AI): image does not match template",
-                        "Product ID": product_id,
-                        "Strip code": strip_code,
-                    }), 200
-        os.remove(scan_path)
-
-        # One scan per product: if already verified (e.g. via QR), scanning connected strip (or vice versa) is flagged
-        existing = get_pharmacist_scan(product_id)
-        if existing:
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "Already verified; scanning connected code (QR or strip) again is not allowed",
-                "Product ID": product_id,
-                "Strip code": strip_code,
-                "Flag": "Duplicate pharmacist scan",
-            }), 200
+        scan_path = _save_scan(request.files["file"])
+        try:
+            # Accept either QR or strip (like consumer); one verification per product — if already scanned via one, the other is flagged
+            factor, decoded = decode_scan(scan_path)
+            if factor == DECODE_TIMEOUT:
+                return _decode_timed_out()
+            return jsonify(_pharmacist_verdict(factor, decoded, scan_path)), 200
+        finally:
+            _remove_scan(scan_path)
 
-        state = get_product_state(product_id)
-        if state != 1:
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "Invalid product state",
-                "Product ID": product_id,
-                "Strip code": strip_code,
-            }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        tx_result = verify_product(product_id)
-        if not tx_result["success"]:
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": tx_result.get("error", "Chain error"),
-                "Product ID": product_id,
-                "Strip code": strip_code,
-            }), 200
 
-        record_pharmacist_scan(product_id)
+@api.route("/pharmacist/verify/code", methods=["POST"])
+def pharmacist_verify_code():
+    """
+    Same verdict as /pharmacist/verify for a code the client decoded itself: JSON {"qr": payload} or
+    {"strip": code}. Send multipart form fields instead, with the pack image as "file", when the
+    packaging check should run (full-pack photos); the image is not decoded again.
+    """
+    try:
+        submitted = _submitted_code(request.get_json(silent=True) or request.form)
+        if submitted is None:
+            return jsonify({"error": CODE_REQUIRED}), 400
 
-        return jsonify({
-            "Final Verdict": "GENUINE",
-            "Scan Status": "First pharmacist scan",
-            "Product ID": product_id,
-            "Strip code": strip_code,
-            "Factor": factor,
-        }), 200
+        file = request.files.get("file")
+        scan_path = _save_scan(file) if file and file.filename else None
+        try:
+            return jsonify(_pharmacist_verdict(*submitted, scan_path)), 200
+        finally:
+            _remove_scan(scan_path)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 # =====================================================
-# 🔷 Consumer Verification (full pack, QR only, or strip – one verification per product; second scan flagged)
+# 🔷 Pharmacist Bulk Intake (whole shipment; streamed NDJSON verdicts)
 # =====================================================
 
-@app.route("/consumer/verify", methods=["POST"])
-def consumer_verify():
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+# Uncompressed size limits for images inside .zip uploads: a few KB of zip can expand to gigabytes
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_MB", "25")) * 1024 * 1024
+BATCH_MAX_TOTAL_BYTES = int(os.getenv("BATCH_MAX_TOTAL_MB", "1024")) * 1024 * 1024
+_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+
+class BatchTooLarge(Exception):
+    pass
+
+
+def _batch_members(archive, count, total):
+    """
+    The image members of a batch zip that fit after count images (total bytes) already saved.
+    Raises BatchTooLarge before anything is extracted if one is over BATCH_MAX_FILE_BYTES or together
+    they pass BATCH_MAX_TOTAL_BYTES (file_size is the header's; zipfile never inflates past it).
+    """
+    members = []
+    for member in archive.infolist():
+        name = member.filename
+        if member.is_dir() or not name.lower().endswith(_IMAGE_EXTENSIONS):
+            continue
+        if count + len(members) >= BATCH_MAX_ITEMS:
+            break
+        if member.file_size > BATCH_MAX_FILE_BYTES:
+            raise BatchTooLarge(f"{name} is larger than {BATCH_MAX_FILE_BYTES // (1024 * 1024)} MB uncompressed")
+        total += member.file_size
+        if total > BATCH_MAX_TOTAL_BYTES:
+            raise BatchTooLarge(f"Images are larger than {BATCH_MAX_TOTAL_BYTES // (1024 * 1024)} MB uncompressed")
+        members.append(member)
+    return members, total
+
+
+def _save_batch_uploads(batch_dir):
+    """Save every uploaded image (multipart "files"/"file", or images inside .zip uploads) into batch_dir.
+    Returns a list of (original_name, saved_path)."""
+    saved = []
+    unzipped = 0
+    for f in request.files.getlist("files") + request.files.getlist("file"):
+        if not f.filename:
+            continue
+        if f.filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(f.stream) as archive:
+                members, unzipped = _batch_members(archive, len(saved), unzipped)
+                for member in members:
+                    name = member.filename
+                    path = os.path.join(batch_dir, f"{len(saved)}_{os.path.basename(name)}")
+                    with archive.open(member) as src, open(path, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    saved.append((name, path))
+        elif len(saved) < BATCH_MAX_ITEMS:
+            path = os.path.join(batch_dir, f"{len(saved)}_{os.path.basename(f.filename)}")
+            f.save(path)
+            saved.append((f.filename, path))
+    return saved
+
+
+@api.route("/pharmacist/verify/batch", methods=["POST"])
+def pharmacist_verify_batch():
+    """
+    Verify a shipment in one request. Scans are decoded in parallel, all products are resolved with one
+    DB query and one batched chain read, first scans are recorded in one transaction, and one JSON verdict
+    per scan is streamed back (application/x-ndjson) as soon as it is known.
+    """
+    batch_dir = os.path.join(TEMP_FOLDER, f"batch_{uuid.uuid4().hex}")
+    os.makedirs(batch_dir, exist_ok=True)
     try:
-        product_id = None
-        factor = None
+        uploads = _save_batch_uploads(batch_dir)
+    except zipfile.BadZipFile:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return jsonify({"error": "Invalid zip archive"}), 400
+    except BatchTooLarge as e:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return jsonify({"error": str(e)}), 413
+    if not uploads:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        return jsonify({"error": "No files uploaded"}), 400
+
+    names = {path: name for name, path in uploads}
+    scans = {}  # path -> (factor, code), for the event log
+
+    def line(path, verdict):
+        record_event("pharmacist", *scans.get(path, (None, None)), verdict)
+        return json.dumps({"File": names[path], **verdict}, default=str) + "\n"
+
+    def generate():
+        try:
+            # 1. Decode in parallel; undecodable scans, forged QRs and codes with a cached verdict are reported immediately
+            decoded = []
+            for path, factor, value in decode_scans(list(names)):
+                if factor == DECODE_TIMEOUT:
+                    # Not counted or cached: the server was busy, the pack may well be genuine
+                    yield line(path, {"Final Verdict": "UNVERIFIED", "Message": DECODE_TIMED_OUT})
+                    continue
+                value, rejected = _verify_qr(factor, value)
+                scans[path] = (factor, _scan_code(factor, value))
+                if rejected:
+                    yield line(path, verdicts.count(*scans[path], rejected))
+                    continue
+                cached = verdicts.get("pharmacist", *scans[path])
+                if cached:
+                    yield line(path, cached)
+                elif factor:
+                    decoded.append((path, factor, value))
+                else:
+                    yield line(path, {
+                        "Final Verdict": "COUNTERFEIT",
+                        "Reason": "No valid QR or strip code found in image",
+                    })
+
+            # 2. One DB query for every product id and strip code in the batch
+            # (codes the issued-codes filter has never seen are left out; they resolve to "not issued")
+            rows = get_products_for_scans(
+                product_ids=[v for _, f, v in decoded if f == "qr" and issued.might_contain_product(v)],
+                pan_codes=[c for c in (_normalize_pan_code(v) for _, f, v in decoded if f == "strip")
+                           if issued.might_contain_code(c)],
+            )
+            by_id = {(r.get("product_id") or "").strip(): r for r in rows}
+            by_code = {_normalize_pan_code(r.get("pan_code")): r for r in rows}
+
+            items = []
+            for path, factor, value in decoded:
+                product = by_id.get(value) if factor == "qr" else by_code.get(_normalize_pan_code(value))
+                if not product:
+                    yield line(path, verdicts.remember("pharmacist", factor, _scan_code(factor, value), {
+                        "Final Verdict": "COUNTERFEIT",
+                        "Reason": "Product not issued by manufacturer (not in products table)",
+                        "Product ID": value if factor == "qr" else None,
+                        "Flag": "Unknown product - QR/strip not from our system",
+                    }))
+                    continue
+                items.append((path, factor, product))
+
+            # 3. One batched chain read for manufacturer and state
+            chain = get_products_chain_info([p["product_id"].strip() for _, _, p in items])
+
+            to_verify = []
+            seen = set()
+            for path, factor, product in items:
+                product_id = product["product_id"].strip()
+                base = {"Product ID": product_id, "Strip code": product.get("pan_code")}
+                scan_code = product_id if factor == "qr" else _normalize_pan_code(product.get("pan_code"))
+                manufacturer, state = chain.get(product_id, (None, None))
+                if manufacturer in (None, "0x0000000000000000000000000000000000000000"):
+                    yield line(path, verdicts.count(factor, scan_code, {
+                        "Final Verdict": "COUNTERFEIT",
+                        "Reason": "Not registered on blockchain",
+                        "Flag": "Product not on chain",
+                        **base,
+                    }))
+                    continue
+                if factor == "qr" and not _is_likely_qr_or_strip_only(path):
+                    template, trusted = templates.anchored(manufacturer, product.get("template_sha256"),
+                                                           chain_hashes.get(manufacturer, get_template_hash))
+                    if not trusted:
+                        yield line(path, {
+                            "Final Verdict": "UNVERIFIED",
+                            "Message": "Packaging template does not match the hash registered on chain",
+                            **base,
+                        })
+                        continue
+                    if template and not verify_packaging_features(path, template["features"]):
+                        yield line(path, verdicts.count(factor, scan_code, {
+                            "Final Verdict": "COUNTERFEIT",
+                            "Reason": "Packaging check failed (AI): image does not match template",
+                            **base,
+                        }))
+                        continue
+                scanned = product.get("pharmacist_scanned_at") or scan_writer.pending_pharmacist_scan(product_id)
+                if scanned or product_id in seen:
+                    duplicate = {
+                        "Final Verdict": "COUNTERFEIT",
+                        "Reason": "Already verified; scanning connected code (QR or strip) again is not allowed",
+                        "Flag": "Duplicate pharmacist scan",
+                        **base,
+                    }
+                    if scanned:
+                        verdicts.put_product("pharmacist", product_id, base["Strip code"], duplicate)
+                    yield line(path, verdicts.count(factor, scan_code, duplicate))
+                    continue
+                seen.add(product_id)
+                if state != 1:
+                    yield line(path, verdicts.remember("pharmacist", factor, scan_code, {
+                        "Final Verdict": "COUNTERFEIT", "Reason": "Invalid product state", **base,
+                    }))
+                    continue
+                to_verify.append((path, factor, scan_code, base))
+
+            # 4. Chain writes sent back to back, then first scans recorded together (one transaction, or
+            # reserved in the write-behind buffer); products someone else recorded first are duplicates
+            tx_results = verify_products([base["Product ID"] for *_, base in to_verify])
+            confirmed = [base["Product ID"] for *_, base in to_verify if tx_results[base["Product ID"]]["success"]]
+            recorded = record_pharmacist_scans(confirmed)
+
+            for path, factor, scan_code, base in to_verify:
+                tx_result = tx_results[base["Product ID"]]
+                if not tx_result["success"]:
+                    yield line(path, {
+                        "Final Verdict": "COUNTERFEIT",
+                        "Reason": tx_result.get("error", "Chain error"),
+                        **base,
+                    })
+                    continue
+                duplicate = {
+                    "Final Verdict": "COUNTERFEIT",
+                    "Reason": "Already verified; scanning connected code (QR or strip) again is not allowed",
+                    "Flag": "Duplicate pharmacist scan",
+                    **base,
+                }
+                verdicts.put_product("pharmacist", base["Product ID"], base["Strip code"], duplicate)
+                if base["Product ID"] not in recorded:
+                    # A concurrent scan (single or another batch) recorded the first scan in the meantime
+                    yield line(path, verdicts.count(factor, scan_code, duplicate))
+                    continue
+                yield line(path, {
+                    "Final Verdict": "GENUINE",
+                    "Scan Status": "First pharmacist scan",
+                    "Factor": factor,
+                    **base,
+                })
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
-        if "file" not in request.files or not request.files["file"].filename:
-            return jsonify({"error": "Upload an image (full pack with QR, QR only, or strip) to verify"}), 400
 
-        file = request.files["file"]
-        scan_path = os.path.join(TEMP_FOLDER, file.filename)
-        file.save(scan_path)
+# =====================================================
+# 🔷 Consumer Verification (full pack, QR only, or strip – one verification per product; second scan flagged)
+# =====================================================
 
-        # Accept full package (QR visible), QR-only image, or strip-only image
-        product_id = (extract_qr_data(scan_path) or "").strip()
-        if product_id and is_valid_product_id(product_id):
-            factor = "qr"
+def _consumer_verdict(factor, decoded):
+    """Verdict for one consumer scan, as returned by /consumer/verify and /consumer/verify/code."""
+    decoded, rejected = _verify_qr(factor, decoded)
+    scan_code = _scan_code(factor, decoded)
+    g.scan_event = ("consumer", factor, scan_code)
+    if rejected:
+        return verdicts.count(factor, scan_code, rejected)
+    # Codes already known to be counterfeit or used skip the DB and chain
+    cached = verdicts.get("consumer", factor, scan_code)
+    if cached:
+        return cached
+    product_id = None
+    if factor == "qr":
+        product_id = decoded
+    elif factor == "strip":
+        norm_code = _normalize_pan_code(decoded)
+        # Codes the issued-codes filter has never seen skip the DB
+        product_row = get_product_by_pan_code(norm_code) if issued.might_contain_code(norm_code) else None
+        if product_row:
+            product_id = product_row.get("product_id")
         else:
-            product_id = None
-            extracted = extract_code_safe(scan_path)
-            if extracted and len(extracted) == 10:
-                norm_code = _normalize_pan_code(extracted)
-                product_row = get_product_by_pan_code(norm_code)
-                if product_row:
-                    product_id = product_row.get("product_id")
-                    factor = "strip"
-                else:
-                    os.remove(scan_path)
-                    return jsonify({
-                        "Final Verdict": "COUNTERFEIT",
-                        "Reason": "Strip code not issued by manufacturer (not in database)",
-                        "Flag": "Unknown strip code - not from our system",
-                    }), 200
-        if not product_id:
-            os.remove(scan_path)
-            return jsonify({
+            return verdicts.remember("consumer", factor, scan_code, {
                 "Final Verdict": "COUNTERFEIT",
-                "Reason": "No valid QR or strip code found in image",
-            }), 200
+                "Reason": "Strip code not issued by manufacturer (not in database)",
+                "Flag": "Unknown strip code - not from our system",
+            })
+    if not product_id:
+        return {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "No valid QR or strip code found in image",
+        }
 
-        try:
-            if os.path.exists(scan_path):
-                os.remove(scan_path)
-        except Exception:
-            pass
-
-        # Mandatory: cross-verify with products table — only manufacturer-issued codes are valid
-        # Product ID and strip code are linked; same product whether QR or strip was scanned
-        product_id_clean = str(product_id).strip()
-        product = get_product_by_id(product_id_clean)
-        if not product or (product.get("product_id") or "").strip() != product_id_clean:
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "Product not issued by manufacturer (not in products table)",
-                "Product ID": product_id_clean,
-                "Flag": "Unknown product - QR/strip not from our system",
-            }), 200
-        product_id = (product.get("product_id") or product_id_clean).strip()
-        strip_code = product.get("pan_code") or product.get("PAN_CODE")
-
-        # Cross-verify: must be registered on blockchain
-        if get_manufacturer(product_id) == "0x0000000000000000000000000000000000000000":
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "Not registered on blockchain",
-                "Product ID": product_id,
-                "Strip code": strip_code,
-                "Flag": "Product not on chain",
-            }), 200
+    # Mandatory: cross-verify with products table — only manufacturer-issued codes are valid
+    # Product ID and strip code are linked; same product whether QR or strip was scanned
+    product_id_clean = str(product_id).strip()
+    product = get_product_by_id(product_id_clean) if issued.might_contain_product(product_id_clean) else None
+    if not product or (product.get("product_id") or "").strip() != product_id_clean:
+        return verdicts.remember("consumer", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Product not issued by manufacturer (not in products table)",
+            "Product ID": product_id_clean,
+            "Flag": "Unknown product - QR/strip not from our system",
+        })
+    product_id = (product.get("product_id") or product_id_clean).strip()
+    strip_code = product.get("pan_code") or product.get("PAN_CODE")
+
+    # Cross-verify: must be registered on blockchain
+    if get_manufacturer(product_id) == "0x0000000000000000000000000000000000000000":
+        # Not cached: registration may still be confirming
+        return verdicts.count(factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Not registered on blockchain",
+            "Product ID": product_id,
+            "Strip code": strip_code,
+            "Flag": "Product not on chain",
+        })
+
+    pharmacist_scan = get_pharmacist_scan(product_id)
+    if not pharmacist_scan:
+        return {
+            "Final Verdict": "UNVERIFIED",
+            "Message": "Never scanned by pharmacist",
+            "Product ID": product_id,
+            "Strip code": strip_code,
+        }
 
-        pharmacist_scan = get_pharmacist_scan(product_id)
-        if not pharmacist_scan:
-            return jsonify({
-                "Final Verdict": "UNVERIFIED",
-                "Message": "Never scanned by pharmacist",
-                "Product ID": product_id,
-                "Strip code": strip_code,
-            }), 200
+    state = get_product_state(product_id)
+    if state == 1:
+        return {
+            "Final Verdict": "UNVERIFIED",
+            "Message": "Never scanned by pharmacist",
+            "Product ID": product_id,
+            "Strip code": strip_code,
+        }
 
-        state = get_product_state(product_id)
-        if state == 1:
-            return jsonify({
-                "Final Verdict": "UNVERIFIED",
-                "Message": "Never scanned by pharmacist",
-                "Product ID": product_id,
-                "Strip code": strip_code,
-            }), 200
+    # One verification per product: if already scanned (QR or strip), flag
+    duplicate = {
+        "Final Verdict": "COUNTERFEIT",
+        "Reason": "Already verified (product was previously scanned via QR or strip)",
+        "Product ID": product_id,
+        "Strip code": strip_code,
+        "Flag": "Duplicate consumer verification",
+    }
+    existing = get_any_consumer_scan(product_id)
+    if existing:
+        verdicts.put_product("consumer", product_id, strip_code, duplicate)
+        return verdicts.count(factor, scan_code, duplicate)
+
+    if not record_consumer_scan(product_id, factor):
+        return verdicts.count(factor, scan_code, duplicate)
+    verdicts.put_product("consumer", product_id, strip_code, duplicate)
+
+    return {
+        "Final Verdict": "VERIFIED",
+        "Product ID": product_id,
+        "Strip code": strip_code,
+        "Factor": factor,
+        "First Scan Time": pharmacist_scan.get("scanned_at"),
+    }
+
+
+@api.route("/consumer/verify", methods=["POST"])
+def consumer_verify():
+    try:
+        if "file" not in request.files or not request.files["file"].filename:
+            return jsonify({"error": "Upload an image (full pack with QR, QR only, or strip) to verify"}), 400
 
-        # One verification per product: if already scanned (QR or strip), flag
-        existing = get_any_consumer_scan(product_id)
-        if existing:
-            return jsonify({
-                "Final Verdict": "COUNTERFEIT",
-                "Reason": "Already verified (product was previously scanned via QR or strip)",
-                "Product ID": product_id,
-                "Strip code": strip_code,
-                "Flag": "Duplicate consumer verification",
-            }), 200
+        scan_path = _save_scan(request.files["file"])
+        try:
+            # Accept full package (QR visible), QR-only image, or strip-only image
+            factor, decoded = decode_scan(scan_path)
+        finally:
+            _remove_scan(scan_path)
+        if factor == DECODE_TIMEOUT:
+            return _decode_timed_out()
+        return jsonify(_consumer_verdict(factor, decoded)), 200
 
-        record_consumer_scan(product_id, factor)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        return jsonify({
-            "Final Verdict": "VERIFIED",
-            "Product ID": product_id,
-            "Strip code": strip_code,
-            "Factor": factor,
-            "First Scan Time": pharmacist_scan.get("scanned_at"),
-        }), 200
+
+@api.route("/consumer/verify/code", methods=["POST"])
+def consumer_verify_code():
+    """Same verdict as /consumer/verify for a code the client decoded itself: JSON {"qr": payload} or {"strip": code}."""
+    try:
+        submitted = _submitted_code(request.get_json(silent=True) or request.form)
+        if submitted is None:
+            return jsonify({"error": CODE_REQUIRED}), 400
+        return jsonify(_consumer_verdict(*submitted)), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 # =====================================================
-# 🔷 Serve QR Images
+# 🔷 Scan event log
 # =====================================================
 
-@app.route("/generated/<path:filename>")
-def serve_generated(filename):
-    """Serve generated images from backend/generated/ (qr, packaged, hidden, reveals)."""
-    return send_from_directory(GENERATED_DIR, filename)
+@api.after_request
+def _log_scan_event(response):
+    """Append the verdict of every single-scan verification to scan_events (via the scan writer)."""
+    scan = g.pop("scan_event", None)
+    if scan and response.is_json:
+        record_event(*scan, response.get_json(silent=True) or {})
+    return response
+
+
+# =====================================================
+# 🔷 Reports
+# =====================================================
+
+@api.route("/reports/hot-counterfeits", methods=["GET"])
+def hot_counterfeits():
+    """Most-submitted counterfeit codes seen by this process since it started."""
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 1000)
+    return jsonify({"Codes": verdicts.hot(limit), "Process": os.getpid()}), 200
+
+
+@api.route("/reports/scan-events", methods=["GET"])
+def scan_events_report():
+    """Verification attempts per route and verdict over the last `days` days (all processes)."""
+    days = min(max(request.args.get("days", 7, type=int), 1), 366)
+    since = datetime.utcnow() - timedelta(days=days)
+    return jsonify({"Since": since, "Summary": scan_event_summary(since)}), 200
 
 
 # =====================================================
-# 🔷 Run
+# 🔷 Serve QR Images
 # =====================================================
 
+# Artifacts never change once written (new product = new id), so clients may cache them forever
+ARTIFACT_MAX_AGE = int(os.getenv("ARTIFACT_MAX_AGE", str(365 * 24 * 3600)))
+# Hand file bodies to the front proxy: "x-accel" (nginx) or "x-sendfile" (Apache/lighttpd); empty = serve here
+ARTIFACT_SENDFILE = os.getenv("ARTIFACT_SENDFILE", "").strip().lower()
+# nginx internal location aliased to the backend working directory (see README)
+ARTIFACT_ACCEL_PREFIX = os.getenv("ARTIFACT_ACCEL_PREFIX", "/_internal/").rstrip("/")
+
+
+def _send_artifact(path, filename):
+    """Send one immutable artifact file: strong ETag, 304s, long-lived caching, optional WebP and proxy offload."""
+    # Whenever WebP could have been chosen, cached responses must be keyed on Accept
+    vary = ARTIFACT_WEBP and filename.endswith(".png")
+    if vary and "image/webp" in request.headers.get("Accept", ""):
+        path = webp_variant(path, filename) or path
+
+    response = send_file(
+        os.path.abspath(path),
+        conditional=True,
+        etag=content_etag(path),
+        max_age=ARTIFACT_MAX_AGE,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if vary:
+        response.vary.add("Accept")
+    if ARTIFACT_SENDFILE == "x-accel" and response.status_code == 200:
+        response.close()
+        response.set_data(b"")
+        response.headers["X-Accel-Redirect"] = f"{ARTIFACT_ACCEL_PREFIX}/{os.path.relpath(path).replace(os.sep, '/')}"
+    return response
+
+
+@api.route("/generated/<path:filename>")
+def serve_generated(filename):
+    """Serve generated images (qr, packaged, hidden, reveals) from the storage backend.
+    In render mode, files not stored are rendered from the product row into the artifact cache."""
+    if safe_join(GENERATED_DIR, filename) is None:
+        abort(404)
+    storage = get_storage()
+    path = storage.local_path(filename)
+    if path is None and render_mode():
+        path = get_cache().get_or_render(filename, get_product_by_id)
+    if path is None:
+        if storage.remote:
+            return redirect(storage.url(filename))
+        abort(404)
+    return _send_artifact(path, filename)
+
+
+app = create_app()
+
 if __name__ == "__main__":
+    # Development server: migrate in-process (app still runs if PostgreSQL is down)
+    try:
+        init_db()
+        print("DB: connected")
+    except psycopg2.OperationalError as e:
+        print("DB not available:", str(e))
     app.run(debug=True)
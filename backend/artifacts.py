@@ -0,0 +1,282 @@
+"""
+Render product artifacts (QR, packaged, hidden, reveals) on request instead of storing them.
+
+Every artifact is a pure function of (template, product_id, pan_code). With ARTIFACT_MODE=render,
+/manufacturer/generate stores only those inputs and serve_generated renders files on first request
+into a size-bounded LRU disk cache.
+
+The same cache holds lossless WebP variants and serving helpers (content ETags) used by
+serve_generated for both modes.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import qrcode
+from PIL import Image
+
+from qr_overlay import compositor
+from id_generation import generate_hidden_code_image
+from revealer import reveal_channels
+
+# "stored" writes every PNG at generation time (default); "render" writes none and renders on request
+ARTIFACT_MODE = os.getenv("ARTIFACT_MODE", "stored").strip().lower()
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "artifact_cache")
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Serve lossless WebP copies to clients that accept them (pixel-identical, typically 3-10x smaller)
+ARTIFACT_WEBP = os.getenv("ARTIFACT_WEBP", "1") != "0"
+
+TEMPLATE_FOLDER = "templates"
+TEMPLATE_VERSIONS = os.path.join(TEMPLATE_FOLDER, "versions")
+
+REVEAL_COLORS = ("red", "blue", "green")
+
+# Logical artifact paths, as used in /generated/<path> URLs
+_ARTIFACT_PATTERNS = [
+    ("qr", re.compile(r"^qr/(?P<product_id>[^/]+)\.png$")),
+    ("packaged", re.compile(r"^packaged/(?P<product_id>[^/]+)_packaged\.png$")),
+    ("hidden", re.compile(r"^hidden/(?P<product_id>[^/]+)_hidden\.png$")),
+    ("reveal", re.compile(r"^reveals/(?P<product_id>[^/]+)/(?P<color>red|blue|green)_reveal\.png$")),
+]
+
+
+def render_mode():
+    return ARTIFACT_MODE == "render"
+
+
+def parse_artifact_path(filename):
+    """Return (kind, product_id, color) for a logical artifact path, or None if it is not one."""
+    for kind, pattern in _ARTIFACT_PATTERNS:
+        m = pattern.match(filename)
+        if m:
+            return kind, m.group("product_id"), m.groupdict().get("color")
+    return None
+
+
+# ========== Template versions (content-addressed copies) ==========
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def template_version_path(sha256):
+    return os.path.join(TEMPLATE_VERSIONS, f"{sha256}.png")
+
+
+def store_template_version(template_path):
+    """Keep an immutable copy of the template under its SHA-256 and return the hash."""
+    sha256 = file_sha256(template_path)
+    version_path = template_version_path(sha256)
+    if not os.path.exists(version_path):
+        os.makedirs(TEMPLATE_VERSIONS, exist_ok=True)
+        tmp = f"{version_path}.{os.getpid()}.tmp"
+        shutil.copyfile(template_path, tmp)
+        os.replace(tmp, version_path)
+    return sha256
+
+
+# ========== Rendering ==========
+
+def _template_for(product):
+    """Template the product was generated with; legacy rows fall back to the manufacturer's current template."""
+    sha256 = product.get("template_sha256")
+    if sha256 and os.path.exists(template_version_path(sha256)):
+        return template_version_path(sha256)
+    manufacturer = product.get("manufacturer") or os.getenv("OWNER_ADDRESS")
+    return os.path.join(TEMPLATE_FOLDER, f"{manufacturer}.png")
+
+
+def render_artifact(kind, product, output_dir):
+    """
+    Render one artifact kind for a product row into output_dir (mirroring the generated/ layout).
+
+    Returns:
+        list: Logical paths written (reveals write all three colours at once).
+    """
+    product_id = product["product_id"]
+    # The QR carries the payload printed at generation (signed), or the bare id for older rows
+    qr_payload = product.get("qr_payload") or product_id
+    if kind == "qr":
+        rel = f"qr/{product_id}.png"
+        qrcode.make(qr_payload).save(_target(output_dir, rel))
+        return [rel]
+    if kind == "packaged":
+        rel = f"packaged/{product_id}_packaged.png"
+        if not compositor.write(_template_for(product), qr_payload, _target(output_dir, rel)):
+            raise FileNotFoundError(f"Template not available for {product_id}")
+        return [rel]
+    if kind == "hidden":
+        rel = f"hidden/{product_id}_hidden.png"
+        generate_hidden_code_image(code=product["pan_code"], output_path=_target(output_dir, rel))
+        return [rel]
+    if kind == "reveal":
+        with tempfile.TemporaryDirectory() as tmp:
+            hidden_path = os.path.join(tmp, "hidden.png")
+            generate_hidden_code_image(code=product["pan_code"], output_path=hidden_path)
+            reveals_dir = os.path.dirname(_target(output_dir, f"reveals/{product_id}/x"))
+            reveal_channels(hidden_path, output_dir=reveals_dir, prefix="")
+        return [f"reveals/{product_id}/{color}_reveal.png" for color in REVEAL_COLORS]
+    raise ValueError(f"Unknown artifact kind: {kind}")
+
+
+def _target(output_dir, rel):
+    path = os.path.join(output_dir, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+# ========== Serving ==========
+
+_etags = {}
+_etags_lock = threading.Lock()
+
+
+def content_etag(path):
+    """Strong ETag (content hash) for a file, cached by (mtime, size) so each file is hashed once."""
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    with _etags_lock:
+        cached = _etags.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+    etag = file_sha256(path)[:32]
+    with _etags_lock:
+        if len(_etags) > 50000:
+            _etags.clear()
+        _etags[path] = (key, etag)
+    return etag
+
+
+def webp_variant(path, rel):
+    """
+    Path of a lossless WebP copy of the PNG at path (logical path rel), encoding it into the artifact
+    cache on first use. Returns None when WebP is disabled or would not be smaller than the PNG.
+    """
+    if not ARTIFACT_WEBP or not rel.endswith(".png"):
+        return None
+    cache = get_cache()
+    variant_rel = f"webp/{rel}.webp"
+    variant = cache.get(variant_rel)
+    if variant is None:
+        target = _target(cache.root, variant_rel)
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with Image.open(path) as img:
+            # exact=True keeps RGB under transparent pixels; hidden strips depend on exact values
+            img.save(tmp, "WEBP", lossless=True, quality=100, method=4, exact=True)
+        os.replace(tmp, target)
+        cache.add([variant_rel])
+        variant = cache.path(variant_rel)
+    try:
+        return variant if os.path.getsize(variant) < os.path.getsize(path) else None
+    except OSError:
+        return None
+
+
+# ========== LRU disk cache ==========
+
+class ArtifactCache:
+    """
+    Size-bounded LRU cache of rendered artifacts on local disk.
+
+    Recency is tracked in memory (seeded from file mtimes at startup) and mirrored to mtime on
+    each hit, so a restarted process keeps roughly the same eviction order. With several worker
+    processes each one enforces the bound on its own view, so the limit is approximate.
+    """
+
+    def __init__(self, root=ARTIFACT_CACHE_DIR, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                found.append((st.st_mtime, os.path.relpath(path, self.root), st.st_size))
+        for _, rel, size in sorted(found):
+            self._entries[rel] = size
+            self._size += size
+
+    def path(self, rel):
+        return os.path.join(self.root, rel)
+
+    def get(self, rel):
+        """Return the cached file path and mark it recently used, or None on a miss."""
+        path = self.path(rel)
+        with self._lock:
+            if rel not in self._entries:
+                return None
+            if not os.path.exists(path):
+                self._size -= self._entries.pop(rel)
+                return None
+            self._entries.move_to_end(rel)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def add(self, rels):
+        """Account for files just written under root, then evict least recently used entries."""
+        with self._lock:
+            for rel in rels:
+                size = os.path.getsize(self.path(rel))
+                self._size += size - self._entries.pop(rel, 0)
+                self._entries[rel] = size
+            while self._size > self.max_bytes and len(self._entries) > len(rels):
+                old, size = self._entries.popitem(last=False)
+                self._size -= size
+                try:
+                    os.remove(self.path(old))
+                except OSError:
+                    pass
+
+    def get_or_render(self, filename, product_lookup):
+        """
+        Return a path for the logical artifact filename, rendering it on a miss.
+
+        product_lookup(product_id) must return the products row (dict) or None.
+        Returns None if filename is not an artifact path or the product is unknown.
+        """
+        parsed = parse_artifact_path(filename)
+        if parsed is None:
+            return None
+        hit = self.get(filename)
+        if hit:
+            return hit
+        kind, product_id, _ = parsed
+        product = product_lookup(product_id)
+        if not product:
+            return None
+        # One render at a time per process: renders are CPU-bound and concurrent misses are usually the same lot
+        with self._render_lock:
+            hit = self.get(filename)
+            if hit:
+                return hit
+            self.add(render_artifact(kind, product, self.root))
+        return self.get(filename)
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ArtifactCache()
+    return _cache
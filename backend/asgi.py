@@ -0,0 +1,454 @@
+"""
+ASGI entry point: async /consumer/verify and /pharmacist/verify (and their /code variants); every other
+route is the Flask app.
+
+  python manage.py migrate
+  uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+The verify routes wait on Postgres (asyncpg) and the Sepolia RPC (AsyncWeb3) without holding a
+thread, so one process can keep hundreds of verifications in flight. Image decoding and the
+packaging check are CPU-bound and run in a process pool (DECODE_PROCESSES, default: one per core).
+Verdicts are the same as the Flask routes in app.py, and share its per-process verdict cache.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import http_date
+
+import blockchain_async as chain
+import db_async as db
+import tracing
+from bloom import issued
+from app import (
+    CODE_REQUIRED, DECODE_TIMED_OUT, TEMP_FOLDER, _is_likely_qr_or_strip_only, _normalize_pan_code, _scan_code,
+    _submitted_code, _verify_qr, create_app,
+)
+from qr_signing import keys
+from scan_decoder import DECODE_TIMEOUT, decode_scan
+from scan_writer import SCAN_WRITE_BEHIND, record_event, writer as scan_writer
+from template_registry import chain_hashes, templates
+from verdict_cache import verdicts
+
+DECODE_PROCESSES = int(os.getenv("DECODE_PROCESSES", str(os.cpu_count() or 2)))
+# Threads the mounted Flask app gets for its (sync) routes
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+_processes = None
+# (route, factor, code) of the scan this request is verifying, for the scan_events log
+_scan_event = ContextVar("scan_event", default=None)
+
+
+# =====================================================
+# 🔷 Process pool (CPU-bound work)
+# =====================================================
+
+def _init_decode_process():
+    import cv2
+    from extractor import get_glyph_bank
+    # Parallelism comes from the pool; OpenCV's own threads would oversubscribe the cores
+    cv2.setNumThreads(1)
+    get_glyph_bank()
+
+
+def _check_packaging(scan_path, features):
+    from ai_verifier import verify_packaging_features
+    return verify_packaging_features(scan_path, features)
+
+
+async def _offload(stage, fn, *args):
+    """Run fn(*args) in the process pool and record its wall time as `stage`."""
+    start = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_processes, fn, *args)
+    finally:
+        tracing.record(stage, time.perf_counter() - start)
+
+
+# =====================================================
+# 🔷 Helpers
+# =====================================================
+
+async def _save_upload(request):
+    """Save the multipart "file" under a unique name in TEMP_FOLDER. Returns the path or None."""
+    form = await request.form()
+    file = form.get("file")
+    if file is None or not getattr(file, "filename", None):
+        return None
+    scan_path = os.path.join(TEMP_FOLDER, f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}")
+    with open(scan_path, "wb") as f:
+        f.write(await file.read())
+    return scan_path
+
+
+async def _code_body(request):
+    """Body of a /verify/code request: the JSON object, or the form fields of a multipart/urlencoded post."""
+    if "application/json" in request.headers.get("content-type", ""):
+        try:
+            return await request.json()
+        except ValueError:
+            return None
+    return await request.form()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _verdict(body, status=200):
+    scan = _scan_event.get()
+    if scan:
+        record_event(*scan, body)
+    # Datetimes formatted like Flask's jsonify, so both entry points return identical JSON
+    return JSONResponse({k: http_date(v) if hasattr(v, "timetuple") else v for k, v in body.items()}, status)
+
+
+def _decode_timed_out():
+    # Same 503 as app._decode_timed_out; not logged as a verdict
+    return JSONResponse({"error": DECODE_TIMED_OUT}, 503, headers={"Retry-After": "5"})
+
+
+async def _off_loop_if(due, fn, *args):
+    """
+    fn(*args), in a thread when due: the in-memory indexes (issued-codes filter, manufacturer keys)
+    refresh themselves from the DB with psycopg2, which would stall every request on the event loop.
+    """
+    return await asyncio.to_thread(fn, *args) if due else fn(*args)
+
+
+async def _lookup(factor, decoded):
+    """Products row for a decoded QR product id or strip code, or None."""
+    if factor == "qr":
+        product_id = str(decoded).strip()
+        if not await _off_loop_if(issued.refresh_due(), issued.might_contain_product, product_id):
+            return None
+        product = await db.get_product_by_id(product_id)
+        if product and (product.get("product_id") or "").strip() == product_id:
+            return product
+        return None
+    if factor == "strip":
+        code = _normalize_pan_code(decoded)
+        if not await _off_loop_if(issued.refresh_due(), issued.might_contain_code, code):
+            return None
+        return await db.get_product_by_pan_code(code)
+    return None
+
+
+async def _chain_template_hash(manufacturer):
+    """Template hash registered on chain for the manufacturer; cached, see template_registry.chain_hashes."""
+    hit, sha256 = chain_hashes.cached(manufacturer)
+    if not hit:
+        sha256 = await chain.get_template_hash(manufacturer)
+        chain_hashes.set(manufacturer, sha256)
+    return sha256
+
+
+async def _pharmacist_scan(product_id):
+    return scan_writer.pending_pharmacist_scan(product_id) or await db.get_pharmacist_scan(product_id)
+
+
+async def _consumer_scan(product_id):
+    return scan_writer.pending_consumer_scan(product_id) or await db.get_any_consumer_scan(product_id)
+
+
+async def _record_pharmacist_scan(product_id):
+    """Same contract as scan_writer.record_pharmacist_scan: False if this process already claimed it."""
+    if SCAN_WRITE_BEHIND:
+        return scan_writer.add_pharmacist_scan(product_id)
+    await db.record_pharmacist_scan(product_id)
+    return True
+
+
+async def _record_consumer_scan(product_id, factor):
+    if SCAN_WRITE_BEHIND:
+        return scan_writer.add_consumer_scan(product_id, factor)
+    await db.record_consumer_scan(product_id, factor)
+    return True
+
+
+# =====================================================
+# 🔷 Pharmacist Verification
+# =====================================================
+
+async def _pharmacist_verdict(factor, decoded, scan_path=None):
+    """Verdict dict for one pharmacist scan; same order of checks as app._pharmacist_verdict."""
+    decoded, rejected = await _off_loop_if(factor == "qr" and keys.refresh_due(), _verify_qr, factor, decoded)
+    scan_code = _scan_code(factor, decoded)
+    _scan_event.set(("pharmacist", factor, scan_code))
+    if rejected:
+        return verdicts.count(factor, scan_code, rejected)
+    cached = verdicts.get("pharmacist", factor, scan_code)
+    if cached:
+        return cached
+    product = await _lookup(factor, decoded)
+    if not factor or (factor == "strip" and not product):
+        return verdicts.remember("pharmacist", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "No valid QR or strip code found in image",
+        })
+    if not product:
+        return verdicts.remember("pharmacist", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Product not issued by manufacturer (not in products table)",
+            "Product ID": str(decoded).strip(),
+            "Flag": "Unknown product - QR/strip not from our system",
+        })
+    product_id = product["product_id"].strip()
+    base = {"Product ID": product_id, "Strip code": product.get("pan_code")}
+    duplicate = {
+        "Final Verdict": "COUNTERFEIT",
+        "Reason": "Already verified; scanning connected code (QR or strip) again is not allowed",
+        "Flag": "Duplicate pharmacist scan",
+        **base,
+    }
+
+    # Independent reads go out together; verdicts are still decided in the same order as app.py
+    manufacturer, existing, state = await asyncio.gather(
+        chain.get_manufacturer(product_id),
+        _pharmacist_scan(product_id),
+        chain.get_product_state(product_id),
+    )
+    if manufacturer == ZERO_ADDRESS:
+        return verdicts.count(factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Not registered on blockchain",
+            "Flag": "Product not on chain",
+            **base,
+        })
+
+    # AI only for full-pack QR scans; strip images, small crops and code-only requests go straight to the chain checks
+    if factor == "qr" and scan_path and not _is_likely_qr_or_strip_only(scan_path):
+        # In a thread: a template miss re-reads packaging_templates (psycopg2)
+        template, trusted = await asyncio.to_thread(templates.anchored, manufacturer, product.get("template_sha256"),
+                                                    await _chain_template_hash(manufacturer))
+        if not trusted:
+            return {
+                "Final Verdict": "UNVERIFIED",
+                "Message": "Packaging template does not match the hash registered on chain",
+                **base,
+            }
+        if template and not await _offload("ai.verify_packaging", _check_packaging, scan_path, template["features"]):
+            return verdicts.count(factor, scan_code, {
+                "Final Verdict": "COUNTERFEIT",
+                "Reason": "Packaging check failed (AI): image does not match template",
+                **base,
+            })
+
+    if existing:
+        verdicts.put_product("pharmacist", product_id, base["Strip code"], duplicate)
+        return verdicts.count(factor, scan_code, duplicate)
+
+    if state != 1:
+        return verdicts.remember("pharmacist", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT", "Reason": "Invalid product state", **base,
+        })
+
+    tx_result = await chain.verify_product(product_id)
+    if not tx_result["success"]:
+        return {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": tx_result.get("error", "Chain error"),
+            **base,
+        }
+
+    if not await _record_pharmacist_scan(product_id):
+        return verdicts.count(factor, scan_code, duplicate)
+    verdicts.put_product("pharmacist", product_id, base["Strip code"], duplicate)
+
+    return {
+        "Final Verdict": "GENUINE",
+        "Scan Status": "First pharmacist scan",
+        "Factor": factor,
+        **base,
+    }
+
+
+async def pharmacist_verify(request):
+    scan_path = await _save_upload(request)
+    if not scan_path:
+        return _verdict({"error": "No file uploaded"}, 400)
+    try:
+        factor, decoded = await _offload("decode", decode_scan, scan_path)
+        if factor == DECODE_TIMEOUT:
+            return _decode_timed_out()
+        return _verdict(await _pharmacist_verdict(factor, decoded, scan_path))
+    except Exception as e:
+        return _verdict({"error": str(e)}, 500)
+    finally:
+        _remove(scan_path)
+
+
+async def pharmacist_verify_code(request):
+    """Code decoded on the client (see app.pharmacist_verify_code); optional pack image for the packaging check."""
+    submitted = _submitted_code(await _code_body(request))
+    if submitted is None:
+        return _verdict({"error": CODE_REQUIRED}, 400)
+    scan_path = None
+    try:
+        if "multipart/form-data" in request.headers.get("content-type", ""):
+            scan_path = await _save_upload(request)
+        return _verdict(await _pharmacist_verdict(*submitted, scan_path))
+    except Exception as e:
+        return _verdict({"error": str(e)}, 500)
+    finally:
+        if scan_path:
+            _remove(scan_path)
+
+
+# =====================================================
+# 🔷 Consumer Verification
+# =====================================================
+
+async def _consumer_verdict(factor, decoded):
+    """Verdict dict for one consumer scan; same order of checks as app._consumer_verdict."""
+    decoded, rejected = await _off_loop_if(factor == "qr" and keys.refresh_due(), _verify_qr, factor, decoded)
+    scan_code = _scan_code(factor, decoded)
+    _scan_event.set(("consumer", factor, scan_code))
+    if rejected:
+        return verdicts.count(factor, scan_code, rejected)
+    cached = verdicts.get("consumer", factor, scan_code)
+    if cached:
+        return cached
+    if not factor:
+        return {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "No valid QR or strip code found in image",
+        }
+
+    product = await _lookup(factor, decoded)
+    if not product and factor == "strip":
+        return verdicts.remember("consumer", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Strip code not issued by manufacturer (not in database)",
+            "Flag": "Unknown strip code - not from our system",
+        })
+    if not product:
+        return verdicts.remember("consumer", factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Product not issued by manufacturer (not in products table)",
+            "Product ID": str(decoded).strip(),
+            "Flag": "Unknown product - QR/strip not from our system",
+        })
+    product_id = product["product_id"].strip()
+    base = {"Product ID": product_id, "Strip code": product.get("pan_code")}
+    duplicate = {
+        "Final Verdict": "COUNTERFEIT",
+        "Reason": "Already verified (product was previously scanned via QR or strip)",
+        "Flag": "Duplicate consumer verification",
+        **base,
+    }
+
+    manufacturer, pharmacist_scan, state, existing = await asyncio.gather(
+        chain.get_manufacturer(product_id),
+        _pharmacist_scan(product_id),
+        chain.get_product_state(product_id),
+        _consumer_scan(product_id),
+    )
+    if manufacturer == ZERO_ADDRESS:
+        return verdicts.count(factor, scan_code, {
+            "Final Verdict": "COUNTERFEIT",
+            "Reason": "Not registered on blockchain",
+            "Flag": "Product not on chain",
+            **base,
+        })
+
+    if not pharmacist_scan or state == 1:
+        return {"Final Verdict": "UNVERIFIED", "Message": "Never scanned by pharmacist", **base}
+
+    # One verification per product: if already scanned (QR or strip), flag
+    if existing:
+        verdicts.put_product("consumer", product_id, base["Strip code"], duplicate)
+        return verdicts.count(factor, scan_code, duplicate)
+
+    if not await _record_consumer_scan(product_id, factor):
+        return verdicts.count(factor, scan_code, duplicate)
+    verdicts.put_product("consumer", product_id, base["Strip code"], duplicate)
+
+    return {
+        "Final Verdict": "VERIFIED",
+        "Factor": factor,
+        "First Scan Time": pharmacist_scan.get("scanned_at"),
+        **base,
+    }
+
+
+async def consumer_verify(request):
+    scan_path = await _save_upload(request)
+    if not scan_path:
+        return _verdict({"error": "Upload an image (full pack with QR, QR only, or strip) to verify"}, 400)
+    try:
+        factor, decoded = await _offload("decode", decode_scan, scan_path)
+        if factor == DECODE_TIMEOUT:
+            return _decode_timed_out()
+        return _verdict(await _consumer_verdict(factor, decoded))
+    except Exception as e:
+        return _verdict({"error": str(e)}, 500)
+    finally:
+        _remove(scan_path)
+
+
+async def consumer_verify_code(request):
+    """Code decoded on the client (see app.consumer_verify_code); no image involved."""
+    submitted = _submitted_code(await _code_body(request))
+    if submitted is None:
+        return _verdict({"error": CODE_REQUIRED}, 400)
+    try:
+        return _verdict(await _consumer_verdict(*submitted))
+    except Exception as e:
+        return _verdict({"error": str(e)}, 500)
+
+
+# =====================================================
+# 🔷 App
+# =====================================================
+
+@asynccontextmanager
+async def lifespan(_app):
+    global _processes
+    # spawn, not fork: the event loop and its threads are already running here
+    _processes = ProcessPoolExecutor(
+        max_workers=DECODE_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_decode_process,
+    )
+    if SCAN_WRITE_BEHIND:
+        scan_writer.start()
+    # Read-only state the verify routes use (wsgi.preload for gunicorn), loaded off the event loop
+    for load in (issued.load, keys.load, templates.load):
+        await asyncio.to_thread(load)
+    try:
+        yield
+    finally:
+        _processes.shutdown(cancel_futures=True)
+        await asyncio.to_thread(scan_writer.close)
+        await db.close_pool()
+
+
+_route_middleware = [Middleware(CORSMiddleware, allow_origins=["*"]), Middleware(tracing.ASGIMiddleware)]
+
+app = Starlette(
+    routes=[
+        Route("/pharmacist/verify", pharmacist_verify, methods=["POST"], middleware=_route_middleware),
+        Route("/pharmacist/verify/code", pharmacist_verify_code, methods=["POST"], middleware=_route_middleware),
+        Route("/consumer/verify", consumer_verify, methods=["POST"], middleware=_route_middleware),
+        Route("/consumer/verify/code", consumer_verify_code, methods=["POST"], middleware=_route_middleware),
+        Mount("/", app=WSGIMiddleware(create_app(), workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
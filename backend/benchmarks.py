@@ -0,0 +1,194 @@
+"""
+Benchmarks for the steganographic encode/decode path.
+
+Measures latency and peak memory of id_generation.generate_hidden_code_image,
+revealer.reveal_channels, extractor.extract_code and qr_overlay.replace_qr (plus the cached
+QRCompositor) on the checked-in samples, saves results as JSON and compares two runs.
+
+Peak memory is resident (RSS), so OpenCV/numpy buffers count, not just the Python heap: each case
+runs once more in a fresh process and reports how far its peak RSS rose above the level reached by
+the imports. It includes one-time initialisation the case triggers (e.g. the glyph bank).
+
+Usage (from backend/):
+  python benchmarks.py run                          # writes benchmark_results/<timestamp>.json
+  python benchmarks.py run -o base.json --repeat 10
+  python benchmarks.py run --only extract
+  python benchmarks.py compare base.json new.json   # exit code 1 if anything regressed
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+RESULTS_DIR = "benchmark_results"
+# Recursive: generated/ may be in the flat or the sharded layout (storage.py)
+HIDDEN_SAMPLES = sorted(glob.glob(os.path.join("generated", "hidden", "**", "*.png"), recursive=True))
+PHOTO_SAMPLES = ["test.jpeg"] + sorted(glob.glob(os.path.join("..", "ai-auth", "samples", "*.png")))
+TEMPLATE_SAMPLES = sorted(glob.glob(os.path.join("templates", "*.png")))
+QR_SAMPLES = sorted(glob.glob(os.path.join("generated", "qr", "**", "*.png"), recursive=True))
+
+
+def _cases(tmp):
+    """Yield (name, callable) pairs; each callable runs one operation on one sample."""
+    from id_generation import generate_hidden_code_image
+    from revealer import reveal_channels
+    from extractor import extract_code
+    from qr_overlay import replace_qr, QRCompositor
+
+    yield "generate_hidden_code_image", lambda: generate_hidden_code_image(
+        code="KCSC33099D", output_path=os.path.join(tmp, "hidden.png"))
+
+    for path in HIDDEN_SAMPLES[:1]:
+        yield f"reveal_channels[{os.path.basename(path)}]", lambda path=path: reveal_channels(
+            path, output_dir=tmp, prefix="bench")
+
+    for path in HIDDEN_SAMPLES + PHOTO_SAMPLES:
+        yield f"extract_code[{os.path.basename(path)}]", lambda path=path: extract_code(path)
+
+    for template in TEMPLATE_SAMPLES[:1]:
+        for qr in QR_SAMPLES[:1]:
+            yield "replace_qr", lambda: replace_qr(template, qr, os.path.join(tmp, "packaged.png"))
+            compositor = QRCompositor()
+            yield "QRCompositor.write", lambda: compositor.write(
+                template, "MEDICINEX-19c5b270", os.path.join(tmp, "packaged.png"))
+
+
+def _status_kib(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return None
+
+
+def _peak_rss_kib(name, tmp):
+    """Run case `name` once in this (fresh) process; KiB its peak RSS rose above the post-import level."""
+    fn = dict(_cases(tmp))[name]
+    try:
+        # Linux: reset the high-water mark to the current RSS, as imports peak above their resting level
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        before = _status_kib("VmRSS")
+    except OSError:
+        before = None
+    if before is None:
+        # Elsewhere only ru_maxrss is available; it under-reports cases that stay below the import peak
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with contextlib.redirect_stdout(io.StringIO()):
+        fn()
+    peak = _status_kib("VmHWM") if sys.platform == "linux" else None
+    if peak is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak //= 1024   # bytes on macOS
+    return peak - before
+
+
+def measure(name, fn, tmp, repeat, warmup=1):
+    """Latency stats in ms over `repeat` runs, then peak RSS (KiB) of one run in a fresh process."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            fn()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append((time.perf_counter() - start) * 1000)
+    # spawn, not fork: a forked child would inherit this process's peak
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as child:
+        peak = child.submit(_peak_rss_kib, name, tmp).result()
+    return {
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.mean(times), 3),
+        "peak_rss_kib": round(peak, 1),
+        "repeat": repeat,
+    }
+
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, fn in _cases(tmp):
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(name, fn, tmp, args.repeat)
+            r = results[name]
+            print(f"{name:55s} median {r['median_ms']:10.2f} ms   peak RSS {r['peak_rss_kib']:10.1f} KiB")
+
+    output = args.output or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "results": results,
+        }, f, indent=2)
+    print("Saved:", output)
+    return 0
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)["results"]
+    with open(args.new) as f:
+        new = json.load(f)["results"]
+
+    regressions = 0
+    for name in sorted(set(base) | set(new)):
+        if name not in base or name not in new:
+            print(f"{name:55s} {'only in ' + ('new' if name in new else 'base')}")
+            continue
+        flags, changes = [], {}
+        for metric, limit in (("median_ms", args.threshold), ("peak_rss_kib", args.memory_threshold)):
+            if metric not in base[name] or metric not in new[name]:
+                # Results from before peak RSS was measured (their peak_kib was the Python heap only)
+                changes[metric] = 0.0
+                continue
+            old, cur = base[name][metric], new[name][metric]
+            changes[metric] = (cur - old) / old if old else 0.0
+            if changes[metric] > limit:
+                flags.append(f"{metric} +{changes[metric]:.0%}")
+        regressions += bool(flags)
+        print(f"{name:55s} time {changes['median_ms']:+7.1%}   mem {changes['peak_rss_kib']:+7.1%}   "
+              f"{'REGRESSION: ' + ', '.join(flags) if flags else 'ok'}")
+
+    print(f"{regressions} regression(s)")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the steganographic encode/decode path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="Run benchmarks and save JSON results")
+    p_run.add_argument("-o", "--output", help=f"Results file (default: {RESULTS_DIR}/<timestamp>.json)")
+    p_run.add_argument("--repeat", type=int, default=5)
+    p_run.add_argument("--only", help="Run only benchmarks whose name contains this string")
+    p_run.set_defaults(func=run)
+
+    p_cmp = sub.add_parser("compare", help="Compare two result files and flag regressions")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=0.10, help="Allowed median latency increase (0.10 = 10%%)")
+    p_cmp.add_argument("--memory-threshold", type=float, default=0.20, help="Allowed peak RSS increase")
+    p_cmp.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,12 @@
 from web3 import Web3
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from web3.exceptions import ContractLogicError
 
+from tracing import traced
+
 # ==============================
 # 🔷 Connect to Sepolia
 # ==============================
@@ -15,18 +19,33 @@ SEPOLIA_RPC_URL = os.getenv("SEPOLIA_RPC_URL")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 
 
-w3 = Web3(Web3.HTTPProvider(SEPOLIA_RPC_URL))
-
 # Your deployed contract address (Sepolia)
-contract_address = Web3.to_checksum_address("0xc9d80E54970558025ACE45c0751E039A533777c6")
+CONTRACT_ADDRESS = "0xc9d80E54970558025ACE45c0751E039A533777c6"
+
+# Created on first use, not at import: a pre-forking server imports this module once in the
+# master, and HTTP sessions / key material should live in each worker, not be shared across fork.
+_client = None
+_client_lock = threading.Lock()
 
-with open("abi.json") as f:
-    abi = json.load(f)
 
-contract = w3.eth.contract(address=contract_address, abi=abi)
+def get_client():
+    """Return (w3, contract, account), connecting on first call."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                w3 = Web3(Web3.HTTPProvider(SEPOLIA_RPC_URL))
+                with open("abi.json") as f:
+                    abi = json.load(f)
+                contract = w3.eth.contract(address=Web3.to_checksum_address(CONTRACT_ADDRESS), abi=abi)
+                # Derive account from private key
+                account = w3.eth.account.from_key(PRIVATE_KEY)
+                _client = (w3, contract, account)
+    return _client
 
-# Derive account from private key
-account = w3.eth.account.from_key(PRIVATE_KEY)
+
+def _contract():
+    return get_client()[1]
 
 
 # ==============================
@@ -34,27 +53,33 @@ account = w3.eth.account.from_key(PRIVATE_KEY)
 # ==============================
 
 def is_node_connected():
-    return w3.is_connected()
+    return get_client()[0].is_connected()
+
+
+def _build_signed_tx(function_call, nonce):
+    w3, _, account = get_client()
+    # Aggressive gas settings (fast confirmation)
+    max_fee = w3.to_wei(40, "gwei")        # total max fee
+    priority_fee = w3.to_wei(5, "gwei")    # miner tip
+
+    tx = function_call.build_transaction({
+        "from": account.address,
+        "nonce": nonce,
+        "gas": 300000,
+        "maxFeePerGas": max_fee,
+        "maxPriorityFeePerGas": priority_fee,
+        "chainId": 11155111  # Sepolia chain ID
+    })
+
+    return account.sign_transaction(tx)
 
 
 def safe_transact(function_call):
     try:
+        w3, _, account = get_client()
         nonce = w3.eth.get_transaction_count(account.address)
 
-        # Aggressive gas settings (fast confirmation)
-        max_fee = w3.to_wei(40, "gwei")        # total max fee
-        priority_fee = w3.to_wei(5, "gwei")    # miner tip
-
-        tx = function_call.build_transaction({
-            "from": account.address,
-            "nonce": nonce,
-            "gas": 300000,
-            "maxFeePerGas": max_fee,
-            "maxPriorityFeePerGas": priority_fee,
-            "chainId": 11155111  # Sepolia chain ID
-        })
-
-        signed_tx = account.sign_transaction(tx)
+        signed_tx = _build_signed_tx(function_call, nonce)
 
         tx_hash = w3.eth.send_raw_transaction(signed_tx.raw_transaction)
         receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
@@ -68,27 +93,110 @@ def safe_transact(function_call):
         return {"success": False, "error": str(e)}
 
 
+def safe_transact_many(function_calls):
+    """
+    Send several transactions back to back with consecutive nonces, then wait for all receipts.
+    Returns a list of {"success", "receipt" | "error"} in the same order as function_calls.
+    """
+    results = [None] * len(function_calls)
+    sent = []
+    try:
+        w3, _, account = get_client()
+        nonce = w3.eth.get_transaction_count(account.address, "pending")
+    except Exception as e:
+        return [{"success": False, "error": str(e)} for _ in function_calls]
+
+    for i, function_call in enumerate(function_calls):
+        try:
+            signed_tx = _build_signed_tx(function_call, nonce)
+            sent.append((i, w3.eth.send_raw_transaction(signed_tx.raw_transaction)))
+            nonce += 1
+        except ContractLogicError as e:
+            results[i] = {"success": False, "error": f"Contract revert: {str(e)}"}
+        except Exception as e:
+            results[i] = {"success": False, "error": str(e)}
+
+    for i, tx_hash in sent:
+        try:
+            receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+            results[i] = {"success": True, "receipt": receipt}
+        except Exception as e:
+            results[i] = {"success": False, "error": str(e)}
+
+    return results
+
+
 
 # ==============================
 # 🔷 Contract Functions
 # ==============================
 
+@traced("chain.register_product")
 def register_product(product_id):
     return safe_transact(
-        contract.functions.registerProduct(product_id)
+        _contract().functions.registerProduct(product_id)
     )
 
 
+@traced("chain.verify_product")
 def verify_product(product_id):
     return safe_transact(
-        contract.functions.verifyProduct(product_id)
+        _contract().functions.verifyProduct(product_id)
     )
 
 
+@traced("chain.get_product_state")
 def get_product_state(product_id):
-    return contract.functions.getProductState(product_id).call()
+    return _contract().functions.getProductState(product_id).call()
 
 
+@traced("chain.get_manufacturer")
 def get_manufacturer(product_id):
-    return contract.functions.getManufacturer(product_id).call()
+    return _contract().functions.getManufacturer(product_id).call()
+
+
+@traced("chain.register_template_hash")
+def register_template_hash(sha256_hex):
+    """Record the SHA-256 of this account's packaging template on chain (registerTemplateHash)."""
+    return safe_transact(
+        _contract().functions.registerTemplateHash(bytes.fromhex(sha256_hex))
+    )
+
 
+@traced("chain.get_template_hash")
+def get_template_hash(manufacturer):
+    """Template SHA-256 (hex) registered on chain for a manufacturer address, or None if there is none."""
+    value = _contract().functions.getTemplateHash(Web3.to_checksum_address(manufacturer)).call()
+    return bytes(value).hex() if any(value) else None
+
+
+@traced("chain.verify_products")
+def verify_products(product_ids):
+    """verifyProduct for many ids; returns {product_id: result} as for verify_product."""
+    ids = list(product_ids)
+    results = safe_transact_many([_contract().functions.verifyProduct(pid) for pid in ids])
+    return dict(zip(ids, results))
+
+
+@traced("chain.get_products_chain_info")
+def get_products_chain_info(product_ids):
+    """
+    Read (manufacturer, state) for many products in one JSON-RPC batch.
+    Returns {product_id: (manufacturer, state)}.
+    """
+    ids = list(dict.fromkeys(product_ids))
+    if not ids:
+        return {}
+    w3, contract, _ = get_client()
+    if hasattr(w3, "batch_requests"):
+        with w3.batch_requests() as batch:
+            for pid in ids:
+                batch.add(contract.functions.getManufacturer(pid))
+                batch.add(contract.functions.getProductState(pid))
+            results = batch.execute()
+        return {pid: (results[2 * i], results[2 * i + 1]) for i, pid in enumerate(ids)}
+    # Providers without batch support: issue the calls concurrently instead
+    with ThreadPoolExecutor(max_workers=min(16, len(ids))) as pool:
+        manufacturers = pool.map(get_manufacturer, ids)
+        states = pool.map(get_product_state, ids)
+        return dict(zip(ids, zip(manufacturers, states)))
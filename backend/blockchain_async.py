@@ -0,0 +1,81 @@
+"""
+AsyncWeb3 versions of the contract calls used by the async verify routes (asgi.py).
+
+Same contract, account and gas settings as blockchain.py. Transactions from one process are
+sent one at a time (nonce read + send under a lock) and their receipts awaited concurrently,
+so many verifications can be in flight without reusing a nonce.
+"""
+import asyncio
+import json
+
+from web3 import AsyncWeb3
+from web3.exceptions import ContractLogicError
+
+from blockchain import CONTRACT_ADDRESS, PRIVATE_KEY, SEPOLIA_RPC_URL
+from tracing import traced
+
+_client = None
+_send_lock = asyncio.Lock()
+
+
+def get_client():
+    """Return (w3, contract, account); created on first use inside the running event loop."""
+    global _client
+    if _client is None:
+        w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(SEPOLIA_RPC_URL))
+        with open("abi.json") as f:
+            abi = json.load(f)
+        contract = w3.eth.contract(address=AsyncWeb3.to_checksum_address(CONTRACT_ADDRESS), abi=abi)
+        account = w3.eth.account.from_key(PRIVATE_KEY)
+        _client = (w3, contract, account)
+    return _client
+
+
+async def safe_transact(function_call):
+    try:
+        w3, _, account = get_client()
+        async with _send_lock:
+            nonce = await w3.eth.get_transaction_count(account.address, "pending")
+            tx = await function_call.build_transaction({
+                "from": account.address,
+                "nonce": nonce,
+                "gas": 300000,
+                "maxFeePerGas": w3.to_wei(40, "gwei"),
+                "maxPriorityFeePerGas": w3.to_wei(5, "gwei"),
+                "chainId": 11155111  # Sepolia chain ID
+            })
+            signed_tx = account.sign_transaction(tx)
+            tx_hash = await w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+        receipt = await w3.eth.wait_for_transaction_receipt(tx_hash)
+        return {"success": True, "receipt": receipt}
+
+    except ContractLogicError as e:
+        return {"success": False, "error": f"Contract revert: {str(e)}"}
+
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+# ==============================
+# 🔷 Contract Functions
+# ==============================
+
+@traced("chain.verify_product")
+async def verify_product(product_id):
+    return await safe_transact(get_client()[1].functions.verifyProduct(product_id))
+
+
+@traced("chain.get_product_state")
+async def get_product_state(product_id):
+    return await get_client()[1].functions.getProductState(product_id).call()
+
+
+@traced("chain.get_manufacturer")
+async def get_manufacturer(product_id):
+    return await get_client()[1].functions.getManufacturer(product_id).call()
+
+
+@traced("chain.get_template_hash")
+async def get_template_hash(manufacturer):
+    value = await get_client()[1].functions.getTemplateHash(AsyncWeb3.to_checksum_address(manufacturer)).call()
+    return bytes(value).hex() if any(value) else None
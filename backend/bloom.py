@@ -0,0 +1,217 @@
+"""
+In-memory Bloom filter of every issued product_id and strip (PAN) code.
+
+Verify routes ask `issued` before querying Postgres: a code the filter has never seen, even after a
+refresh made for that miss, was definitely not issued, so it is reported COUNTERFEIT without a DB
+round trip. A "maybe" still goes to the DB, so false positives only cost the query we would have
+made anyway. Misses are refreshed for at most every BLOOM_MISS_REFRESH_SECONDS; misses in between
+are also a "maybe", since a code issued by another worker since the last refresh is not in the filter.
+
+The filter is loaded from products on first use (or in wsgi.preload, before fork), gets codes
+added by this process as they are generated, pulls rows created by other processes every
+BLOOM_REFRESH_SECONDS, and is rebuilt at the right size every BLOOM_REBUILD_SECONDS. Until the
+first load succeeds (e.g. DB down) every code is a "maybe".
+
+Env:
+  BLOOM_ENABLED=0            disable (every code goes to the DB)
+  BLOOM_ERROR_RATE=0.001     false-positive rate at the sized capacity
+  BLOOM_REFRESH_SECONDS=30   pull newly issued codes (ULID product ids younger than this always go to the DB)
+  BLOOM_REBUILD_SECONDS=3600 full rebuild
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import db
+from product_ids import product_id_time
+from tracing import traced
+
+BLOOM_ENABLED = os.getenv("BLOOM_ENABLED", "1") != "0"
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.001"))
+BLOOM_REFRESH_SECONDS = float(os.getenv("BLOOM_REFRESH_SECONDS", "30"))
+BLOOM_REBUILD_SECONDS = float(os.getenv("BLOOM_REBUILD_SECONDS", "3600"))
+# A miss triggers an early refresh at most this often, so codes issued by another worker a moment
+# ago are picked up; misses in between are checked against the DB instead
+BLOOM_MISS_REFRESH_SECONDS = float(os.getenv("BLOOM_MISS_REFRESH_SECONDS", "1"))
+# Refresh window overlap: created_at is set at insert, commits can land slightly out of order
+REFRESH_OVERLAP = timedelta(seconds=10)
+# Rebuilt filters leave room for this many times the current count before the error rate degrades
+HEADROOM = 2
+MIN_CAPACITY = 100_000
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing on one BLAKE2b digest)."""
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        # Bit updates are read-modify-write; a lost update would be a false negative
+        with self._lock:
+            for p in positions:
+                self.bits[p >> 3] |= 1 << (p & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+
+def _product_key(product_id):
+    return "p:" + str(product_id).strip()
+
+
+def _code_key(pan_code):
+    return "c:" + str(pan_code).strip().upper()
+
+
+class IssuedCodes:
+    """Issued product ids and strip codes, kept in sync with the products table."""
+
+    def __init__(self):
+        self._filter = None
+        self._snapshot = None       # latest created_at seen
+        self._loaded_at = 0.0
+        self._refreshed_at = 0.0
+        # Codes added locally; replayed into a rebuilt filter in case the rebuild's query missed them
+        self._recent = deque(maxlen=10000)
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def ready(self):
+        return self._filter is not None
+
+    @traced("bloom.load")
+    def load(self):
+        """(Re)build the filter from the whole products table. Returns False if the DB is unavailable."""
+        try:
+            count = db.count_products()
+            bloom = BloomFilter(max(MIN_CAPACITY, 2 * count * HEADROOM))
+            snapshot = self._add_rows(bloom, db.iter_issued_codes(), None)
+        except Exception as e:
+            print("Bloom filter not loaded:", str(e))
+            return False
+        with self._lock:
+            for key in self._recent:
+                bloom.add(key)
+            self._filter, self._snapshot = bloom, snapshot
+            self._loaded_at = self._refreshed_at = time.monotonic()
+        print(f"Bloom filter: {count} products, {len(bloom.bits) // 1024} KiB")
+        return True
+
+    @traced("bloom.refresh")
+    def refresh(self):
+        """Add products created since the last load/refresh."""
+        bloom, snapshot = self._filter, self._snapshot
+        if bloom is None:
+            return self.load()
+        try:
+            since = snapshot - REFRESH_OVERLAP if snapshot else None
+            newest = self._add_rows(bloom, db.iter_issued_codes(since=since), snapshot)
+        except Exception as e:
+            print("Bloom filter refresh failed:", str(e))
+            return False
+        with self._lock:
+            if self._filter is bloom:
+                self._snapshot = newest
+            self._refreshed_at = time.monotonic()
+        return True
+
+    @staticmethod
+    def _add_rows(bloom, rows, snapshot):
+        for product_id, pan_code, created_at in rows:
+            bloom.add(_product_key(product_id))
+            bloom.add(_code_key(pan_code))
+            if created_at and (snapshot is None or created_at > snapshot):
+                snapshot = created_at
+        return snapshot
+
+    def add(self, product_id, pan_code):
+        """Record a product issued by this process (call right after insert_product)."""
+        keys = (_product_key(product_id), _code_key(pan_code))
+        with self._lock:
+            self._recent.extend(keys)
+            if self._filter is not None:
+                for key in keys:
+                    self._filter.add(key)
+
+    def refresh_due(self):
+        """True if a miss now would refresh the filter from the DB (a blocking query; see asgi._off_loop_if)."""
+        return BLOOM_ENABLED and self._filter is not None and \
+            time.monotonic() - self._refreshed_at >= BLOOM_MISS_REFRESH_SECONDS
+
+    def _maybe(self, key):
+        if not BLOOM_ENABLED:
+            return True
+        self._ensure_started()
+        bloom = self._filter
+        if bloom is None or key in bloom:
+            return True
+        # Miss: maybe issued by another worker since the last refresh. Only a refresh that started after
+        # this scan arrived makes the miss definite; while refreshes are throttled the DB has to answer
+        # (the route then caches a confirmed "not issued", so repeats of the same code stay cheap).
+        if time.monotonic() - self._refreshed_at < BLOOM_MISS_REFRESH_SECONDS:
+            return True
+        with self._refresh_lock:
+            if time.monotonic() - self._refreshed_at < BLOOM_MISS_REFRESH_SECONDS:
+                return True   # another thread refreshed while this one waited, possibly before the insert
+            if not self.refresh():
+                # Can't confirm against the DB; let the caller query it as it would without a filter
+                return True
+        return key in self._filter
+
+    def might_contain_product(self, product_id):
+        """False only if product_id was definitely never issued."""
+        # Time-ordered ids minted since the last refresh (by any worker) may not be in the filter yet
+        created = product_id_time(product_id)
+        if created is not None:
+            now = datetime.utcnow()
+            if now - timedelta(seconds=BLOOM_REFRESH_SECONDS) - REFRESH_OVERLAP < created < now + REFRESH_OVERLAP:
+                return True
+        return self._maybe(_product_key(product_id))
+
+    def might_contain_code(self, pan_code):
+        """False only if the strip code was definitely never issued."""
+        return self._maybe(_code_key(pan_code))
+
+    def _ensure_started(self):
+        # One refresher thread per process; a forked worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="bloom-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            if self._filter is None or time.monotonic() - self._loaded_at >= BLOOM_REBUILD_SECONDS:
+                self.load()
+            else:
+                self.refresh()
+            time.sleep(BLOOM_REFRESH_SECONDS)
+
+
+issued = IssuedCodes()
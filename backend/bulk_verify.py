@@ -0,0 +1,238 @@
+"""
+Offline bulk verification of archived scans (audits, recall investigations).
+
+Walks a directory (or reads a manifest with one image path per line), decodes QR / strip codes
+and runs the packaging check in a multiprocessing pool, looks products up in bulk from the DB,
+and writes a CSV (or Parquet) report. Read-only: no scans are recorded and nothing is sent on-chain.
+QR signatures are checked as the verify routes check them (REQUIRE_SIGNED_QR included): a forged
+signed payload is COUNTERFEIT even if the product id it carries was issued. --no-db skips the check.
+
+Progress is checkpointed after every chunk, so an interrupted run resumes where it stopped.
+
+Usage (from backend/):
+  python bulk_verify.py scans/ -o report.csv
+  python bulk_verify.py manifest.txt -o report.parquet --workers 8
+  python bulk_verify.py scans/ -o report.csv --no-db
+"""
+import argparse
+import csv
+import os
+import sys
+from multiprocessing import Pool
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+TEMPLATE_FOLDER = "templates"
+# Same cut-off as app._is_likely_qr_or_strip_only: smaller images are crops and skip the packaging check
+MIN_PACK_SIDE = 400
+
+REPORT_FIELDS = [
+    "path", "factor", "decoded", "signature", "product_id", "pan_code", "manufacturer",
+    "in_db", "pharmacist_scanned_at", "packaging", "status",
+]
+
+
+def iter_images(source):
+    """Image paths from a directory (recursive, sorted) or a manifest file (one path per line)."""
+    if os.path.isdir(source):
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(dirpath, name)
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source) as f:
+            for line in f:
+                path = line.strip().split(",")[0]
+                if path and not path.startswith("#"):
+                    yield path if os.path.isabs(path) else os.path.join(base, path)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def _decode(path):
+    from scan_decoder import decode_scan
+    try:
+        factor, value = decode_scan(path)
+    except Exception:
+        factor, value = None, None
+    return path, factor, value
+
+
+def _qr_signature(payload, use_db):
+    """
+    (product id, signature status) of a QR payload, as app._verify_qr checks it. The status is
+    qr_signing.verify_signature's, or "" with --no-db (the public keys are in manufacturer_keys).
+    """
+    if not use_db:
+        from product_ids import qr_product_id
+        return qr_product_id(payload), ""
+    from qr_signing import verify_signature
+    status, product_id, _ = verify_signature(payload)
+    return product_id or payload, status
+
+
+def _check_packaging(args):
+    path, template_path = args
+    from ai_verifier import verify_packaging
+    try:
+        with Image.open(path) as img:
+            if min(img.size) < MIN_PACK_SIDE:
+                return path, "skipped"
+        return path, "pass" if verify_packaging(path, template_path) else "fail"
+    except Exception:
+        return path, "error"
+
+
+def _template_for(manufacturer, override):
+    if override:
+        return override
+    if manufacturer:
+        candidate = os.path.join(TEMPLATE_FOLDER, f"{manufacturer}.png")
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def _forged(signature):
+    if signature == "invalid":
+        return True
+    if signature == "unsigned":
+        from qr_signing import REQUIRE_SIGNED_QR
+        return REQUIRE_SIGNED_QR
+    return False
+
+
+def process_chunk(pool, paths, use_db, template_override):
+    """Decode, look up and check one chunk of images. Returns report rows in input order."""
+    from scan_decoder import DECODE_TIMEOUT
+    decoded = {path: (factor, value) for path, factor, value in pool.imap_unordered(_decode, paths)}
+    # Signed payloads carry the product id first; the report is about the product
+    signatures = {}
+    for path, (factor, value) in decoded.items():
+        if factor == "qr":
+            value, signatures[path] = _qr_signature(value, use_db)
+            decoded[path] = factor, value
+
+    products_by_id, products_by_code = {}, {}
+    if use_db:
+        from db import get_products_for_scans
+        rows = get_products_for_scans(
+            product_ids=[v for f, v in decoded.values() if f == "qr"],
+            pan_codes=[v for f, v in decoded.values() if f == "strip"],
+        )
+        products_by_id = {(r.get("product_id") or "").strip(): r for r in rows}
+        products_by_code = {(r.get("pan_code") or "").strip().upper(): r for r in rows}
+
+    report = {}
+    packaging_jobs = []
+    for path in paths:
+        factor, value = decoded[path]
+        row = dict.fromkeys(REPORT_FIELDS, "")
+        row.update(path=path, factor=factor or "", decoded=value or "")
+        if factor == DECODE_TIMEOUT:
+            # Nothing is known about this image; re-run it
+            row.update(factor="", status="DECODE_TIMEOUT")
+            report[path] = row
+            continue
+        if not factor:
+            row["status"] = "NO_CODE"
+            report[path] = row
+            continue
+        product = products_by_id.get(value) if factor == "qr" else products_by_code.get(value)
+        if product:
+            row.update(
+                product_id=product.get("product_id"),
+                pan_code=product.get("pan_code"),
+                manufacturer=product.get("manufacturer") or "",
+                in_db=True,
+                pharmacist_scanned_at=product.get("pharmacist_scanned_at") or "",
+            )
+        else:
+            row["product_id"] = value if factor == "qr" else ""
+            row["in_db"] = False if use_db else ""
+        row["signature"] = signatures.get(path, "")
+        if _forged(row["signature"]):
+            # Same verdict as the verify routes, whatever product id the forgery carries
+            row["status"] = "COUNTERFEIT"
+        elif use_db and not product:
+            row["status"] = "NOT_ISSUED"
+        else:
+            row["status"] = "DECODED"
+        template_path = _template_for(row["manufacturer"], template_override)
+        if factor == "qr" and template_path and row["status"] != "COUNTERFEIT":
+            packaging_jobs.append((path, template_path))
+        else:
+            row["packaging"] = "skipped"
+        report[path] = row
+
+    for path, outcome in pool.imap_unordered(_check_packaging, packaging_jobs):
+        report[path]["packaging"] = outcome
+        if outcome == "fail":
+            report[path]["status"] = "PACKAGING_FAIL"
+
+    return [report[path] for path in paths]
+
+
+def write_parquet(csv_path, parquet_path):
+    try:
+        import pandas as pd
+    except ImportError:
+        print("pandas/pyarrow not installed; CSV report left at", csv_path)
+        return False
+    pd.read_csv(csv_path, dtype=str, keep_default_na=False).to_parquet(parquet_path, index=False)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk offline verification of archived scans")
+    parser.add_argument("source", help="Directory of images or manifest file (one path per line)")
+    parser.add_argument("-o", "--output", default="bulk_report.csv", help="Report path (.csv or .parquet)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--template", help="Packaging template for every scan (default: per manufacturer)")
+    parser.add_argument("--no-db", action="store_true", help="Decode only; skip product lookups")
+    args = parser.parse_args(argv)
+
+    parquet = args.output.lower().endswith(".parquet")
+    csv_path = args.output[:-len(".parquet")] + ".csv" if parquet else args.output
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+
+    # Resume only when both the checkpoint and the report it describes exist
+    done = load_checkpoint(checkpoint_path) if os.path.exists(csv_path) else set()
+    new_report = not done
+    pending = [p for p in iter_images(args.source) if p not in done]
+    print(f"{len(done)} already processed, {len(pending)} to go")
+
+    with open(csv_path, "w" if new_report else "a", newline="") as report_file, \
+            open(checkpoint_path, "w" if new_report else "a") as checkpoint, \
+            Pool(args.workers) as pool:
+        writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS)
+        if new_report:
+            writer.writeheader()
+        for start in range(0, len(pending), args.chunk_size):
+            chunk = pending[start:start + args.chunk_size]
+            writer.writerows(process_chunk(pool, chunk, not args.no_db, args.template))
+            report_file.flush()
+            os.fsync(report_file.fileno())
+            # Checkpoint only after the rows are durable, so a crash never skips images
+            checkpoint.write("".join(p + "\n" for p in chunk))
+            checkpoint.flush()
+            print(f"{min(start + len(chunk), len(pending))}/{len(pending)}")
+
+    if parquet:
+        write_parquet(csv_path, args.output)
+    print("Report:", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
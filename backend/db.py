@@ -1,8 +1,11 @@
+import json
 import os
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import date, datetime
+
+from tracing import traced
 
 # Load .env from backend folder (so it works even when running from project root)
 _backend_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,6 +14,8 @@ load_dotenv(os.path.join(_backend_dir, ".env"))
 # --- Online (Supabase) connection: uncomment below and comment the line above to use .env ---
 _raw_url = os.getenv("DATABASE_URL")
 DATABASE_URL = _raw_url.strip() if (_raw_url and _raw_url.strip()) else "postgresql://localhost:5432/authentimed"
+# Monthly scan_events partitions created ahead of time by migrate (writers also create them on demand)
+SCAN_EVENT_MONTHS_AHEAD = int(os.getenv("SCAN_EVENT_MONTHS_AHEAD", "2"))
 if "supabase.com" in DATABASE_URL and "sslmode" not in DATABASE_URL:
     DATABASE_URL = DATABASE_URL + ("&" if "?" in DATABASE_URL else "?") + "sslmode=require"
 
@@ -47,6 +52,39 @@ def init_db():
         )
     """)
 
+    # Inputs needed to re-render artifacts on request (ARTIFACT_MODE=render)
+    cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS manufacturer TEXT")
+    cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS template_sha256 TEXT")
+    # Signed QR payload as printed (qr_signing.py); re-rendered artifacts must carry the same one
+    cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS lot TEXT")
+    cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS qr_payload TEXT")
+    # Incremental refresh of the in-memory issued-codes filter (bloom.py)
+    cur.execute("CREATE INDEX IF NOT EXISTS products_created_at_idx ON products (created_at)")
+
+    # Public keys that sign QR payloads, by key id (qr_signing.py)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS manufacturer_keys (
+            key_id TEXT PRIMARY KEY,
+            manufacturer TEXT NOT NULL,
+            public_key TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT (NOW() AT TIME ZONE 'utc'),
+            revoked_at TIMESTAMP
+        )
+    """)
+
+    # Packaging templates per manufacturer, one row per version, with precomputed packaging-check features
+    # (template_registry.py); the file is templates/versions/<sha256>.png
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS packaging_templates (
+            manufacturer TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            features JSONB,
+            uploaded_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+            PRIMARY KEY (manufacturer, sha256)
+        )
+    """)
+
     # Pharmacist: one scan per product (plan §3.2)
     cur.execute("""
         CREATE TABLE IF NOT EXISTS pharmacist_scans (
@@ -65,11 +103,28 @@ def init_db():
         )
     """)
 
+    # Every verification attempt, append-only; one partition per month, BRIN because rows arrive in time order
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scan_events (
+            route TEXT NOT NULL,
+            factor TEXT,
+            code TEXT,
+            product_id TEXT,
+            verdict TEXT NOT NULL,
+            reason TEXT,
+            scanned_at TIMESTAMP NOT NULL
+        ) PARTITION BY RANGE (scanned_at)
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS scan_events_scanned_at_brin ON scan_events USING BRIN (scanned_at)")
+    conn.commit()
+    ensure_scan_event_partitions(conn=conn)
+
     conn.commit()
     cur.close()
     conn.close()
 
 
+@traced("db.code_exists")
 def code_exists(code, database_url=None):
     """Return True if PAN code already exists in products (used by code_generator for uniqueness)."""
     if not code or not str(code).strip():
@@ -90,6 +145,7 @@ def insert_mapping(code, _value=None, database_url=None):
     pass
 
 
+@traced("db.record_scan")
 def record_scan(product_id):
     conn = get_connection()
     cur = conn.cursor()
@@ -117,6 +173,7 @@ def record_scan(product_id):
     conn.close()
 
 
+@traced("db.get_scan_info")
 def get_scan_info(product_id):
     conn = get_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
@@ -132,8 +189,12 @@ def get_scan_info(product_id):
 
 # ========== Products (product_id <-> pan_code) ==========
 
-def insert_product(product_id, pan_code):
-    """Store product_id and pan_code link for verification. pan_code is stored normalized (trim, upper)."""
+@traced("db.insert_product")
+def insert_product(product_id, pan_code, manufacturer=None, template_sha256=None, lot=None, qr_payload=None):
+    """
+    Store product_id and pan_code link for verification. pan_code is stored normalized (trim, upper).
+    manufacturer, template_sha256 and qr_payload record what was printed, so artifacts can be re-rendered.
+    """
     conn = get_connection()
     cur = conn.cursor()
     try:
@@ -142,8 +203,9 @@ def insert_product(product_id, pan_code):
         if not pid or not code:
             return
         cur.execute(
-            "INSERT INTO products (product_id, pan_code) VALUES (%s, %s)",
-            (pid, code)
+            "INSERT INTO products (product_id, pan_code, manufacturer, template_sha256, lot, qr_payload) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            (pid, code, manufacturer, template_sha256, lot, qr_payload)
         )
         conn.commit()
     finally:
@@ -151,8 +213,12 @@ def insert_product(product_id, pan_code):
         conn.close()
 
 
+@traced("db.get_product_by_id")
 def get_product_by_id(product_id):
-    """Get product row by product_id. Returns dict or None. Only returns a row if product was issued by manufacturer (exists in products)."""
+    """
+    Get product row by product_id. Returns dict or None. Only returns a row if product was issued by manufacturer (exists in products).
+    DB errors propagate: None means the product is definitely not issued, and callers cache that verdict.
+    """
     pid = (product_id or "").strip()
     if not pid:
         return None
@@ -164,13 +230,12 @@ def get_product_by_id(product_id):
         if row and (row.get("product_id") or "").strip() != pid:
             return None
         return row
-    except Exception:
-        return None
     finally:
         cur.close()
         conn.close()
 
 
+@traced("db.get_product_by_pan_code")
 def get_product_by_pan_code(pan_code):
     """Get product row by pan_code (for strip verification). Returns dict or None. Match is case-insensitive and trim-safe."""
     if not pan_code or not str(pan_code).strip():
@@ -186,8 +251,113 @@ def get_product_by_pan_code(pan_code):
         conn.close()
 
 
+@traced("db.count_products")
+def count_products():
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COUNT(*) FROM products")
+        return cur.fetchone()[0]
+    finally:
+        cur.close()
+        conn.close()
+
+
+def iter_issued_codes(since=None, batch_size=10000):
+    """
+    Yield (product_id, pan_code, created_at) for every product, or only those created after `since`.
+    Streams through a server-side cursor, so memory stays flat however many products there are.
+    """
+    conn = get_connection()
+    cur = conn.cursor(name="issued_codes")
+    cur.itersize = batch_size
+    try:
+        if since is None:
+            cur.execute("SELECT product_id, pan_code, created_at FROM products")
+        else:
+            cur.execute("SELECT product_id, pan_code, created_at FROM products WHERE created_at > %s", (since,))
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ========== Manufacturer QR signing keys ==========
+
+def register_manufacturer_key(key_id, manufacturer, public_key_hex):
+    """Record a QR signing public key (raw Ed25519, hex). Re-registering the same key id is a no-op."""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "INSERT INTO manufacturer_keys (key_id, manufacturer, public_key) VALUES (%s, %s, %s) "
+            "ON CONFLICT (key_id) DO NOTHING",
+            (key_id, manufacturer, public_key_hex)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@traced("db.get_manufacturer_keys")
+def get_manufacturer_keys():
+    """All QR signing keys that have not been revoked."""
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("SELECT key_id, manufacturer, public_key FROM manufacturer_keys WHERE revoked_at IS NULL")
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ========== Packaging templates ==========
+
+def insert_packaging_template(manufacturer, sha256, features):
+    """
+    Record a template upload and return its row. A new file gets the next version number for the
+    manufacturer; re-uploading an earlier version keeps its number and makes it current again.
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute(
+            "INSERT INTO packaging_templates (manufacturer, sha256, version, features) "
+            "SELECT %s, %s, COALESCE(MAX(version), 0) + 1, %s FROM packaging_templates WHERE manufacturer = %s "
+            "ON CONFLICT (manufacturer, sha256) DO UPDATE SET uploaded_at = NOW() AT TIME ZONE 'utc' "
+            "RETURNING manufacturer, sha256, version, features, uploaded_at",
+            (manufacturer, sha256, json.dumps(features), manufacturer)
+        )
+        row = cur.fetchone()
+        conn.commit()
+        return row
+    finally:
+        cur.close()
+        conn.close()
+
+
+@traced("db.get_packaging_templates")
+def get_packaging_templates():
+    """Every template version, oldest upload first (so the last row per manufacturer is its current one)."""
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute(
+            "SELECT manufacturer, sha256, version, features, uploaded_at FROM packaging_templates "
+            "ORDER BY uploaded_at, version"
+        )
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
 # ========== Pharmacist scans (one per product) ==========
 
+@traced("db.get_pharmacist_scan")
 def get_pharmacist_scan(product_id):
     """Return scan row if pharmacist already scanned this product, else None."""
     conn = get_connection()
@@ -200,6 +370,7 @@ def get_pharmacist_scan(product_id):
         conn.close()
 
 
+@traced("db.record_pharmacist_scan")
 def record_pharmacist_scan(product_id):
     """Record that a pharmacist scanned this product (one scan allowed per product)."""
     conn = get_connection()
@@ -216,8 +387,60 @@ def record_pharmacist_scan(product_id):
         conn.close()
 
 
+@traced("db.get_products_for_scans")
+def get_products_for_scans(product_ids=(), pan_codes=()):
+    """
+    Resolve many scanned codes in one query (bulk pharmacist intake).
+    Returns products rows matching any product_id or pan_code, each with pharmacist_scanned_at
+    (None if the product has not been scanned by a pharmacist yet).
+    """
+    pids = [str(p).strip() for p in product_ids if p and str(p).strip()]
+    codes = [str(c).strip().upper() for c in pan_codes if c and str(c).strip()]
+    if not pids and not codes:
+        return []
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("""
+            SELECT p.*, ps.scanned_at AS pharmacist_scanned_at
+            FROM products p
+            LEFT JOIN pharmacist_scans ps ON ps.product_id = p.product_id
+            WHERE p.product_id = ANY(%s) OR UPPER(TRIM(p.pan_code)) = ANY(%s)
+        """, (pids, codes))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@traced("db.record_pharmacist_scans")
+def record_pharmacist_scans(product_ids):
+    """Record pharmacist scans for many products in one transaction. Returns the set of product_ids inserted
+    (products that already had a scan are left untouched)."""
+    pids = list(dict.fromkeys(p for p in product_ids if p))
+    if not pids:
+        return set()
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        now = datetime.utcnow()
+        inserted = execute_values(
+            cur,
+            "INSERT INTO pharmacist_scans (product_id, scanned_at) VALUES %s "
+            "ON CONFLICT (product_id) DO NOTHING RETURNING product_id",
+            [(pid, now) for pid in pids],
+            fetch=True,
+        )
+        conn.commit()
+        return {row[0] for row in inserted}
+    finally:
+        cur.close()
+        conn.close()
+
+
 # ========== Consumer scans (one verification per product; flag if already scanned via any factor) ==========
 
+@traced("db.get_consumer_scan")
 def get_consumer_scan(product_id, factor):
     """Return scan row if consumer already scanned this product with this factor, else None."""
     conn = get_connection()
@@ -233,6 +456,7 @@ def get_consumer_scan(product_id, factor):
         conn.close()
 
 
+@traced("db.get_any_consumer_scan")
 def get_any_consumer_scan(product_id):
     """Return any existing consumer scan for this product (QR or strip). Used to allow only one verification per product."""
     conn = get_connection()
@@ -245,6 +469,7 @@ def get_any_consumer_scan(product_id):
         conn.close()
 
 
+@traced("db.record_consumer_scan")
 def record_consumer_scan(product_id, factor):
     """Record consumer scan for this product and factor (one scan per factor per product)."""
     conn = get_connection()
@@ -259,3 +484,155 @@ def record_consumer_scan(product_id, factor):
     finally:
         cur.close()
         conn.close()
+
+
+@traced("db.insert_scan_rows")
+def insert_scan_rows(pharmacist_rows=(), consumer_rows=()):
+    """
+    Write buffered scans in one transaction (scan_writer.py).
+    pharmacist_rows: (product_id, scanned_at); consumer_rows: (product_id, factor, scanned_at).
+    Rows for products that already have a scan are skipped, so flushes are idempotent.
+    """
+    if not pharmacist_rows and not consumer_rows:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        if pharmacist_rows:
+            execute_values(
+                cur,
+                "INSERT INTO pharmacist_scans (product_id, scanned_at) VALUES %s ON CONFLICT (product_id) DO NOTHING",
+                list(pharmacist_rows),
+            )
+        if consumer_rows:
+            # One consumer verification per product, whichever factor was flushed first
+            execute_values(
+                cur,
+                """
+                INSERT INTO consumer_scans (product_id, factor, scanned_at)
+                SELECT v.product_id, v.factor, v.scanned_at FROM (VALUES %s) AS v (product_id, factor, scanned_at)
+                WHERE NOT EXISTS (SELECT 1 FROM consumer_scans c WHERE c.product_id = v.product_id)
+                ON CONFLICT (product_id, factor) DO NOTHING
+                """,
+                list(consumer_rows),
+            )
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+# ========== Scan events (append-only, one partition per month) ==========
+
+_event_partitions = set()   # (year, month) partitions known to exist
+
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _create_scan_event_partition(cur, year, month):
+    end = _next_month(year, month)
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS scan_events_{year:04d}_{month:02d} PARTITION OF scan_events "
+        "FOR VALUES FROM (%s) TO (%s)",
+        (date(year, month, 1).isoformat(), date(end[0], end[1], 1).isoformat()),
+    )
+
+
+def ensure_scan_event_partitions(months_ahead=SCAN_EVENT_MONTHS_AHEAD, conn=None):
+    """Create the partitions for this month and the next months_ahead months."""
+    own = conn is None
+    conn = conn or get_connection()
+    cur = conn.cursor()
+    try:
+        today = datetime.utcnow()
+        year, month = today.year, today.month
+        for _ in range(months_ahead + 1):
+            _create_scan_event_partition(cur, year, month)
+            _event_partitions.add((year, month))
+            year, month = _next_month(year, month)
+        conn.commit()
+    finally:
+        cur.close()
+        if own:
+            conn.close()
+
+
+@traced("db.insert_scan_events")
+def insert_scan_events(rows):
+    """Append scan_events rows (route, factor, code, product_id, verdict, reason, scanned_at) in one
+    transaction, creating any missing monthly partition first."""
+    if not rows:
+        return
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        months = {(row[-1].year, row[-1].month) for row in rows} - _event_partitions
+        for year, month in sorted(months):
+            _create_scan_event_partition(cur, year, month)
+        execute_values(
+            cur,
+            "INSERT INTO scan_events (route, factor, code, product_id, verdict, reason, scanned_at) VALUES %s",
+            list(rows),
+        )
+        conn.commit()
+        _event_partitions.update(months)
+    finally:
+        cur.close()
+        conn.close()
+
+
+def list_scan_event_partitions():
+    """[(table_name, (year, month))] of existing scan_events partitions, oldest first."""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = 'scan_events'
+        """)
+        partitions = []
+        for (name,) in cur.fetchall():
+            year, month = name.rsplit("_", 2)[-2:]
+            partitions.append((name, (int(year), int(month))))
+        return sorted(partitions, key=lambda p: p[1])
+    finally:
+        cur.close()
+        conn.close()
+
+
+def archive_scan_event_partition(name, out_file=None):
+    """Detach a partition, optionally COPY it to out_file (CSV with header), then drop it."""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"ALTER TABLE scan_events DETACH PARTITION {name}")
+        if out_file is not None:
+            cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", out_file)
+        cur.execute(f"DROP TABLE {name}")
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@traced("db.scan_event_summary")
+def scan_event_summary(since, until=None):
+    """Attempts per route and verdict in [since, until); only the partitions in range are scanned."""
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        cur.execute("""
+            SELECT route, verdict, COUNT(*) AS count, COUNT(DISTINCT code) AS codes
+            FROM scan_events
+            WHERE scanned_at >= %s AND scanned_at < %s
+            GROUP BY route, verdict
+            ORDER BY route, count DESC
+        """, (since, until or datetime.utcnow()))
+        return cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
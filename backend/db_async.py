@@ -0,0 +1,99 @@
+"""
+asyncpg versions of the queries used by the async verify routes (asgi.py).
+
+Same tables and semantics as db.py; rows are returned as dicts. The pool is created on first use
+inside the running event loop and closed by close_pool() on shutdown. Tables are created by
+`python manage.py migrate`, never here.
+"""
+import asyncio
+import os
+from datetime import datetime
+
+import asyncpg
+
+from db import DATABASE_URL
+from tracing import traced
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+# Set to 0 behind a transaction-mode pooler (Supabase port 6543 / pgbouncer): it can't keep prepared statements
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "100"))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    DATABASE_URL, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                    statement_cache_size=DB_STATEMENT_CACHE,
+                )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+async def _fetchrow(query, *args):
+    pool = await get_pool()
+    row = await pool.fetchrow(query, *args)
+    return dict(row) if row else None
+
+
+# ========== Products ==========
+
+@traced("db.get_product_by_id")
+async def get_product_by_id(product_id):
+    """Product row by product_id, or None. DB errors propagate (see db.get_product_by_id)."""
+    pid = (product_id or "").strip()
+    if not pid:
+        return None
+    return await _fetchrow("SELECT * FROM products WHERE product_id = $1", pid)
+
+
+@traced("db.get_product_by_pan_code")
+async def get_product_by_pan_code(pan_code):
+    """Product row by strip code (case-insensitive, trim-safe), or None."""
+    if not pan_code or not str(pan_code).strip():
+        return None
+    return await _fetchrow("SELECT * FROM products WHERE UPPER(TRIM(pan_code)) = $1", str(pan_code).strip().upper())
+
+
+# ========== Pharmacist scans ==========
+
+@traced("db.get_pharmacist_scan")
+async def get_pharmacist_scan(product_id):
+    return await _fetchrow("SELECT * FROM pharmacist_scans WHERE product_id = $1", product_id)
+
+
+@traced("db.record_pharmacist_scan")
+async def record_pharmacist_scan(product_id):
+    pool = await get_pool()
+    await pool.execute(
+        "INSERT INTO pharmacist_scans (product_id, scanned_at) VALUES ($1, $2)",
+        product_id, datetime.utcnow(),
+    )
+
+
+# ========== Consumer scans ==========
+
+@traced("db.get_any_consumer_scan")
+async def get_any_consumer_scan(product_id):
+    return await _fetchrow("SELECT * FROM consumer_scans WHERE product_id = $1 LIMIT 1", product_id)
+
+
+@traced("db.record_consumer_scan")
+async def record_consumer_scan(product_id, factor):
+    pool = await get_pool()
+    await pool.execute(
+        "INSERT INTO consumer_scans (product_id, factor, scanned_at) VALUES ($1, $2, $3)",
+        product_id, factor, datetime.utcnow(),
+    )
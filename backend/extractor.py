@@ -61,120 +61,102 @@ segments = {
 # ===============================
 def generate_template(char):
     """Generate template exactly as encoder draws it"""
-    img_array = np.zeros((digit_height, digit_width), dtype=np.uint8)
-    
     seg = segments.get(char, [])
-    
-    for y in range(digit_height):
-        for x in range(digit_width):
-            draw = False
-            
-            # Basic segments
-            if "top" in seg and y < thickness:
-                draw = True
-            
-            if "bottom" in seg and y > digit_height - thickness:
-                draw = True
-            
-            if "middle" in seg and half_height - thickness < y < half_height + thickness:
-                draw = True
-            
-            if "left" in seg and x < thickness:
-                draw = True
-            
-            if "right" in seg and x > digit_width - thickness:
-                draw = True
-            
-            if "left_top" in seg and x < thickness and y < half_height:
-                draw = True
-            
-            if "left_bottom" in seg and x < thickness and y > half_height:
-                draw = True
-            
-            if "right_top" in seg and x > digit_width - thickness and y < half_height:
-                draw = True
-            
-            if "right_bottom" in seg and x > digit_width - thickness and y > half_height:
-                draw = True
-            
-            if "center_vertical" in seg and digit_width//2 - thickness < x < digit_width//2 + thickness:
-                draw = True
-            
-            if "right_bottom_half" in seg and x > digit_width - thickness and y > half_height:
-                draw = True
-            
-            if "right_top_half" in seg and x > digit_width - thickness and y < half_height:
-                draw = True
-            
-            # Diagonals
-            if "diagonal_z" in seg:
-                expected_x = digit_width - int((y * digit_width) / digit_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diagonal_zero" in seg:
-                expected_x = int((y * digit_width) / digit_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_r_leg" in seg and y >= half_height:
-                adjusted = y - half_height
-                expected_x = int((adjusted * digit_width) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_y_left" in seg and y <= half_height:
-                expected_x = int((y * (digit_width // 2)) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_m_right" in seg and y <= half_height:
-                expected_x = digit_width - int((y * (digit_width // 2)) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_k_top" in seg and y <= half_height:
-                expected_x = digit_width - int((y * digit_width) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_w_left" in seg and y >= half_height:
-                adjusted = y - half_height
-                expected_x = (digit_width // 2) - int((adjusted * (digit_width // 2)) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_w_right" in seg and y >= half_height:
-                adjusted = y - half_height
-                expected_x = (digit_width // 2) + int((adjusted * (digit_width // 2)) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_d_top" in seg and y <= half_height:
-                expected_x = int((y * digit_width) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_d_bottom" in seg and y >= half_height:
-                adjusted = y - half_height
-                expected_x = digit_width - int((adjusted * digit_width) / half_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_v_left" in seg:
-                expected_x = int((y * (digit_width // 2)) / digit_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if "diag_v_right" in seg:
-                expected_x = digit_width - int((y * (digit_width // 2)) / digit_height)
-                if abs(x - expected_x) < thickness:
-                    draw = True
-            
-            if draw:
-                img_array[y, x] = 255
-    
-    return img_array
+    y, x = np.mgrid[0:digit_height, 0:digit_width]
+    w, h, hh = digit_width, digit_height, half_height
+    lower = y - hh
+    draw = np.zeros((digit_height, digit_width), dtype=bool)
+
+    def near(expected_x):
+        return np.abs(x - expected_x) < thickness
+
+    # Basic segments
+    if "top" in seg:
+        draw |= y < thickness
+    if "bottom" in seg:
+        draw |= y > h - thickness
+    if "middle" in seg:
+        draw |= (hh - thickness < y) & (y < hh + thickness)
+    if "left" in seg:
+        draw |= x < thickness
+    if "right" in seg:
+        draw |= x > w - thickness
+    if "left_top" in seg:
+        draw |= (x < thickness) & (y < hh)
+    if "left_bottom" in seg:
+        draw |= (x < thickness) & (y > hh)
+    if "right_top" in seg or "right_top_half" in seg:
+        draw |= (x > w - thickness) & (y < hh)
+    if "right_bottom" in seg or "right_bottom_half" in seg:
+        draw |= (x > w - thickness) & (y > hh)
+    if "center_vertical" in seg:
+        draw |= (w // 2 - thickness < x) & (x < w // 2 + thickness)
+
+    # Diagonals (integer floor division matches the encoder's int(a / b) for non-negative values)
+    if "diagonal_z" in seg:
+        draw |= near(w - (y * w) // h)
+    if "diagonal_zero" in seg:
+        draw |= near((y * w) // h)
+    if "diag_r_leg" in seg:
+        draw |= (y >= hh) & near((lower * w) // hh)
+    if "diag_y_left" in seg:
+        draw |= (y <= hh) & near((y * (w // 2)) // hh)
+    if "diag_m_right" in seg:
+        draw |= (y <= hh) & near(w - (y * (w // 2)) // hh)
+    if "diag_k_top" in seg:
+        draw |= (y <= hh) & near(w - (y * w) // hh)
+    if "diag_w_left" in seg:
+        draw |= (y >= hh) & near((w // 2) - (lower * (w // 2)) // hh)
+    if "diag_w_right" in seg:
+        draw |= (y >= hh) & near((w // 2) + (lower * (w // 2)) // hh)
+    if "diag_d_top" in seg:
+        draw |= (y <= hh) & near((y * w) // hh)
+    if "diag_d_bottom" in seg:
+        draw |= (y >= hh) & near(w - (lower * w) // hh)
+    if "diag_v_left" in seg:
+        draw |= near((y * (w // 2)) // h)
+    if "diag_v_right" in seg:
+        draw |= near(w - (y * (w // 2)) // h)
+
+    return np.where(draw, 255, 0).astype(np.uint8)
+
+
+# ===============================
+# GLYPH BANK (templates built once per process)
+# ===============================
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+DIGITS = "0123456789"
+
+# Per position: (channel index in RGB, channel name, allowed characters), following the code_generator
+# format (4 letters + 5 digits + 1 letter). The encoder draws 'B' and '6' as the same glyph, so each
+# position must allow only one of them.
+POSITIONS = (
+    [(0, "RED", LETTERS)] * 4
+    + [(0, "RED", DIGITS)]
+    + [(2, "BLUE", DIGITS)] * 4
+    + [(1, "GREEN", LETTERS)]
+)
+
+_glyph_bank = None
+
+
+def get_glyph_bank():
+    """
+    Return (chars, templates, normalized) for every glyph.
+
+    templates: uint8 (n, digit_height, digit_width) as drawn by the encoder.
+    normalized: float32 (n, digit_height * digit_width), zero-mean and unit-norm, for correlation.
+    """
+    global _glyph_bank
+    if _glyph_bank is None:
+        chars = "".join(segments)
+        templates = np.stack([generate_template(c) for c in chars])
+        flat = templates.reshape(len(chars), -1).astype(np.float32)
+        flat -= flat.mean(axis=1, keepdims=True)
+        flat /= np.linalg.norm(flat, axis=1, keepdims=True)
+        _glyph_bank = (chars, templates, flat)
+    return _glyph_bank
+
 
 # ===============================
 # COMPARISON
@@ -190,92 +172,171 @@ def compare_with_template(char_img, template):
 # ===============================
 def match_character(char_img, allowed_chars):
     """Find best matching character"""
+    chars, templates, _ = get_glyph_bank()
     best_char = "?"
     best_score = 0.0
-    
+
     for char in allowed_chars:
-        template = generate_template(char)
+        template = templates[chars.index(char)]
         score = compare_with_template(char_img, template)
-        
+
         if score > best_score:
             best_score = score
             best_char = char
-    
+
     return best_char, best_score
 
+# ===============================
+# LOCATE AND ALIGN GLYPH BAND
+# ===============================
+BAND_WIDTH = TOTAL_CHARACTERS * digit_width + (TOTAL_CHARACTERS - 1) * spacing
+# A channel counts as ink where it exceeds the mean of the other two by this much (encoder offset is +1)
+INK_THRESHOLD = 0.5
+# Extra canonical pixels searched around the estimated band position
+ALIGN_SLACK = 3
+# Reads stop at the first position whose best correlation is below this floor ("no strip code")
+MIN_CONFIDENCE = float(os.getenv("STRIP_MIN_CONFIDENCE", "0.5"))
+# Ink bounding boxes outside this width/height range cannot be a glyph row (canonical range is ~5.9-13.6)
+BAND_ASPECT_RANGE = (4.0, 16.0)
+
+
+def _channel_excess(image):
+    """Per-channel excess over the other two channels, float32 (h, w, 3). Glyph pixels are ~+1 in their channel."""
+    rgb = np.asarray(image.convert("RGB"), dtype=np.float32)
+    total = rgb.sum(axis=2, keepdims=True)
+    return rgb - (total - rgb) / 2.0
+
+
+def _locate_band(excess):
+    """Bounding box (x0, y0, x1, y1) of the glyph band from row/column ink projections, or None."""
+    ink = (excess > INK_THRESHOLD).any(axis=2)
+    rows = ink.sum(axis=1)
+    if rows.max() == 0:
+        return None
+    band_rows = np.nonzero(rows >= max(1, rows.max() * 0.1))[0]
+    y0, y1 = band_rows[0], band_rows[-1]
+    cols = ink[y0:y1 + 1].sum(axis=0)
+    band_cols = np.nonzero(cols >= max(1, cols.max() * 0.1))[0]
+    return band_cols[0], y0, band_cols[-1], y1
+
+
+def _plausible_band(box):
+    """Cheap shape check that rejects photos whose ink box spans the whole frame."""
+    x0, y0, x1, y1 = box
+    aspect = (x1 - x0 + 1) / (y1 - y0 + 1)
+    return BAND_ASPECT_RANGE[0] <= aspect <= BAND_ASPECT_RANGE[1]
+
+
+def _resize_channels(excess, size):
+    """Resize each float channel to size=(width, height) (bilinear, no 8-bit quantisation)."""
+    if (excess.shape[1], excess.shape[0]) == size:
+        return excess
+    return np.stack([
+        np.asarray(Image.fromarray(np.ascontiguousarray(excess[:, :, c])).resize(size, Image.BILINEAR))
+        for c in range(3)
+    ], axis=2)
+
+
+def _score_offsets(canvas, offsets, positions):
+    """
+    Correlate the given cell positions at every candidate band origin against the glyph bank
+    in one matrix product. Glyphs not allowed at a position score -inf.
+
+    Returns float32 (len(offsets), len(positions), n_glyphs) of normalized correlations.
+    """
+    chars, _, bank = get_glyph_bank()
+    cells = np.empty((len(offsets), len(positions), digit_height * digit_width), dtype=np.float32)
+    for i, (ox, oy) in enumerate(offsets):
+        for j, pos in enumerate(positions):
+            x = ox + pos * (digit_width + spacing)
+            cells[i, j] = canvas[oy:oy + digit_height, x:x + digit_width, POSITIONS[pos][0]].ravel()
+    cells -= cells.mean(axis=2, keepdims=True)
+    norms = np.linalg.norm(cells, axis=2, keepdims=True)
+    cells /= np.where(norms > 0, norms, 1.0)
+    allowed = np.array([[c in POSITIONS[pos][2] for c in chars] for pos in positions])
+    return np.where(allowed[None], cells @ bank.T, -np.inf)
+
+
+def decode_strip(image_path, min_confidence=None):
+    """
+    Decode the strip code from an image that may be cropped, resized or offset.
+
+    The glyph band is located by channel-excess projection profiles, rescaled to the
+    canonical cell size, and aligned by searching a small offset window for the best
+    total correlation with the glyph bank. Position 0 is scored first so images with
+    no glyph there are rejected before the remaining positions are computed.
+
+    Args:
+        image_path: Path to the image.
+        min_confidence: Per-character floor (default MIN_CONFIDENCE); 0 disables gating.
+
+    Returns:
+        tuple: (code, confidences) where confidences is a list of per-character
+               normalized correlations in [-1, 1], or (None, None) if there is no
+               strip code (no plausible band, or a position below the floor).
+    """
+    floor = MIN_CONFIDENCE if min_confidence is None else min_confidence
+
+    with Image.open(image_path) as img:
+        excess = _channel_excess(img)
+
+    box = _locate_band(excess)
+    if box is None or not _plausible_band(box):
+        return None, None
+    x0, y0, x1, y1 = box
+
+    # Ink extents never exceed the cell grid, so the larger ratio is the best scale estimate
+    scale = max((y1 - y0 + 1) / digit_height, (x1 - x0 + 1) / BAND_WIDTH)
+    height, width = excess.shape[:2]
+    canvas = _resize_channels(excess, (max(1, round(width / scale)), max(1, round(height / scale))))
+    cx0, cy0 = int(x0 / scale), int(y0 / scale)
+    cx1, cy1 = int(x1 / scale), int(y1 / scale)
+
+    # The band origin lies between (ink end - band size) and ink start, within the canvas
+    canvas_h, canvas_w = canvas.shape[:2]
+    xs = range(max(0, cx1 - BAND_WIDTH + 1 - ALIGN_SLACK), min(canvas_w - BAND_WIDTH, cx0 + ALIGN_SLACK) + 1)
+    ys = range(max(0, cy1 - digit_height + 1 - ALIGN_SLACK), min(canvas_h - digit_height, cy0 + ALIGN_SLACK) + 1)
+    offsets = [(ox, oy) for oy in ys for ox in xs]
+    if not offsets:
+        return None, None
+
+    first = _score_offsets(canvas, offsets, [0])
+    if first.max() < floor:
+        return None, None
+    rest = _score_offsets(canvas, offsets, range(1, TOTAL_CHARACTERS))
+    scores = np.concatenate([first, rest], axis=1)
+    best = scores.max(axis=2)
+    winner = int(np.argmax(best.sum(axis=1)))
+
+    chars, _, _ = get_glyph_bank()
+    code = ""
+    for pos, glyph in enumerate(scores[winner].argmax(axis=1)):
+        if best[winner, pos] < floor:
+            return None, None
+        code += chars[glyph]
+    return code, [float(c) for c in best[winner]]
+
+
 # ===============================
 # EXTRACT CODE
 # ===============================
-def extract_code(image_path):
-    """Extract code from steganographic image"""
-    
-    # Load image
-    img = Image.open(image_path)
-    pixels = img.load()
-    width, height = img.size
-    
-    # Calculate positions
-    total_width = TOTAL_CHARACTERS * digit_width + (TOTAL_CHARACTERS - 1) * spacing
-    start_x = (width - total_width) // 2
-    start_y = (height - digit_height) // 2
-    
-    extracted_code = ""
-    
-    LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-    DIGITS = "0123456789"
-    
+def extract_code_with_confidence(image_path):
+    """Extract code and per-character confidences without the confidence floor; see decode_strip."""
+    code, confidences = decode_strip(image_path, min_confidence=0.0)
+    if code is None:
+        return "?" * TOTAL_CHARACTERS, [0.0] * TOTAL_CHARACTERS
+
     print("\nExtracting code...")
     print("-" * 60)
-    
-    # Process each character position
-    for char_idx in range(10):
-        # Determine channel and allowed characters
-        if char_idx < 5:  # First 5: VANC2 (RED)
-            channel_idx = 0
-            allowed = LETTERS + DIGITS  # Can be letters or digits
-            channel_name = "RED"
-        elif char_idx < 9:  # Next 4: 0015 (BLUE)
-            channel_idx = 2
-            allowed = DIGITS
-            channel_name = "BLUE"
-        else:  # Last 1: V (GREEN)
-            channel_idx = 1
-            allowed = LETTERS
-            channel_name = "GREEN"
-        
-        # Calculate character position
-        x_offset = start_x + char_idx * (digit_width + spacing)
-        
-        # Extract character pixels from correct channel
-        char_pixels = []
-        for y in range(start_y, start_y + digit_height):
-            row = []
-            for x in range(x_offset, x_offset + digit_width):
-                r, g, b = pixels[x, y]
-                
-                # Select correct channel
-                if channel_idx == 0:
-                    val = r
-                elif channel_idx == 1:
-                    val = g
-                else:
-                    val = b
-                
-                # Threshold
-                row.append(255 if val > base_color else 0)
-            char_pixels.append(row)
-        
-        # Convert to numpy
-        char_img = np.array(char_pixels, dtype=np.uint8)
-        
-        # Match character
-        detected_char, score = match_character(char_img, allowed)
-        
-        print(f"Position {char_idx} ({channel_name}): '{detected_char}' (confidence: {score:.1%})")
-        
-        extracted_code += detected_char
-    
-    return extracted_code
+    for char_idx, (char, score) in enumerate(zip(code, confidences)):
+        print(f"Position {char_idx} ({POSITIONS[char_idx][1]}): '{char}' (confidence: {score:.1%})")
+    return code, confidences
+
+
+def extract_code(image_path):
+    """Extract code from steganographic image"""
+    code, _ = extract_code_with_confidence(image_path)
+    return code
 
 
 def extract_code_safe(image_path):
@@ -288,7 +349,6 @@ def extract_code_safe(image_path):
     except (FileNotFoundError, OSError, Exception):
         return None
 
-
 # ===============================
 # MAIN
 # ===============================
@@ -0,0 +1,36 @@
+"""
+gunicorn settings for the Flask backend:  gunicorn -c gunicorn.conf.py wsgi:app
+
+Worker model: one process per core for CPU-bound decoding (OpenCV/numpy), each with a pool of
+threads so requests blocked on Postgres or the chain RPC (receipts take seconds) don't hold a
+whole process. Every setting can be overridden from the environment.
+"""
+import os
+
+_cores = os.cpu_count() or 2
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(_cores)))
+worker_class = "gthread"
+# Request threads per worker: mostly waiting on IO, so more than cores is fine
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Chain writes wait for a receipt; don't let the arbiter kill workers mid-transaction
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so fragmentation from large image buffers doesn't accumulate
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+
+# Import the app (and wsgi.preload) once in the master; workers inherit it copy-on-write
+preload_app = True
+
+# Decode threads per worker: split the cores between workers instead of giving each worker all of
+# them. decode_scan runs QR and strip stages side by side, so keep at least 2.
+os.environ.setdefault("DECODE_WORKERS", str(max(2, _cores // workers)))
+
+
+def post_fork(server, worker):
+    # OpenCV's own thread pool would multiply with workers x decode threads; keep it per-call serial
+    import cv2
+    cv2.setNumThreads(int(os.getenv("OPENCV_THREADS", "1")))
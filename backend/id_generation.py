@@ -3,6 +3,7 @@ Generate steganographic PAN-format hidden code image (10 chars: 4 letters + 5 di
 Uses code_generator for unique, DB-backed codes when code is not provided.
 """
 from PIL import Image
+import numpy as np
 import os
 from datetime import datetime
 
@@ -18,46 +19,6 @@ DIGIT_HEIGHT = 100
 SPACING = 20
 HALF_HEIGHT = DIGIT_HEIGHT // 2
 
-SEGMENTS = {
-    "0": ["top", "bottom", "left", "right", "diagonal_z"],
-    "1": ["right"],
-    "2": ["top", "middle", "bottom", "right_top", "left_bottom"],
-    "3": ["top", "middle", "bottom", "right"],
-    "4": ["middle", "left_top", "right"],
-    "5": ["top", "middle", "bottom", "left_top", "right_bottom"],
-    "6": ["top", "middle", "bottom", "left", "right_bottom"],
-    "7": ["top", "right"],
-    "8": ["top", "middle", "bottom", "left", "right"],
-    "9": ["top", "middle", "bottom", "left_top", "right"],
-
-    "A": ["top", "middle", "left", "right"],
-    "B": ["top", "middle", "bottom", "left", "iso_b_top", "right_bottom_half"],
-    "C": ["top", "bottom", "left"],
-    "D": ["left", "diag_d_top", "diag_d_bottom"],
-    "E": ["top", "middle", "bottom", "left"],
-    "F": ["top", "middle", "left"],
-    "G": ["top", "bottom", "left", "right_bottom"],
-    "H": ["middle", "left", "right"],
-    "I": ["top", "bottom", "center_vertical"],
-    "J": ["bottom", "right"],
-    "K": ["left", "diag_k_top", "diag_r_leg"],
-    "L": ["bottom", "left"],
-    "M": ["left", "right", "diag_m_right", "diag_y_left"],
-    "N": ["left", "right", "diagonal_zero"],
-    "O": ["top", "bottom", "left", "right"],
-    "P": ["top", "middle", "left", "right_top"],
-    "Q": ["top", "bottom", "left", "right", "diag_w_right"],
-    "R": ["top", "middle", "left", "right_top_half", "diag_r_leg"],
-    "S": ["top", "bottom", "diagonal_zero"],
-    "T": ["top", "center_vertical"],
-    "U": ["bottom", "left", "right"],
-    "V": ["diag_v_right", "diag_v_left"],
-    "W": ["left", "right", "diag_w_left", "diag_w_right"],
-    "X": ["diagonal_z", "diagonal_zero"],
-    "Y": ["diag_y_left", "diagonal_z"],
-    "Z": ["top", "bottom", "diagonal_z"]
-}
-
 
 def _validate_code(code):
     """Validate code format: 4 letters + 5 digits + 1 letter, 10 chars total."""
@@ -68,102 +29,32 @@ def _validate_code(code):
     return code.upper()
 
 
-def _draw_character(pixels, x_offset, char, channel, start_y):
-    thickness = 6
-    seg = SEGMENTS.get(char, [])
-
-    for x in range(x_offset, x_offset + DIGIT_WIDTH):
-        for y in range(start_y, start_y + DIGIT_HEIGHT):
-            relative_x = x - x_offset
-            relative_y = y - start_y
-            draw = False
-
-            if "top" in seg and relative_y < thickness:
-                draw = True
-            if "bottom" in seg and relative_y > DIGIT_HEIGHT - thickness:
-                draw = True
-            if "middle" in seg and HALF_HEIGHT - thickness < relative_y < HALF_HEIGHT + thickness:
-                draw = True
-            if "left" in seg and relative_x < thickness:
-                draw = True
-            if "right" in seg and relative_x > DIGIT_WIDTH - thickness:
-                draw = True
-            if "left_top" in seg and relative_x < thickness and relative_y < HALF_HEIGHT:
-                draw = True
-            if "left_bottom" in seg and relative_x < thickness and relative_y > HALF_HEIGHT:
-                draw = True
-            if "right_top" in seg and relative_x > DIGIT_WIDTH - thickness and relative_y < HALF_HEIGHT:
-                draw = True
-            if "right_bottom" in seg and relative_x > DIGIT_WIDTH - thickness and relative_y > HALF_HEIGHT:
-                draw = True
-            if "center_vertical" in seg and DIGIT_WIDTH // 2 - thickness < relative_x < DIGIT_WIDTH // 2 + thickness:
-                draw = True
-            if "right_bottom_half" in seg and relative_x > DIGIT_WIDTH - thickness and relative_y > HALF_HEIGHT:
-                draw = True
-            if "right_top_half" in seg and relative_x > DIGIT_WIDTH - thickness and relative_y < HALF_HEIGHT:
-                draw = True
-
-            if "diagonal_z" in seg:
-                expected_x = DIGIT_WIDTH - int((relative_y * DIGIT_WIDTH) / DIGIT_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diagonal_zero" in seg:
-                expected_x = int((relative_y * DIGIT_WIDTH) / DIGIT_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_r_leg" in seg and relative_y >= HALF_HEIGHT:
-                adjusted = relative_y - HALF_HEIGHT
-                expected_x = int((adjusted * DIGIT_WIDTH) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_y_left" in seg and relative_y <= HALF_HEIGHT:
-                expected_x = int((relative_y * (DIGIT_WIDTH // 2)) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_m_right" in seg and relative_y <= HALF_HEIGHT:
-                expected_x = DIGIT_WIDTH - int((relative_y * (DIGIT_WIDTH // 2)) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_k_top" in seg and relative_y <= HALF_HEIGHT:
-                expected_x = DIGIT_WIDTH - int((relative_y * DIGIT_WIDTH) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_w_left" in seg and relative_y >= HALF_HEIGHT:
-                adjusted = relative_y - HALF_HEIGHT
-                expected_x = (DIGIT_WIDTH // 2) - int((adjusted * (DIGIT_WIDTH // 2)) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_w_right" in seg and relative_y >= HALF_HEIGHT:
-                adjusted = relative_y - HALF_HEIGHT
-                expected_x = (DIGIT_WIDTH // 2) + int((adjusted * (DIGIT_WIDTH // 2)) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_d_top" in seg and relative_y <= HALF_HEIGHT:
-                expected_x = int((relative_y * DIGIT_WIDTH) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_d_bottom" in seg and relative_y >= HALF_HEIGHT:
-                adjusted = relative_y - HALF_HEIGHT
-                expected_x = DIGIT_WIDTH - int((adjusted * DIGIT_WIDTH) / HALF_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_v_left" in seg:
-                expected_x = int((relative_y * (DIGIT_WIDTH // 2)) / DIGIT_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-            if "diag_v_right" in seg:
-                expected_x = DIGIT_WIDTH - int((relative_y * (DIGIT_WIDTH // 2)) / DIGIT_HEIGHT)
-                if abs(relative_x - expected_x) < thickness:
-                    draw = True
-
-            if draw:
-                r, g, b = pixels[x, y]
-                if channel == "red":
-                    pixels[x, y] = (r + RED_OFFSET, g, b)
-                elif channel == "blue":
-                    pixels[x, y] = (r, g, b + BLUE_OFFSET)
-                else:
-                    pixels[x, y] = (r, g + GREEN_OFFSET, b)
+def render_hidden_index(code):
+    """
+    Draw the code as a palette-index map (SIZE x SIZE uint8): 0 = BASE_COLOR, 1/2/3 = the red, blue
+    and green offsets. Glyph shapes come from extractor's glyph bank, so encoder and decoder share
+    one definition.
+    """
+    from extractor import get_glyph_bank
+    chars, templates, _ = get_glyph_bank()
+
+    index = np.zeros((SIZE, SIZE), dtype=np.uint8)
+    total_width = 10 * DIGIT_WIDTH + 9 * SPACING
+    start_x = (SIZE - total_width) // 2
+    start_y = (SIZE - DIGIT_HEIGHT) // 2
+
+    for i, char in enumerate(code):
+        x_position = start_x + i * (DIGIT_WIDTH + SPACING)
+        value = 1 if i < 5 else 2 if i < 9 else 3
+        cell = index[start_y:start_y + DIGIT_HEIGHT, x_position:x_position + DIGIT_WIDTH]
+        cell[templates[chars.index(char)] > 0] = value
+    return index
+
+
+def hidden_palette():
+    """RGB palette for render_hidden_index: base, red, blue, green."""
+    r, g, b = BASE_COLOR
+    return [(r, g, b), (r + RED_OFFSET, g, b), (r, g, b + BLUE_OFFSET), (r, g + GREEN_OFFSET, b)]
 
 
 def generate_hidden_code_image(code=None, output_path=None, database_url=None):
@@ -186,28 +77,16 @@ def generate_hidden_code_image(code=None, output_path=None, database_url=None):
 
     code = _validate_code(code)
 
-    width = height = SIZE
-    img = Image.new("RGB", (width, height), BASE_COLOR)
-    pixels = img.load()
-
-    total_width = 10 * DIGIT_WIDTH + 9 * SPACING
-    start_x = (width - total_width) // 2
-    start_y = (height - DIGIT_HEIGHT) // 2
-
-    for i, char in enumerate(code):
-        x_position = start_x + i * (DIGIT_WIDTH + SPACING)
-        if i < 5:
-            _draw_character(pixels, x_position, char, "red", start_y)
-        elif i < 9:
-            _draw_character(pixels, x_position, char, "blue", start_y)
-        else:
-            _draw_character(pixels, x_position, char, "green", start_y)
+    # Four colours only: stored as a 2-bit indexed PNG (decoders convert to RGB, so it reads
+    # exactly like the old 24-bit RGB file at a fraction of the size)
+    img = Image.fromarray(render_hidden_index(code), "P")
+    img.putpalette([c for color in hidden_palette() for c in color])
 
     if output_path is None:
         os.makedirs("generated/hidden", exist_ok=True)
         stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_path = os.path.join("generated", "hidden", f"hidden_pan_format_{stamp}.png")
-    img.save(output_path)
+    img.save(output_path, optimize=True)
     return code, output_path
 
 
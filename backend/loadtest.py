@@ -0,0 +1,481 @@
+"""
+End-to-end load test for /manufacturer/generate, /pharmacist/verify and /consumer/verify.
+
+Boots the Flask app on a local threaded server with in-process stand-ins for the db.py and
+blockchain.py APIs (configurable latency), so throughput can be measured without Supabase
+or Sepolia. --real-db uses db.py as-is (point DATABASE_URL at a local Postgres) and
+--real-chain uses blockchain.py as-is (point SEPOLIA_RPC_URL at a local anvil/Hardhat node
+started with --chain-id 11155111).
+
+The app runs in a scratch working directory so generated files never land in backend/generated.
+
+Usage (from backend/):
+  python loadtest.py --duration 30 --concurrency 16
+  python loadtest.py --chain-write-latency-ms 2000 --mix generate=1,pharmacist=2,consumer=7
+"""
+import argparse
+import functools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from tracing import traced
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+
+def _sleep_ms(ms):
+    if ms > 0:
+        time.sleep(ms / 1000.0)
+
+
+# =====================================================
+# 🔷 Stand-ins for db.py and blockchain.py
+# =====================================================
+
+def make_fake_db(latency_ms):
+    """Module with the db.py API, backed by dicts. Every call sleeps latency_ms (one round trip)."""
+    lock = threading.Lock()
+    products, pharmacist_scans, consumer_scans, scan_events, manufacturer_keys = {}, {}, {}, [], {}
+    packaging_templates = {}
+    db = types.ModuleType("db")
+
+    def call(fn):
+        @traced(f"db.{fn.__name__}")
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            _sleep_ms(latency_ms)
+            with lock:
+                return fn(*args, **kwargs)
+        setattr(db, fn.__name__, wrapper)
+        return wrapper
+
+    @call
+    def init_db():
+        pass
+
+    @call
+    def code_exists(code, database_url=None):
+        code = str(code or "").strip().upper()
+        return any(p["pan_code"] == code for p in products.values())
+
+    @call
+    def insert_mapping(code, _value=None, database_url=None):
+        pass
+
+    @call
+    def insert_product(product_id, pan_code, manufacturer=None, template_sha256=None, lot=None, qr_payload=None):
+        products[product_id] = {
+            "product_id": product_id, "pan_code": pan_code.strip().upper(),
+            "manufacturer": manufacturer, "template_sha256": template_sha256,
+            "lot": lot, "qr_payload": qr_payload, "created_at": datetime.utcnow(),
+        }
+
+    @call
+    def register_manufacturer_key(key_id, manufacturer, public_key_hex):
+        manufacturer_keys.setdefault(key_id, {
+            "key_id": key_id, "manufacturer": manufacturer, "public_key": public_key_hex,
+        })
+
+    @call
+    def get_manufacturer_keys():
+        return list(manufacturer_keys.values())
+
+    @call
+    def insert_packaging_template(manufacturer, sha256, features):
+        row = packaging_templates.get((manufacturer, sha256))
+        if row is None:
+            version = 1 + max((r["version"] for r in packaging_templates.values()
+                               if r["manufacturer"] == manufacturer), default=0)
+            row = {"manufacturer": manufacturer, "sha256": sha256, "version": version, "features": features}
+        row["uploaded_at"] = datetime.utcnow()
+        packaging_templates[(manufacturer, sha256)] = row
+        return dict(row)
+
+    @call
+    def get_packaging_templates():
+        return sorted((dict(r) for r in packaging_templates.values()), key=lambda r: (r["uploaded_at"], r["version"]))
+
+    @call
+    def get_product_by_id(product_id):
+        return products.get((product_id or "").strip())
+
+    @call
+    def get_product_by_pan_code(pan_code):
+        code = str(pan_code or "").strip().upper()
+        return next((p for p in products.values() if p["pan_code"] == code), None)
+
+    @call
+    def count_products():
+        return len(products)
+
+    @call
+    def iter_issued_codes(since=None, batch_size=10000):
+        return [(p["product_id"], p["pan_code"], p["created_at"]) for p in products.values()
+                if since is None or p["created_at"] > since]
+
+    @call
+    def get_products_for_scans(product_ids=(), pan_codes=()):
+        codes = {str(c).strip().upper() for c in pan_codes}
+        return [
+            {**p, "pharmacist_scanned_at": (pharmacist_scans.get(p["product_id"]) or {}).get("scanned_at")}
+            for p in products.values() if p["product_id"] in product_ids or p["pan_code"] in codes
+        ]
+
+    @call
+    def get_pharmacist_scan(product_id):
+        return pharmacist_scans.get(product_id)
+
+    @call
+    def record_pharmacist_scan(product_id):
+        pharmacist_scans[product_id] = {"product_id": product_id, "scanned_at": datetime.utcnow()}
+
+    @call
+    def record_pharmacist_scans(product_ids):
+        inserted = {pid for pid in product_ids if pid not in pharmacist_scans}
+        for pid in inserted:
+            pharmacist_scans[pid] = {"product_id": pid, "scanned_at": datetime.utcnow()}
+        return inserted
+
+    @call
+    def get_consumer_scan(product_id, factor):
+        return consumer_scans.get((product_id, factor))
+
+    @call
+    def get_any_consumer_scan(product_id):
+        return next((s for (pid, _), s in consumer_scans.items() if pid == product_id), None)
+
+    @call
+    def record_consumer_scan(product_id, factor):
+        consumer_scans[(product_id, factor)] = {
+            "product_id": product_id, "factor": factor, "scanned_at": datetime.utcnow(),
+        }
+
+    @call
+    def insert_scan_rows(pharmacist_rows=(), consumer_rows=()):
+        for pid, scanned_at in pharmacist_rows:
+            pharmacist_scans.setdefault(pid, {"product_id": pid, "scanned_at": scanned_at})
+        for pid, factor, scanned_at in consumer_rows:
+            if not any(p == pid for p, _ in consumer_scans):
+                consumer_scans[(pid, factor)] = {"product_id": pid, "factor": factor, "scanned_at": scanned_at}
+
+    @call
+    def insert_scan_events(rows):
+        scan_events.extend(rows)
+
+    @call
+    def scan_event_summary(since, until=None):
+        counts = {}
+        for route, _, _, _, verdict, _, scanned_at in scan_events:
+            if scanned_at >= since and (until is None or scanned_at < until):
+                counts[(route, verdict)] = counts.get((route, verdict), 0) + 1
+        return [{"route": r, "verdict": v, "count": n} for (r, v), n in sorted(counts.items())]
+
+    return db
+
+
+def make_fake_chain(read_latency_ms, write_latency_ms, manufacturer):
+    """Module with the blockchain.py API. Reads sleep read_latency_ms, transactions write_latency_ms."""
+    lock = threading.Lock()
+    states, owners, template_hashes = {}, {}, {}
+    chain = types.ModuleType("blockchain")
+
+    def register_product(product_id):
+        _sleep_ms(write_latency_ms)
+        with lock:
+            if states.get(product_id):
+                return {"success": False, "error": "Contract revert: Already registered"}
+            states[product_id], owners[product_id] = 1, manufacturer
+        return {"success": True, "receipt": None}
+
+    def verify_product(product_id):
+        _sleep_ms(write_latency_ms)
+        with lock:
+            if states.get(product_id) == 1:
+                states[product_id] = 2
+        return {"success": True, "receipt": None}
+
+    def verify_products(product_ids):
+        # Sent back to back, so the batch costs roughly one confirmation
+        _sleep_ms(write_latency_ms)
+        with lock:
+            for pid in product_ids:
+                if states.get(pid) == 1:
+                    states[pid] = 2
+        return {pid: {"success": True, "receipt": None} for pid in product_ids}
+
+    def get_product_state(product_id):
+        _sleep_ms(read_latency_ms)
+        return states.get(product_id, 0)
+
+    def get_manufacturer(product_id):
+        _sleep_ms(read_latency_ms)
+        return owners.get(product_id, ZERO_ADDRESS)
+
+    def get_products_chain_info(product_ids):
+        _sleep_ms(read_latency_ms)
+        return {pid: (owners.get(pid, ZERO_ADDRESS), states.get(pid, 0)) for pid in product_ids}
+
+    def register_template_hash(sha256_hex):
+        _sleep_ms(write_latency_ms)
+        template_hashes[manufacturer.lower()] = sha256_hex
+        return {"success": True, "receipt": None}
+
+    def get_template_hash(address):
+        _sleep_ms(read_latency_ms)
+        return template_hashes.get(address.lower())
+
+    def is_node_connected():
+        return True
+
+    for fn in (register_product, verify_product, verify_products, get_product_state,
+               get_manufacturer, get_products_chain_info, register_template_hash, get_template_hash,
+               is_node_connected):
+        setattr(chain, fn.__name__, traced(f"chain.{fn.__name__}")(fn))
+    return chain
+
+
+# =====================================================
+# 🔷 App bootstrap
+# =====================================================
+
+def boot_app(args):
+    """Prepare a scratch working dir, install stand-ins, import app and serve it. Returns (base_url, server)."""
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, BACKEND_DIR)
+    sys.path.insert(0, os.path.join(os.path.dirname(BACKEND_DIR), "ai-auth"))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="authentimed_load_")
+    os.makedirs(os.path.join(workdir, "templates"), exist_ok=True)
+    shutil.copy(os.path.join(BACKEND_DIR, "abi.json"), workdir)
+    os.chdir(workdir)
+
+    if not args.real_db:
+        sys.modules["db"] = make_fake_db(args.db_latency_ms)
+    if not args.real_chain:
+        sys.modules["blockchain"] = make_fake_chain(
+            args.chain_read_latency_ms, args.chain_write_latency_ms, os.environ["OWNER_ADDRESS"])
+
+    if args.real_db:
+        # The app no longer migrates at import (see manage.py)
+        from db import init_db
+        init_db()
+    import app as app_module
+    server = make_server(args.host, args.port, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"App serving at http://{args.host}:{server.server_port} (workdir {workdir})")
+    return f"http://{args.host}:{server.server_port}", server
+
+
+# =====================================================
+# 🔷 Traffic
+# =====================================================
+
+def _multipart(fields):
+    """Encode {name: (filename, bytes)} as multipart/form-data. Returns (body, content_type)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, (filename, content) in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def _post(url, fields=None):
+    body, content_type = _multipart(fields or {})
+    req = urllib.request.Request(url, data=body, method="POST", headers={"Content-Type": content_type})
+    try:
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            return resp.status, json.loads(resp.read() or b"{}")
+    except urllib.error.HTTPError as e:
+        return e.code, {}
+
+
+def _get(url):
+    with urllib.request.urlopen(url, timeout=60) as resp:
+        return resp.read()
+
+
+class Traffic:
+    """Realistic mix: manufacturers add products, pharmacists scan new packs (QR or strip), consumers
+    verify scanned packs; a share of requests replay already-used codes or send junk photos."""
+
+    def __init__(self, base_url, template_bytes, replay_ratio, junk_ratio, junk_image):
+        self.base_url = base_url
+        self.template_bytes = template_bytes
+        self.replay_ratio = replay_ratio
+        self.junk_ratio = junk_ratio
+        self.junk_image = junk_image
+        self.lock = threading.Lock()
+        self.fresh = []      # (product_id, packaged_png, hidden_png) not yet pharmacist-scanned
+        self.scanned = []    # pharmacist-scanned, available for consumers
+
+    def generate(self):
+        status, data = _post(f"{self.base_url}/manufacturer/generate")
+        if status == 200 and "images" in data:
+            packaged = _get(self.base_url + data["images"]["packaged"])
+            hidden = _get(self.base_url + data["images"]["hidden"])
+            with self.lock:
+                self.fresh.append((data["Product ID"], packaged, hidden))
+        return status
+
+    def _pick(self, pool, consume):
+        with self.lock:
+            if not pool:
+                return None
+            if consume and random.random() >= self.replay_ratio:
+                return pool.pop(random.randrange(len(pool)))
+            return random.choice(pool)
+
+    def _image(self, item):
+        if item is None or random.random() < self.junk_ratio:
+            return self.junk_image
+        _, packaged, hidden = item
+        return packaged if random.random() < 0.7 else hidden
+
+    def pharmacist(self):
+        item = self._pick(self.fresh, consume=True)
+        status, _ = _post(f"{self.base_url}/pharmacist/verify", {"file": (f"{uuid.uuid4().hex}.png", self._image(item))})
+        if item is not None:
+            with self.lock:
+                self.scanned.append(item)
+        return status
+
+    def consumer(self):
+        item = self._pick(self.scanned, consume=True)
+        status, _ = _post(f"{self.base_url}/consumer/verify", {"file": (f"{uuid.uuid4().hex}.png", self._image(item))})
+        return status
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def run_load(traffic, mix, duration, concurrency):
+    routes = list(mix)
+    weights = [mix[r] for r in routes]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        while time.monotonic() < deadline:
+            route = random.choices(routes, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = getattr(traffic, route)() == 200
+            except Exception:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies[route].append(elapsed)
+                if not ok:
+                    errors[route] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    return latencies, errors, time.monotonic() - started
+
+
+def report(latencies, errors, elapsed):
+    print()
+    print(f"{'route':12s} {'requests':>9s} {'errors':>7s} {'req/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    summary = {}
+    for route in sorted(latencies):
+        values = sorted(latencies[route])
+        summary[route] = {
+            "requests": len(values),
+            "errors": errors[route],
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "p99_ms": percentile(values, 99),
+        }
+        s = summary[route]
+        print(f"{route:12s} {s['requests']:9d} {s['errors']:7d} {s['rps']:8.1f} "
+              f"{s['p50_ms']:9.1f} {s['p95_ms']:9.1f} {s['p99_ms']:9.1f}")
+    return summary
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("generate", "pharmacist", "consumer"):
+            raise argparse.ArgumentTypeError(f"Unknown route in mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the Authentimed backend with local stand-ins")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of mixed traffic")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--seed-products", type=int, default=20, help="Products generated before the run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("generate=1,pharmacist=3,consumer=6"))
+    parser.add_argument("--replay-ratio", type=float, default=0.1, help="Share of scans that reuse a code")
+    parser.add_argument("--junk-ratio", type=float, default=0.1, help="Share of scans that send a non-pack photo")
+    parser.add_argument("--db-latency-ms", type=float, default=5)
+    parser.add_argument("--chain-read-latency-ms", type=float, default=150)
+    parser.add_argument("--chain-write-latency-ms", type=float, default=1500)
+    parser.add_argument("--real-db", action="store_true", help="Use db.py against DATABASE_URL")
+    parser.add_argument("--real-chain", action="store_true", help="Use blockchain.py against SEPOLIA_RPC_URL")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--workdir", help="Scratch working directory for the app (default: temp dir)")
+    parser.add_argument("--json", help="Also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    template_src = sorted(
+        f for f in os.listdir(os.path.join(BACKEND_DIR, "templates")) if f.endswith(".png"))[0]
+    os.environ.setdefault("OWNER_ADDRESS", template_src[:-len(".png")])
+    with open(os.path.join(BACKEND_DIR, "templates", template_src), "rb") as f:
+        template_bytes = f.read()
+    with open(os.path.join(BACKEND_DIR, "test.jpeg"), "rb") as f:
+        junk_image = f.read()
+
+    base_url, server = boot_app(args)
+    traffic = Traffic(base_url, template_bytes, args.replay_ratio, args.junk_ratio, junk_image)
+
+    # Register the template with the first request, then seed products for the scanners
+    _post(f"{base_url}/manufacturer/generate", {"file": ("template.png", template_bytes)})
+    print(f"Seeding {args.seed_products} products...")
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda _: traffic.generate(), range(args.seed_products)))
+
+    print(f"Running mixed traffic for {args.duration:.0f}s with {args.concurrency} clients...")
+    latencies, errors, elapsed = run_load(traffic, args.mix, args.duration, args.concurrency)
+    summary = report(latencies, errors, elapsed)
+    server.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+One-off operational commands, kept out of worker startup.
+
+Usage (from backend/):
+  python manage.py migrate    # create/upgrade tables; run once per deploy, before starting workers
+  python manage.py partitions --months-ahead 3           # create upcoming scan_events partitions
+  python manage.py archive-scan-events --keep-months 12  # archive (CSV.gz) and drop older partitions
+"""
+import argparse
+import gzip
+import os
+import sys
+from datetime import datetime
+
+
+def migrate(args):
+    from db import init_db
+    init_db()
+    print("DB: migrated")
+    return 0
+
+
+def partitions(args):
+    from db import ensure_scan_event_partitions, list_scan_event_partitions
+    ensure_scan_event_partitions(args.months_ahead)
+    for name, _ in list_scan_event_partitions():
+        print(name)
+    return 0
+
+
+def archive_scan_events(args):
+    """Archive and drop scan_events partitions for months older than the last keep_months."""
+    from db import archive_scan_event_partition, list_scan_event_partitions
+    now = datetime.utcnow()
+    cutoff = now.year * 12 + now.month - 1 - args.keep_months   # months since year 0, zero-based
+    old = [name for name, (year, month) in list_scan_event_partitions() if year * 12 + month - 1 <= cutoff]
+    print(f"{len(old)} partition(s) older than {args.keep_months} month(s)")
+    for name in old:
+        if args.dry_run:
+            print(f"  would archive {name}")
+            continue
+        if args.no_archive:
+            archive_scan_event_partition(name)
+            print(f"  dropped {name}")
+            continue
+        os.makedirs(args.out_dir, exist_ok=True)
+        path = os.path.join(args.out_dir, f"{name}.csv.gz")
+        with gzip.open(path, "wt") as out:
+            archive_scan_event_partition(name, out)
+        print(f"  archived {name} -> {path}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Authentimed backend management commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_migrate = sub.add_parser("migrate", help="Create or upgrade database tables")
+    p_migrate.set_defaults(func=migrate)
+
+    p_partitions = sub.add_parser("partitions", help="Create scan_events partitions ahead of time")
+    p_partitions.add_argument("--months-ahead", type=int, default=3)
+    p_partitions.set_defaults(func=partitions)
+
+    p_archive = sub.add_parser("archive-scan-events", help="Archive and drop old scan_events partitions")
+    p_archive.add_argument("--keep-months", type=int, default=12,
+                           help="Months kept, counting the current one (default: %(default)s)")
+    p_archive.add_argument("--out-dir", default="archive", help="Where CSV.gz archives go (default: %(default)s)")
+    p_archive.add_argument("--no-archive", action="store_true", help="Drop without writing an archive")
+    p_archive.add_argument("--dry-run", action="store_true")
+    p_archive.set_defaults(func=archive_scan_events)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Move generated artifacts from the old flat layout (generated/qr/<id>.png, generated/reveals/<id>/...)
+into the sharded storage layout, locally or into an S3-compatible bucket.
+
+Idempotent and safe to interrupt: files already at their destination are skipped, and sources are
+removed only after the destination has them. The app serves both layouts meanwhile, so it can keep
+running during the migration.
+
+Usage (from backend/):
+  python migrate_storage.py --dry-run               # what would move
+  python migrate_storage.py                         # shard generated/ in place
+  python migrate_storage.py --to s3 --workers 16    # upload to S3_BUCKET (MinIO: set S3_ENDPOINT_URL)
+  python migrate_storage.py --to s3 --delete        # ... and remove local copies once uploaded
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import ARTIFACT_ROOT, LocalStorage, make_storage
+
+
+def migrate_one(destination, key, path, in_place, delete):
+    """Returns "moved", "copied" or "skipped"."""
+    if in_place:
+        if path == destination.path(key):
+            return "skipped"
+        destination.put_file(key, path, move=True)
+        return "moved"
+    if not destination.exists(key):
+        destination.put_file(key, path, move=delete)
+        return "moved" if delete else "copied"
+    if delete:
+        os.remove(path)
+    return "skipped"
+
+
+def _prune_empty_dirs(root):
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if dirpath != root and not dirnames and not filenames:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate generated artifacts to the sharded storage layout")
+    parser.add_argument("--source", default=ARTIFACT_ROOT, help="Local artifact root (default: %(default)s)")
+    parser.add_argument("--to", choices=["local", "s3"], default="local",
+                        help="Destination backend; local shards the source tree in place")
+    parser.add_argument("--delete", action="store_true", help="Remove source files after uploading (--to s3)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    source = LocalStorage(args.source)
+    in_place = args.to == "local"
+    destination = source if in_place else make_storage(args.to)
+
+    pending = [(key, path) for key, path in source.iter_keys()
+               if not (in_place and path == source.path(key))]
+    print(f"{len(pending)} artifact(s) to migrate from {args.source} to {args.to}")
+    if args.dry_run:
+        for key, path in pending[:20]:
+            print(f"  {path} -> {key}")
+        return 0
+
+    counts = {"moved": 0, "copied": 0, "skipped": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(migrate_one, destination, key, path, in_place, args.delete)
+                   for key, path in pending]
+        for i, future in enumerate(futures, 1):
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print("Failed:", pending[i - 1][1], e)
+            if i % 1000 == 0:
+                print(f"{i}/{len(pending)}")
+
+    if in_place or args.delete:
+        _prune_empty_dirs(args.source)
+    print(", ".join(f"{name}: {n}" for name, n in counts.items()))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
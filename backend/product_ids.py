@@ -0,0 +1,99 @@
+"""
+Product ids printed in the QR code.
+
+New ids are MEDICINEX-<ULID>: 26 Crockford base32 characters holding a 48-bit millisecond timestamp
+and 80 random bits. They sort by creation time, so products inserts append to the end of the
+primary-key index, and a collision needs two ids in the same millisecond with the same 80 random
+bits. Uppercase base32 and "-" are all in the QR alphanumeric set, so a bare 36-character id still
+fits a version 2 QR, the same size as the old ids.
+
+Old ids (MEDICINEX-<8 hex>) stay valid everywhere.
+
+The QR itself may carry a signed payload (qr_signing.py) instead of the bare id:
+  <product_id>.<key hint>.<Ed25519 signature>
+all in the same alphabet, so it is still an alphanumeric-mode QR. At 143 characters (the signature
+alone is 103) it needs a version 6 QR; qr_overlay sizes the print slot for that.
+"""
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+PRODUCT_ID_PREFIX = "MEDICINEX-"
+CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+_ID = r"MEDICINEX-(?:[a-f0-9]{8}|[0-7][0-9A-HJKMNP-TV-Z]{25})"
+PRODUCT_ID_PATTERN = re.compile(rf"^{_ID}$")
+QR_PAYLOAD_PATTERN = re.compile(
+    rf"^(?P<product_id>{_ID})"
+    r"(?:\.(?P<key_hint>[0-9A-HJKMNP-TV-Z]{2})\.(?P<signature>[0-9A-HJKMNP-TV-Z]{103}))?$"
+)
+
+_RANDOM_BITS = 80
+_lock = threading.Lock()
+_last = (None, 0, 0)   # (pid, ms, random) of the previous id
+
+
+def encode_base32(value, length=26):
+    """Crockford base32, most significant character first, left-padded to length."""
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def new_product_id():
+    """A new MEDICINEX-<ULID>, strictly increasing within this process (monotonic ULID)."""
+    global _last
+    with _lock:
+        pid, last_ms, last_random = _last
+        ms = time.time_ns() // 1_000_000
+        # A forked worker inherits _last; it must not continue the parent's random sequence
+        if pid == os.getpid() and ms <= last_ms:
+            ms, random = last_ms, last_random + 1
+            if random >> _RANDOM_BITS:
+                ms, random = last_ms + 1, int.from_bytes(os.urandom(10), "big")
+        else:
+            random = int.from_bytes(os.urandom(10), "big")
+        _last = (os.getpid(), ms, random)
+    return PRODUCT_ID_PREFIX + encode_base32((ms << _RANDOM_BITS) | random)
+
+
+def is_valid_product_id(product_id):
+    return PRODUCT_ID_PATTERN.match(product_id or "") is not None
+
+
+def decode_base32(text):
+    value = 0
+    for ch in text:
+        value = (value << 5) | CROCKFORD.index(ch)
+    return value
+
+
+def parse_qr_payload(payload):
+    """(product_id, key_hint, signature) for a bare or signed QR payload, else None.
+    key_hint and signature are None for a bare product id."""
+    m = QR_PAYLOAD_PATTERN.match((payload or "").strip())
+    if m is None:
+        return None
+    return m.group("product_id"), m.group("key_hint"), m.group("signature")
+
+
+def is_valid_qr_payload(payload):
+    return parse_qr_payload(payload) is not None
+
+
+def qr_product_id(payload):
+    """Product id carried by a QR payload (signed or not), or None."""
+    parsed = parse_qr_payload(payload)
+    return parsed[0] if parsed else None
+
+
+def product_id_time(product_id):
+    """Creation time (UTC, naive like the DB columns) embedded in a ULID product id; None for old ids."""
+    if not is_valid_product_id(product_id) or len(product_id) != len(PRODUCT_ID_PREFIX) + 26:
+        return None
+    ms = decode_base32(product_id[len(PRODUCT_ID_PREFIX):]) >> _RANDOM_BITS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).replace(tzinfo=None)
@@ -1,9 +1,105 @@
+import os
+import threading
+
 import cv2
+import numpy as np
+import qrcode
+
+# Ratios based on original 720x405 template. The slot is 135 px there, so a signed payload (version 6
+# QR: 41 modules plus the quiet zone) gets 3 whole pixels per module; it covers the template's own QR
+# and stays on the white area around it, which extends the quiet zone.
+QR_SIZE_RATIO = 135 / 720
+QR_X_RATIO = 560 / 720
+QR_Y_RATIO = 150 / 405
+QR_BORDER = 2
+
+# 0 (fastest, largest) .. 9 (slowest, smallest); OpenCV's default is 3
+PNG_COMPRESSION = int(os.getenv("PNG_COMPRESSION", "3"))
+
+
+def _qr_box(package):
+    """Return (x_start, y_start, qr_size) for the QR slot of a template image."""
+    h, w = package.shape[:2]
+    return int(w * QR_X_RATIO), int(h * QR_Y_RATIO), int(w * QR_SIZE_RATIO)
+
+
+def render_qr(data, size):
+    """Render data as a QR code directly to a size x size BGR array (quiet zone included)."""
+    qr = qrcode.QRCode(border=QR_BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    modules = np.where(np.array(qr.get_matrix(), dtype=bool), 0, 255).astype(np.uint8)
+
+    # A whole number of pixels per module, centred on white: resampling to a fractional module size
+    # blurs module edges, and dense codes then stop decoding at print size
+    scale = size // modules.shape[0]
+    if scale == 0:
+        return cv2.cvtColor(cv2.resize(modules, (size, size), interpolation=cv2.INTER_AREA), cv2.COLOR_GRAY2BGR)
+    code = np.repeat(np.repeat(modules, scale, axis=0), scale, axis=1)
+    qr_img = np.full((size, size), 255, dtype=np.uint8)
+    offset = (size - code.shape[0]) // 2
+    qr_img[offset:offset + code.shape[0], offset:offset + code.shape[0]] = code
+    return cv2.cvtColor(qr_img, cv2.COLOR_GRAY2BGR)
+
+
+class QRCompositor:
+    """
+    Paste QR codes into packaging templates.
 
-# Ratios based on original 720x405 template
-QR_SIZE_RATIO = 115 / 720
-QR_X_RATIO = 577 / 720
-QR_Y_RATIO = 170 / 405
+    Each template is decoded once and cached (reloaded only if the file changes), and QR
+    codes are rendered straight into the composite, so a lot run costs one template decode
+    plus one PNG encode per product.
+    """
+
+    def __init__(self, png_compression=PNG_COMPRESSION):
+        self.png_compression = png_compression
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def template(self, template_path):
+        """Return the cached template image (BGR) for template_path, or None if unreadable."""
+        try:
+            mtime = os.path.getmtime(template_path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._templates.get(template_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        package = cv2.imread(template_path)
+        if package is None:
+            return None
+        with self._lock:
+            self._templates[template_path] = (mtime, package)
+        return package
+
+    def invalidate(self, template_path=None):
+        """Drop one cached template (or all of them)."""
+        with self._lock:
+            if template_path is None:
+                self._templates.clear()
+            else:
+                self._templates.pop(template_path, None)
+
+    def compose(self, template_path, data):
+        """Return a new BGR array: the template with a QR code for data in its QR slot."""
+        package = self.template(template_path)
+        if package is None:
+            return None
+        x_start, y_start, qr_size = _qr_box(package)
+        composite = package.copy()
+        composite[y_start:y_start + qr_size, x_start:x_start + qr_size] = render_qr(data, qr_size)
+        return composite
+
+    def write(self, template_path, data, output_path):
+        """Compose and save as PNG. Returns True on success."""
+        composite = self.compose(template_path, data)
+        if composite is None:
+            return False
+        return cv2.imwrite(output_path, composite, [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression])
+
+
+compositor = QRCompositor()
 
 
 def replace_qr(package_image_path, new_qr_path, output_path):
@@ -13,16 +109,10 @@ def replace_qr(package_image_path, new_qr_path, output_path):
     if package is None or new_qr is None:
         return False
 
-    h, w, _ = package.shape
-
-    # Compute relative QR size
-    qr_size = int(w * QR_SIZE_RATIO)
+    # Compute relative QR size and position
+    x_start, y_start, qr_size = _qr_box(package)
     new_qr = cv2.resize(new_qr, (qr_size, qr_size))
 
-    # Compute relative position
-    x_start = int(w * QR_X_RATIO)
-    y_start = int(h * QR_Y_RATIO)
-
     package[y_start:y_start+qr_size, x_start:x_start+qr_size] = new_qr
 
     cv2.imwrite(output_path, package)
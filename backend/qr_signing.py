@@ -0,0 +1,207 @@
+"""
+Ed25519-signed QR payloads: reject forged QR codes before any DB or chain call.
+
+/manufacturer/generate prints <product_id>.<key hint>.<signature> (see product_ids.py) instead of
+the bare product id. The signature covers the product id; the lot stays in the products table, as
+every extra character in the QR shrinks its modules at print size. The key id is the first 30 bits
+of SHA-256(public key) and the QR carries only its first KEY_HINT_CHARS characters: verification
+tries every key with that prefix (almost always one). Public keys live in manufacturer_keys and
+are cached here, so verify_signature does no I/O for known keys and re-reads the table at most
+every QR_KEY_REFRESH_SECONDS when no cached key matches.
+
+The signing key of this deployment (the OWNER_ADDRESS manufacturer) is read from
+QR_SIGNING_KEY_FILE (PEM, PKCS#8), or created there on first use, and its public key is registered
+in manufacturer_keys the first time it signs.
+
+Env:
+  QR_SIGNING=0              print bare product ids (old behaviour)
+  QR_SIGNING_KEY_FILE       default keys/qr_signing_ed25519.pem
+  REQUIRE_SIGNED_QR=1       reject QR codes without a signature (default: accept them, as printed before).
+                            Until it is set, a forger can print the bare product id of an issued pack
+                            instead of a signed payload; create_app warns at startup while it is off.
+  QR_KEY_REFRESH_SECONDS=30
+"""
+import hashlib
+import os
+import threading
+import time
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+import db
+from product_ids import decode_base32, encode_base32, parse_qr_payload
+from tracing import traced
+
+QR_SIGNING = os.getenv("QR_SIGNING", "1") != "0"
+QR_SIGNING_KEY_FILE = os.getenv("QR_SIGNING_KEY_FILE", os.path.join("keys", "qr_signing_ed25519.pem"))
+REQUIRE_SIGNED_QR = os.getenv("REQUIRE_SIGNED_QR", "0") == "1"
+QR_KEY_REFRESH_SECONDS = float(os.getenv("QR_KEY_REFRESH_SECONDS", "30"))
+
+SIGNATURE_CHARS = 103   # 64 bytes in base32
+KEY_HINT_CHARS = 2      # 10 bits of the key id
+MESSAGE_PREFIX = b"MEDICINEX-QR2|"
+
+
+def _message(product_id):
+    return MESSAGE_PREFIX + product_id.encode()
+
+
+def _raw_public(public_key):
+    return public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+
+def key_id(public_key):
+    digest = hashlib.sha256(_raw_public(public_key)).digest()
+    return encode_base32(int.from_bytes(digest[:4], "big") >> 2, 6)
+
+
+# ========== Signing (manufacturer side) ==========
+
+_signing_key = None
+_registered = False
+_signing_lock = threading.Lock()
+
+
+def signing_key():
+    """This deployment's private key; created (mode 0600) the first time if the file does not exist."""
+    global _signing_key
+    if _signing_key is None:
+        with _signing_lock:
+            if _signing_key is None:
+                _signing_key = _load_or_create_key(QR_SIGNING_KEY_FILE)
+    return _signing_key
+
+
+def _load_or_create_key(path):
+    try:
+        with open(path, "rb") as f:
+            return serialization.load_pem_private_key(f.read(), password=None)
+    except FileNotFoundError:
+        pass
+    key = Ed25519PrivateKey.generate()
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption())
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker created it first
+        with open(path, "rb") as f:
+            return serialization.load_pem_private_key(f.read(), password=None)
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+    print("QR signing key created:", path)
+    return key
+
+
+def signed_payload(key, product_id):
+    """<product_id>.<key hint>.<signature> for a private key (no registration; see sign_qr_payload)."""
+    signature = encode_base32(int.from_bytes(key.sign(_message(product_id)), "big"), SIGNATURE_CHARS)
+    return f"{product_id}.{key_id(key.public_key())[:KEY_HINT_CHARS]}.{signature}"
+
+
+def sign_qr_payload(product_id, manufacturer=None):
+    """QR payload for a new product, signed with this deployment's key (registered on first use)."""
+    global _registered
+    key = signing_key()
+    if not _registered:
+        public_key = key.public_key()
+        manufacturer = manufacturer or os.getenv("OWNER_ADDRESS")
+        db.register_manufacturer_key(key_id(public_key), manufacturer, _raw_public(public_key).hex())
+        keys.add(key_id(public_key), manufacturer, public_key)
+        _registered = True
+    return signed_payload(key, product_id)
+
+
+# ========== Verification ==========
+
+class ManufacturerKeys:
+    """key hint -> [(manufacturer, public key)], loaded from manufacturer_keys."""
+
+    def __init__(self):
+        self._keys = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            rows = db.get_manufacturer_keys()
+        except Exception as e:
+            print("Manufacturer keys not loaded:", str(e))
+            return False
+        loaded = {}
+        for row in rows:
+            public_key = Ed25519PublicKey.from_public_bytes(bytes.fromhex(row["public_key"]))
+            loaded.setdefault(row["key_id"][:KEY_HINT_CHARS], []).append((row["manufacturer"], public_key))
+        with self._lock:
+            self._keys = loaded   # replaced, so revoked keys drop out
+            self._loaded_at = time.monotonic()
+        return True
+
+    def add(self, kid, manufacturer, public_key):
+        hint = kid[:KEY_HINT_CHARS]
+        with self._lock:
+            self._keys[hint] = self._keys.get(hint, []) + [(manufacturer, public_key)]
+
+    def refresh_due(self):
+        """True if a signature no cached key matches would now re-read manufacturer_keys (a blocking query)."""
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= QR_KEY_REFRESH_SECONDS
+
+    def get(self, hint):
+        """[(manufacturer, public key)] whose key id starts with hint, as cached (no I/O)."""
+        return self._keys.get(hint, [])
+
+    def refresh(self, hint):
+        """get(hint) after re-reading the table, which happens at most every QR_KEY_REFRESH_SECONDS."""
+        if self.refresh_due():
+            with self._lock:
+                due = self.refresh_due()
+                if due:
+                    self._loaded_at = time.monotonic()
+            if due:
+                self.load()
+        return self.get(hint)
+
+
+keys = ManufacturerKeys()
+
+
+def _signer(entries, signature, product_id):
+    """The (manufacturer, public key) entry whose key made signature; None if none did."""
+    for entry in entries:
+        try:
+            entry[1].verify(signature, _message(product_id))
+        except InvalidSignature:
+            continue
+        return entry
+    return None
+
+
+@traced("qr.verify_signature")
+def verify_signature(payload):
+    """
+    Check a decoded QR payload.
+
+    Returns:
+        (status, product_id, manufacturer): status is "valid", "unsigned" (bare product id, as printed
+        before signing) or "invalid" (malformed, unknown key or bad signature).
+    """
+    parsed = parse_qr_payload(payload)
+    if parsed is None:
+        return "invalid", None, None
+    product_id, hint, signature = parsed
+    if signature is None:
+        return "unsigned", product_id, None
+    try:
+        raw = decode_base32(signature).to_bytes(64, "big")
+    except OverflowError:
+        return "invalid", product_id, None
+    entry = _signer(keys.get(hint), raw, product_id)
+    if entry is None:
+        # Unknown key, or a new one sharing its hint with a cached key: re-read the table (rate-limited)
+        entry = _signer(keys.refresh(hint), raw, product_id)
+    if entry is None:
+        return "invalid", product_id, None
+    return "valid", product_id, entry[0]
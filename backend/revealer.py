@@ -2,6 +2,7 @@
 Reveal RGB channels from a PAN-format steganographic image into separate images.
 """
 from PIL import Image
+import numpy as np
 import os
 
 THRESHOLD = 120
@@ -19,50 +20,28 @@ def reveal_channels(image_path, output_dir=None, prefix=""):
     Returns:
         dict: {"red": path, "blue": path, "green": path}
     """
-    img = Image.open(image_path)
-    pixels = img.load()
-    width, height = img.size
+    # Accepts every stored form of the hidden image (24-bit RGB, indexed, RGBA)
+    with Image.open(image_path) as img:
+        rgb = np.asarray(img.convert("RGB"))
 
     if output_dir is None:
         output_dir = os.path.dirname(os.path.abspath(image_path))
 
     os.makedirs(output_dir, exist_ok=True)
 
-    red_img = Image.new("RGB", (width, height))
-    blue_img = Image.new("RGB", (width, height))
-    green_img = Image.new("RGB", (width, height))
-
-    red_pixels = red_img.load()
-    blue_pixels = blue_img.load()
-    green_pixels = green_img.load()
-
-    for x in range(width):
-        for y in range(height):
-            r, g, b = pixels[x, y]
-
-            if r > THRESHOLD:
-                red_pixels[x, y] = (255, 255, 255)
-            else:
-                red_pixels[x, y] = (0, 0, 0)
-
-            if b > THRESHOLD:
-                blue_pixels[x, y] = (255, 255, 255)
-            else:
-                blue_pixels[x, y] = (0, 0, 0)
-
-            if g > THRESHOLD:
-                green_pixels[x, y] = (255, 255, 255)
-            else:
-                green_pixels[x, y] = (0, 0, 0)
+    # Pure black/white: saved as 1-bit PNGs
+    red_img = Image.fromarray(rgb[:, :, 0] > THRESHOLD)
+    blue_img = Image.fromarray(rgb[:, :, 2] > THRESHOLD)
+    green_img = Image.fromarray(rgb[:, :, 1] > THRESHOLD)
 
     base = f"{prefix}_" if prefix else ""
     red_path = os.path.join(output_dir, f"{base}red_reveal.png")
     blue_path = os.path.join(output_dir, f"{base}blue_reveal.png")
     green_path = os.path.join(output_dir, f"{base}green_reveal.png")
 
-    red_img.save(red_path)
-    blue_img.save(blue_path)
-    green_img.save(green_path)
+    red_img.save(red_path, optimize=True)
+    blue_img.save(blue_path, optimize=True)
+    green_img.save(green_path, optimize=True)
 
     return {"red": red_path, "blue": blue_path, "green": green_path}
 
@@ -76,7 +55,7 @@ if __name__ == "__main__":
         prefix = "standalone"
     else:
         hidden_dir = os.path.join("generated", "hidden")
-        candidates = glob.glob(os.path.join(hidden_dir, "*.png"))
+        candidates = glob.glob(os.path.join(hidden_dir, "**", "*.png"), recursive=True)
         if not candidates:
             path = os.path.join(hidden_dir, "hidden_pan_format.png")
             prefix = "standalone"
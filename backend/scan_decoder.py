@@ -0,0 +1,113 @@
+"""
+Decode an uploaded scan into a product identity (QR product id or strip/PAN code).
+
+QR (pyzbar) and strip (extractor) decoding run concurrently on a shared thread pool.
+The first stage to return a valid code wins; the other stage is cancelled. A scan whose stages
+are still running at DECODE_STAGE_TIMEOUT comes back as DECODE_TIMEOUT, not as "no code": the
+routes answer it with a retry (503 / UNVERIFIED), since a busy server says nothing about the pack.
+"""
+import contextvars
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
+from qr_extractor import extract_qr_data
+from extractor import decode_strip
+from product_ids import is_valid_qr_payload
+from tracing import traced
+
+# Shared by all requests in this process; size it to the number of cores available to decoding.
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "4"))
+# Seconds each stage may run before it is abandoned.
+DECODE_STAGE_TIMEOUT = float(os.getenv("DECODE_STAGE_TIMEOUT", "10"))
+
+# Factor returned by decode_scan when the stages ran out of time before finding a code
+DECODE_TIMEOUT = "timeout"
+
+STRIP_CODE_PATTERN = re.compile(r"^[A-Z]{4}[0-9]{5}[A-Z]$")
+
+_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+# Drives decode_scan for batch uploads; kept separate from _pool so batch items never wait on their own workers.
+_batch_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode-batch")
+
+
+def is_valid_strip_code(code):
+    """True if code has the PAN format produced by code_generator (4 letters + 5 digits + 1 letter)."""
+    return STRIP_CODE_PATTERN.match(code or "") is not None
+
+
+@traced("decode.qr")
+def _decode_qr(scan_path):
+    # Bare product id or signed payload; the signature is checked by the caller (qr_signing.verify_signature)
+    payload = (extract_qr_data(scan_path) or "").strip()
+    return payload if is_valid_qr_payload(payload) else None
+
+
+@traced("decode.strip")
+def _decode_strip(scan_path):
+    try:
+        code, _ = decode_strip(scan_path)
+    except Exception:
+        return None
+    # decode_strip already applies the confidence floor; None means "no strip code"
+    return code if is_valid_strip_code(code) else None
+
+
+def decode_scan(scan_path, stage_timeout=None):
+    """
+    Decode QR and strip concurrently and return the first valid result.
+
+    Args:
+        scan_path: Path to the uploaded image.
+        stage_timeout: Seconds to wait for the stages (default DECODE_STAGE_TIMEOUT).
+
+    Returns:
+        tuple: ("qr", product_id), ("strip", pan_code), (None, None) if both stages finished
+               without a valid code, or (DECODE_TIMEOUT, None) if a stage was still running at the deadline.
+    """
+    timeout = DECODE_STAGE_TIMEOUT if stage_timeout is None else stage_timeout
+    # Submission order doubles as precedence when both stages finish in the same wait.
+    # Each stage runs in a copy of the caller's context so its timings land in the caller's request trace
+    stages = {
+        _pool.submit(contextvars.copy_context().run, _decode_qr, scan_path): "qr",
+        _pool.submit(contextvars.copy_context().run, _decode_strip, scan_path): "strip",
+    }
+    order = list(stages)
+    pending = set(stages)
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=order.index):
+                try:
+                    value = future.result()
+                except Exception:
+                    value = None
+                if value:
+                    return stages[future], value
+    finally:
+        # Stages that have not started are dropped; a running stage finishes in the background.
+        for future in pending:
+            future.cancel()
+    return (DECODE_TIMEOUT, None) if pending else (None, None)
+
+
+def decode_scans(scan_paths, stage_timeout=None):
+    """
+    Decode many scans in parallel, yielding (scan_path, factor, value) as each one completes.
+    factor/value are as returned by decode_scan.
+    """
+    futures = {
+        _batch_pool.submit(contextvars.copy_context().run, decode_scan, path, stage_timeout): path
+        for path in scan_paths
+    }
+    for future in as_completed(futures):
+        try:
+            factor, value = future.result()
+        except Exception:
+            factor, value = None, None
+        yield futures[future], factor, value
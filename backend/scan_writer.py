@@ -0,0 +1,261 @@
+"""
+Optional write-behind for pharmacist and consumer scan records.
+
+With SCAN_WRITE_BEHIND=1 a first scan is reserved in memory and the request returns at once; a
+background thread writes buffered scans in one multi-row INSERT (db.insert_scan_rows) every
+SCAN_FLUSH_MS or as soon as SCAN_FLUSH_ROWS are waiting. The reservation stays until the row is
+committed, so get_*_scan below see it and a second scan of the same product in this process is a
+duplicate. Across processes the flush INSERT skips products that already have a scan (ON CONFLICT);
+the window is the flush interval, as it was the gap between SELECT and INSERT before.
+
+Rows that cannot be written (DB down at exit, or more than SCAN_MAX_PENDING waiting) are appended
+to a spool file (SCAN_SPOOL_DIR/scans.<pid>.jsonl) and written by the next process to start.
+
+Without SCAN_WRITE_BEHIND every call goes straight to db.py, as before.
+
+Every verification attempt is also appended to scan_events (route, factor, code, verdict) through
+the same buffer, whether or not SCAN_WRITE_BEHIND is set (SCAN_EVENTS=0 to disable).
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import db
+from tracing import traced
+
+SCAN_WRITE_BEHIND = os.getenv("SCAN_WRITE_BEHIND", "0") == "1"
+SCAN_FLUSH_MS = float(os.getenv("SCAN_FLUSH_MS", "5"))
+SCAN_FLUSH_ROWS = int(os.getenv("SCAN_FLUSH_ROWS", "500"))
+SCAN_MAX_PENDING = int(os.getenv("SCAN_MAX_PENDING", "100000"))
+SCAN_SPOOL_DIR = os.getenv("SCAN_SPOOL_DIR", "temp")
+SCAN_EVENTS = os.getenv("SCAN_EVENTS", "1") != "0"
+# Back-off after a failed flush, so a DB outage is not hammered every few milliseconds
+RETRY_SECONDS = 1.0
+
+
+class ScanWriter:
+    def __init__(self):
+        self._pharmacist = {}   # product_id -> scanned_at, until committed
+        self._consumer = {}     # product_id -> (factor, scanned_at), until committed
+        # (kind, row): row is the db.insert_scan_rows tuple for kind, scanned_at always last
+        self._queue = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    # ---- reservations (read side) ----
+
+    def pending_pharmacist_scan(self, product_id):
+        """Pharmacist scan row reserved in this process and not yet committed, else None."""
+        scanned_at = self._pharmacist.get(product_id)
+        return {"product_id": product_id, "scanned_at": scanned_at} if scanned_at else None
+
+    def pending_consumer_scan(self, product_id):
+        entry = self._consumer.get(product_id)
+        return {"product_id": product_id, "factor": entry[0], "scanned_at": entry[1]} if entry else None
+
+    # ---- writes ----
+
+    def add_pharmacist_scan(self, product_id):
+        """Reserve and buffer a pharmacist scan. False if this process already has one for the product."""
+        now = datetime.utcnow()
+        with self._lock:
+            if product_id in self._pharmacist:
+                return False
+            self._pharmacist[product_id] = now
+            self._queue.append(("pharmacist", (product_id, now)))
+        self._after_add()
+        return True
+
+    def add_consumer_scan(self, product_id, factor):
+        """Reserve and buffer a consumer scan. False if this process already has one for the product."""
+        now = datetime.utcnow()
+        with self._lock:
+            if product_id in self._consumer:
+                return False
+            self._consumer[product_id] = (factor, now)
+            self._queue.append(("consumer", (product_id, factor, now)))
+        self._after_add()
+        return True
+
+    def add_event(self, route, factor, code, product_id, verdict, reason):
+        """Buffer one scan_events row."""
+        with self._lock:
+            self._queue.append(("event", (route, factor, code, product_id, verdict, reason, datetime.utcnow())))
+        self._after_add()
+
+    def _after_add(self):
+        self.start()
+        if len(self._queue) >= SCAN_FLUSH_ROWS:
+            self._wake.set()
+        if len(self._queue) > SCAN_MAX_PENDING:
+            # DB has been unreachable for a while; keep memory bounded
+            self._spool(self._take())
+
+    # ---- flushing ----
+
+    def _take(self):
+        with self._lock:
+            rows, self._queue = self._queue, []
+        return rows
+
+    def _release(self, rows):
+        with self._lock:
+            for kind, row in rows:
+                if kind == "pharmacist":
+                    self._pharmacist.pop(row[0], None)
+                elif kind == "consumer":
+                    self._consumer.pop(row[0], None)
+
+    @traced("scan_writer.flush")
+    def flush(self):
+        """Write everything buffered. Returns False (failed rows put back) if a DB write failed."""
+        with self._flush_lock:
+            rows = self._take()
+            if not rows:
+                return True
+            scans = [(kind, row) for kind, row in rows if kind != "event"]
+            events = [(kind, row) for kind, row in rows if kind == "event"]
+            failed = []
+            # Separate transactions: the event log must never hold back first-scan records
+            try:
+                db.insert_scan_rows(
+                    pharmacist_rows=[row for kind, row in scans if kind == "pharmacist"],
+                    consumer_rows=[row for kind, row in scans if kind == "consumer"],
+                )
+                self._release(scans)
+            except Exception as e:
+                print("Scan flush failed:", str(e))
+                failed += scans
+            try:
+                db.insert_scan_events([row for _, row in events])
+            except Exception as e:
+                print("Scan event flush failed:", str(e))
+                failed += events
+            if failed:
+                with self._lock:
+                    self._queue[:0] = failed
+            return not failed
+
+    def _run(self):
+        self._replay_spool()
+        while True:
+            self._wake.wait(SCAN_FLUSH_MS / 1000)
+            self._wake.clear()
+            if not self.flush():
+                time.sleep(RETRY_SECONDS)
+
+    def start(self):
+        # One flusher thread per process; a forked worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="scan-writer", daemon=True).start()
+
+    def close(self):
+        """Flush on shutdown; whatever cannot be written goes to the spool file."""
+        if self._pid != os.getpid():
+            return
+        if not self.flush():
+            self._spool(self._take())
+
+    # ---- spool (durable fallback) ----
+
+    def _spool(self, rows):
+        if not rows:
+            return
+        os.makedirs(SCAN_SPOOL_DIR, exist_ok=True)
+        path = os.path.join(SCAN_SPOOL_DIR, f"scans.{os.getpid()}.jsonl")
+        with open(path, "a") as f:
+            for kind, row in rows:
+                f.write(json.dumps([kind, *row[:-1], row[-1].isoformat()]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._release(rows)
+        print(f"Scan writer: spooled {len(rows)} row(s) to {path}")
+
+    def _replay_spool(self):
+        for path in glob.glob(os.path.join(SCAN_SPOOL_DIR, "scans.*.jsonl")):
+            # Claim the file first so two starting processes never replay it twice
+            claimed = f"{path}.{os.getpid()}.replay"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed) as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            with self._lock:
+                for kind, *row in rows:
+                    row[-1] = datetime.fromisoformat(row[-1])
+                    if kind == "pharmacist":
+                        self._pharmacist.setdefault(row[0], row[-1])
+                    elif kind == "consumer":
+                        self._consumer.setdefault(row[0], (row[1], row[-1]))
+                    self._queue.append((kind, tuple(row)))
+            # The rows are buffered now, like any new scan: written by the next flush or spooled again at exit
+            os.remove(claimed)
+            self.flush()
+            print(f"Scan writer: replayed {len(rows)} spooled row(s) from {path}")
+
+
+writer = ScanWriter()
+atexit.register(writer.close)
+
+
+# =====================================================
+# 🔷 db.py-compatible API used by the routes
+# =====================================================
+
+def get_pharmacist_scan(product_id):
+    if SCAN_WRITE_BEHIND:
+        writer.start()
+    return writer.pending_pharmacist_scan(product_id) or db.get_pharmacist_scan(product_id)
+
+
+def get_any_consumer_scan(product_id):
+    if SCAN_WRITE_BEHIND:
+        writer.start()
+    return writer.pending_consumer_scan(product_id) or db.get_any_consumer_scan(product_id)
+
+
+def record_pharmacist_scan(product_id):
+    """Record a first pharmacist scan. False if another request in this process already claimed it."""
+    if SCAN_WRITE_BEHIND:
+        return writer.add_pharmacist_scan(product_id)
+    db.record_pharmacist_scan(product_id)
+    return True
+
+
+def record_pharmacist_scans(product_ids):
+    """
+    Record first pharmacist scans for a batch. Returns the set of product_ids claimed by this call; the
+    others already had a scan (another request in this process, or a row in the DB).
+    """
+    if SCAN_WRITE_BEHIND:
+        return {pid for pid in dict.fromkeys(product_ids) if writer.add_pharmacist_scan(pid)}
+    return db.record_pharmacist_scans(product_ids)
+
+
+def record_consumer_scan(product_id, factor):
+    """Record a consumer verification. False if another request in this process already claimed it."""
+    if SCAN_WRITE_BEHIND:
+        return writer.add_consumer_scan(product_id, factor)
+    db.record_consumer_scan(product_id, factor)
+    return True
+
+
+def record_event(route, factor, code, verdict):
+    """Log one verification attempt and its verdict dict to scan_events (buffered)."""
+    if SCAN_EVENTS and verdict.get("Final Verdict"):
+        writer.add_event(
+            route, factor, code, verdict.get("Product ID"), verdict["Final Verdict"],
+            verdict.get("Flag") or verdict.get("Reason") or verdict.get("Message"),
+        )
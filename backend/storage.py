@@ -0,0 +1,189 @@
+"""
+Where generated artifacts (QR, packaged, hidden, reveals) are stored.
+
+Callers use logical keys, the same paths as the /generated/<key> URLs:
+  qr/<product_id>.png, packaged/<product_id>_packaged.png, hidden/<product_id>_hidden.png,
+  reveals/<product_id>/<color>_reveal.png
+Backends store them sharded by a hash prefix of the product id, so no directory (or S3 prefix)
+grows with the number of products:
+  qr/MEDICINEX-19c5b270.png  ->  qr/5e/0b/MEDICINEX-19c5b270.png
+
+Env:
+  ARTIFACT_STORAGE=local|s3   backend (default local)
+  ARTIFACT_ROOT=generated     local root directory
+  STORAGE_SHARD_DEPTH=2       hash-prefix levels (2 hex chars each)
+  S3_BUCKET, S3_ENDPOINT_URL (e.g. http://localhost:9000 for MinIO), S3_PREFIX,
+  S3_PUBLIC_URL (serve from here instead of presigned URLs), S3_URL_EXPIRY (seconds)
+"""
+import hashlib
+import mimetypes
+import os
+import shutil
+import threading
+
+from artifacts import parse_artifact_path
+
+ARTIFACT_STORAGE = os.getenv("ARTIFACT_STORAGE", "local").strip().lower()
+ARTIFACT_ROOT = os.getenv("ARTIFACT_ROOT", "generated")
+STORAGE_SHARD_DEPTH = int(os.getenv("STORAGE_SHARD_DEPTH", "2"))
+
+S3_BUCKET = os.getenv("S3_BUCKET", "authentimed-artifacts")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL", "").rstrip("/")
+S3_URL_EXPIRY = int(os.getenv("S3_URL_EXPIRY", "3600"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def shard_key(key):
+    """Physical key for a logical artifact key; keys that are not artifact paths are returned unchanged."""
+    parsed = parse_artifact_path(key)
+    if parsed is None:
+        return key
+    digest = hashlib.sha256(parsed[1].encode()).hexdigest()
+    kind_dir, rest = key.split("/", 1)
+    return "/".join([kind_dir, *(digest[2 * i:2 * i + 2] for i in range(STORAGE_SHARD_DEPTH)), rest])
+
+
+def logical_key(physical):
+    """Inverse of shard_key. Also accepts legacy (flat) keys. Returns None for non-artifact paths."""
+    parts = physical.split("/")
+    candidate = "/".join([parts[0], *parts[1 + STORAGE_SHARD_DEPTH:]])
+    if len(parts) > 1 + STORAGE_SHARD_DEPTH and shard_key(candidate) == physical:
+        return candidate
+    return physical if parse_artifact_path(physical) else None
+
+
+# ========== Local filesystem ==========
+
+class LocalStorage:
+    """Sharded directory tree under root. Files from the old flat layout are still found until migrated."""
+
+    remote = False
+
+    def __init__(self, root=ARTIFACT_ROOT):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *shard_key(key).split("/"))
+
+    def legacy_path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def local_path(self, key):
+        """Path of the stored file, or None if it does not exist."""
+        for candidate in (self.path(key), self.legacy_path(key)):
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def exists(self, key):
+        return self.local_path(key) is not None
+
+    def put_file(self, key, src_path, move=False):
+        """Store src_path under key. Readers never see a partial file."""
+        dst = self.path(key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if move:
+            shutil.move(src_path, dst)
+            return
+        tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src_path, tmp)
+        os.replace(tmp, dst)
+
+    def delete(self, key):
+        for candidate in (self.path(key), self.legacy_path(key)):
+            try:
+                os.remove(candidate)
+            except OSError:
+                pass
+
+    def iter_keys(self):
+        """Yield (logical_key, physical_path) for every stored artifact, sharded or legacy."""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                key = logical_key(os.path.relpath(path, self.root).replace(os.sep, "/"))
+                if key:
+                    yield key, path
+
+    def url(self, key):
+        return None
+
+
+# ========== S3-compatible (AWS S3, MinIO) ==========
+
+class S3Storage:
+    """Objects in an S3 bucket under sharded keys. Served by redirecting to a public or presigned URL."""
+
+    remote = True
+
+    def __init__(self, bucket=S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, prefix=S3_PREFIX):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("ARTIFACT_STORAGE=s3 needs boto3 (pip install boto3)")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._client_error = ClientError
+
+    def object_key(self, key):
+        return self.prefix + shard_key(key)
+
+    def local_path(self, key):
+        return None
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except self._client_error:
+            return False
+
+    def put_file(self, key, src_path, move=False):
+        self.client.upload_file(src_path, self.bucket, self.object_key(key), ExtraArgs={
+            "ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream",
+            "CacheControl": IMMUTABLE_CACHE_CONTROL,
+        })
+        if move:
+            os.remove(src_path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(key))
+
+    def iter_keys(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                key = logical_key(obj["Key"][len(self.prefix):])
+                if key:
+                    yield key, obj["Key"]
+
+    def url(self, key):
+        if S3_PUBLIC_URL:
+            return f"{S3_PUBLIC_URL}/{self.object_key(key)}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": self.object_key(key)}, ExpiresIn=S3_URL_EXPIRY)
+
+
+def make_storage(kind=None):
+    kind = (kind or ARTIFACT_STORAGE).strip().lower()
+    if kind == "local":
+        return LocalStorage()
+    if kind == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown ARTIFACT_STORAGE: {kind}")
+
+
+_storage = None
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = make_storage()
+    return _storage
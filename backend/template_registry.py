@@ -0,0 +1,236 @@
+"""
+Packaging template registry: manufacturer address -> template versions, with the packaging-check
+features (ai-auth/verify.py) computed once per upload instead of on every verification.
+
+Versions are rows of packaging_templates (db.py); the files are the content-addressed copies under
+templates/versions/<sha256>.png (artifacts.store_template_version). Each process keeps an index of the
+table, so resolving the template for a scan is a dict lookup:
+
+  1. the exact version the product was printed with (products.template_sha256),
+  2. else the manufacturer's current (most recently uploaded) version,
+  3. else, with a single manufacturer registered, that manufacturer's current version (the
+     OWNER_ADDRESS deployment, where chain and env may spell the address differently).
+
+An unknown manufacturer re-reads the table at most every TEMPLATE_REFRESH_SECONDS, so uploads made
+by another worker are picked up without a restart.
+
+Integrity: /manufacturer/generate registers the current template's SHA-256 on chain
+(registerTemplateHash). Verification only trusts a template whose hash equals the manufacturer's
+on-chain hash (anchored() below); chain_hashes caches getTemplateHash per manufacturer, so this adds
+no RPC call per scan. The sha256 column alone proves nothing about the file on disk, so every version
+file is re-hashed when the table is loaded (mismatched or missing files are dropped from the index),
+and its features are recomputed from the verified file rather than read from the DB. Before a template
+is trusted its file is checked again; a file whose inode, size and mtime are unchanged since it was
+hashed is not re-read.
+
+Env:
+  TEMPLATE_REFRESH_SECONDS=30
+  TEMPLATE_HASH_TTL=300          seconds an on-chain hash is reused (other workers' uploads show up after this)
+  REQUIRE_TEMPLATE_HASH=1        fail the packaging check for manufacturers with no hash on chain
+                                 (default: check against the local template, as before anchoring)
+"""
+import os
+import threading
+import time
+
+import db
+from ai_verifier import template_features
+from artifacts import TEMPLATE_FOLDER, file_sha256, store_template_version, template_version_path
+
+TEMPLATE_REFRESH_SECONDS = float(os.getenv("TEMPLATE_REFRESH_SECONDS", "30"))
+TEMPLATE_HASH_TTL = float(os.getenv("TEMPLATE_HASH_TTL", "300"))
+REQUIRE_TEMPLATE_HASH = os.getenv("REQUIRE_TEMPLATE_HASH", "0") == "1"
+
+
+def _key(manufacturer):
+    # Addresses compare case-insensitively (checksummed on chain, as typed in OWNER_ADDRESS)
+    return (manufacturer or "").strip().lower()
+
+
+def _entry(row):
+    return {
+        "manufacturer": row["manufacturer"],
+        "sha256": row["sha256"],
+        "version": row["version"],
+        "path": template_version_path(row["sha256"]),
+        "features": row["features"],
+        "verified": None,   # (inode, size, mtime) of the file when it last hashed to sha256
+    }
+
+
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _verified(entry):
+    """True if the entry's file still hashes to its sha256; its features are then computed from that file."""
+    state = _file_state(entry["path"])
+    if state is None:
+        return False
+    if entry["verified"] == state:
+        return True
+    if file_sha256(entry["path"]) != entry["sha256"]:
+        return False
+    features = template_features(entry["path"])
+    if features is None or _file_state(entry["path"]) != state:
+        return False   # unreadable, or replaced while it was being read
+    entry["features"], entry["verified"] = features, state
+    return True
+
+
+class TemplateRegistry:
+    def __init__(self):
+        self._current = {}    # manufacturer key -> entry of its current version
+        self._by_sha = {}     # sha256 -> entry
+        self._rejected = set()   # manufacturer keys with a version file that failed its hash
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)build the index from packaging_templates; templates on disk from before the registry are registered first."""
+        try:
+            rows = db.get_packaging_templates()
+            known = {_key(row["manufacturer"]) for row in rows}
+            legacy = [
+                name[:-len(".png")] for name in sorted(os.listdir(TEMPLATE_FOLDER))
+                if name.endswith(".png") and _key(name[:-len(".png")]) not in known
+            ] if os.path.isdir(TEMPLATE_FOLDER) else []
+            for manufacturer in legacy:
+                rows.append(self._insert(manufacturer, os.path.join(TEMPLATE_FOLDER, f"{manufacturer}.png")))
+        except Exception as e:
+            print("Template registry not loaded:", str(e))
+            return False
+        current, by_sha, rejected = {}, {}, set()
+        for row in rows:
+            entry = _entry(row)
+            previous = self._by_sha.get(entry["sha256"])
+            if previous is not None:
+                # Already hashed by an earlier load: only re-read the file if it changed since
+                entry["features"], entry["verified"] = previous["features"], previous["verified"]
+            if not _verified(entry):
+                print(f"Template {entry['path']} is missing or does not match its hash; ignored")
+                rejected.add(_key(entry["manufacturer"]))
+                continue
+            current[_key(entry["manufacturer"])] = entry   # rows are oldest first: the last one wins
+            by_sha[entry["sha256"]] = entry
+        with self._lock:
+            self._current, self._by_sha, self._rejected = current, by_sha, rejected
+            self._loaded_at = time.monotonic()
+        return True
+
+    def _insert(self, manufacturer, template_path):
+        sha256 = store_template_version(template_path)
+        return db.insert_packaging_template(_key(manufacturer), sha256, template_features(template_version_path(sha256)))
+
+    def register(self, manufacturer, template_path):
+        """Record an uploaded template as the manufacturer's current version and return its entry."""
+        entry = _entry(self._insert(manufacturer, template_path))
+        entry["verified"] = _file_state(entry["path"])   # features were just computed from this file
+        with self._lock:
+            self._current[_key(manufacturer)] = entry
+            self._by_sha[entry["sha256"]] = entry
+        return entry
+
+    def current(self, manufacturer):
+        """The manufacturer's own current version (no fallback), or None."""
+        entry = self._current.get(_key(manufacturer))
+        if entry is None and self._refresh_due():
+            self.load()
+            entry = self._current.get(_key(manufacturer))
+        return entry
+
+    def resolve(self, manufacturer, sha256=None):
+        """Template entry to check a scan against (see module docstring), or None if there is none."""
+        entry = self._by_sha.get(sha256) if sha256 else None
+        if entry is None:
+            entry = self.current(manufacturer)
+        if entry is None and len(self._current) == 1:
+            entry = next(iter(self._current.values()))
+        return entry
+
+    def anchored(self, manufacturer, sha256, chain_sha256):
+        """
+        Template to check a scan against, given the manufacturer's on-chain hash (None if it has none).
+
+        Returns (entry, trusted): the resolved template when its hash is the one on chain, else the local
+        version carrying the on-chain hash; trusted is False when no local template matches it, or its
+        file no longer hashes to it.
+        """
+        entry = self.resolve(manufacturer, sha256)
+        if entry is not None and not _verified(entry):
+            self._drop(entry)
+            entry = None
+        if chain_sha256 is None:
+            # Nothing registered on chain yet (templates from before anchoring). A template that failed
+            # its hash is not "no template": refuse rather than skip the packaging check.
+            if entry is None:
+                return None, _key(manufacturer) not in self._rejected
+            return entry, not REQUIRE_TEMPLATE_HASH
+        if entry is not None and entry["sha256"] == chain_sha256:
+            return entry, True
+        pinned = self._by_sha.get(chain_sha256)
+        if pinned is None and self._refresh_due():
+            self.load()
+            pinned = self._by_sha.get(chain_sha256)
+        if pinned is not None and not _verified(pinned):
+            self._drop(pinned)
+            pinned = None
+        return pinned, pinned is not None
+
+    def _drop(self, entry):
+        # The file changed on disk after it was loaded: stop resolving to it until it matches again
+        print(f"Template {entry['path']} no longer matches its hash; ignored")
+        with self._lock:
+            self._rejected.add(_key(entry["manufacturer"]))
+            if self._by_sha.get(entry["sha256"]) is entry:
+                del self._by_sha[entry["sha256"]]
+            key = _key(entry["manufacturer"])
+            if self._current.get(key) is entry:
+                del self._current[key]
+
+    def _refresh_due(self):
+        # Unknown manufacturer: re-read the table, but not more often than TEMPLATE_REFRESH_SECONDS
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < TEMPLATE_REFRESH_SECONDS:
+                return False
+            self._loaded_at = time.monotonic()
+        return True
+
+    def entries(self):
+        return list(self._by_sha.values())
+
+
+templates = TemplateRegistry()
+
+
+class ChainTemplateHashes:
+    """manufacturer -> template SHA-256 registered on chain, cached for TEMPLATE_HASH_TTL seconds."""
+
+    def __init__(self, ttl=TEMPLATE_HASH_TTL):
+        self.ttl = ttl
+        self._hashes = {}   # manufacturer key -> (fetched_at, sha256 or None)
+
+    def cached(self, manufacturer):
+        """(True, sha256 or None) if a fresh value is cached, else (False, None)."""
+        entry = self._hashes.get(_key(manufacturer))
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return False, None
+        return True, entry[1]
+
+    def get(self, manufacturer, fetch):
+        """Cached on-chain hash; fetch(manufacturer) (blockchain.get_template_hash) is called on a miss."""
+        hit, sha256 = self.cached(manufacturer)
+        if not hit:
+            sha256 = fetch(manufacturer)
+            self.set(manufacturer, sha256)
+        return sha256
+
+    def set(self, manufacturer, sha256):
+        self._hashes[_key(manufacturer)] = (time.monotonic(), sha256)
+
+
+chain_hashes = ChainTemplateHashes()
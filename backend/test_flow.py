@@ -2,16 +2,27 @@
 Test runner for steganography flow.
 
 Usage:
-  - With any argument: uses `test.jpeg` (project root or generated/hidden)
+  - `python test_flow.py roundtrip`: encode the codes in ROUND_TRIP_CODES and check they decode back
+    (exit code 1 on a mismatch)
+  - `python test_flow.py qr`: print signed QR payloads into every template in templates/ and decode
+    the composites at template resolution (exit code 1 if the QR decoder misses any)
+  - With any other argument: uses `test.jpeg` (project root or generated/hidden)
   - Without arguments: generates a hidden image via `id_generation`.
 
 Flow:
   stego image -> revealer.reveal_channels -> extractor.extract_code
 """
+import glob
 import sys
 import os
+import tempfile
 from datetime import datetime
 
+# The encoder draws 'B' and '6' identically: 'B' in every letter position and '6' in every digit
+# position must still decode to the character that was encoded.
+ROUND_TRIP_CODES = ["APBJ99962F", "JEGB41144X", "BBBB66666B", "KCSC33099D", "BOSZ10526B"]
+QR_CHECK_PAYLOADS = 50
+
 
 def find_test_file():
     candidates = [
@@ -24,8 +35,75 @@ def find_test_file():
     return None
 
 
+def round_trip():
+    """Encode each of ROUND_TRIP_CODES with id_generation and decode it with extractor.decode_strip."""
+    from id_generation import generate_hidden_code_image
+    from extractor import decode_strip
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for code in ROUND_TRIP_CODES:
+            path = os.path.join(tmp, f"{code}.png")
+            generate_hidden_code_image(code=code, output_path=path)
+            decoded, _ = decode_strip(path)
+            ok = decoded == code
+            failures += not ok
+            print(f"{code} -> {decoded}  {'ok' if ok else 'MISMATCH'}")
+    print(f"{failures} mismatch(es)")
+    return 1 if failures else 0
+
+
+def _qr_decoders():
+    """(name, decode(bgr array) -> text) for the QR decoders available; the first one must read every code."""
+    import cv2
+    decoders = []
+    try:
+        from pyzbar.pyzbar import decode
+        # What scan_decoder uses (qr_extractor)
+        decoders.append(("zbar", lambda img: next((c.data.decode() for c in decode(img)), None)))
+    except ImportError:
+        pass
+    decoders.append(("opencv-aruco", lambda img: cv2.QRCodeDetectorAruco().detectAndDecode(img)[0]))
+    decoders.append(("opencv", lambda img: cv2.QRCodeDetector().detectAndDecode(img)[0]))
+    return decoders
+
+
+def qr_check():
+    """Compose QR_CHECK_PAYLOADS signed payloads into each template and decode them at template resolution."""
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    from product_ids import new_product_id
+    from qr_overlay import QRCompositor
+    from qr_signing import signed_payload
+
+    templates = sorted(glob.glob(os.path.join("templates", "*.png")))
+    if not templates:
+        print("No templates in templates/")
+        return 1
+    key = Ed25519PrivateKey.generate()   # throwaway: nothing is registered
+    compositor = QRCompositor()
+    decoders = _qr_decoders()
+    failures = 0
+    for template in templates:
+        decoded = {name: 0 for name, _ in decoders}
+        for _ in range(QR_CHECK_PAYLOADS):
+            payload = signed_payload(key, new_product_id())
+            composite = compositor.compose(template, payload)
+            for name, decode in decoders:
+                decoded[name] += decode(composite) == payload
+        h, w = composite.shape[:2]
+        print(f"{os.path.basename(template)} ({w}x{h}, {len(payload)}-char payload): " +
+              ", ".join(f"{name} {count}/{QR_CHECK_PAYLOADS}" for name, count in decoded.items()))
+        failures += QR_CHECK_PAYLOADS - decoded[decoders[0][0]]
+    print(f"{failures} composite(s) not decoded by {decoders[0][0]}")
+    return 1 if failures else 0
+
+
 def main():
     # Decide flow
+    if sys.argv[1:] == ["qr"]:
+        sys.exit(qr_check())
+    if sys.argv[1:] == ["roundtrip"]:
+        sys.exit(round_trip())
     if len(sys.argv) > 1:
         print("Argument detected — attempting test.jpeg flow")
         stego = find_test_file()
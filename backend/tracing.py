@@ -0,0 +1,189 @@
+"""
+Per-stage timing for the verification pipeline.
+
+@traced("stage") times a function. Inside a request the timing is added to that request's
+breakdown (logged after the request and optionally sent as a Server-Timing header); every
+timing also feeds a process-wide histogram exposed in Prometheus text format on /metrics.
+
+Env:
+  TRACE_LOG=0        disable the per-request breakdown log line
+  SERVER_TIMING=1    add a Server-Timing header to responses
+"""
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+
+TRACE_LOG = os.getenv("TRACE_LOG", "1") != "0"
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# Histogram upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# List of (stage, seconds) for the current request; None outside requests
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label value (Prometheus semantics)."""
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(BUCKETS) + 1), 0.0]
+            series[0][bisect_left(BUCKETS, seconds)] += 1
+            series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+        for label_value, (counts, total) in sorted(snapshot.items()):
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return "\n".join(lines)
+
+
+STAGE_SECONDS = Histogram(
+    "authentimed_stage_duration_seconds", "Time spent in each pipeline stage.", "stage")
+REQUEST_SECONDS = Histogram(
+    "authentimed_request_duration_seconds", "End-to-end request time per route.", "route")
+
+
+def record(stage, seconds):
+    """Record one stage timing (histogram + current request breakdown)."""
+    STAGE_SECONDS.observe(stage, seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+def traced(stage):
+    """Decorator: time every call of the wrapped function (or coroutine function) as `stage`."""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    record(stage, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def breakdown(spans):
+    """Sum spans per stage, keeping first-seen order. Returns [(stage, total_seconds, calls)]."""
+    totals = {}
+    for stage, seconds in spans:
+        total, calls = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + seconds, calls + 1)
+    return [(stage, total, calls) for stage, (total, calls) in totals.items()]
+
+
+def render_metrics():
+    return STAGE_SECONDS.render() + "\n" + REQUEST_SECONDS.render() + "\n"
+
+
+def _finish(method, route, elapsed, spans):
+    """Record the request histogram and log line; return the Server-Timing header value (or None)."""
+    REQUEST_SECONDS.observe(route, elapsed)
+    stages = breakdown(spans)
+    if TRACE_LOG and stages:
+        parts = " ".join(f"{s}={t * 1000:.1f}ms" + (f"x{n}" if n > 1 else "") for s, t, n in stages)
+        print(f"TIMING {method} {route} total={elapsed * 1000:.1f}ms {parts}")
+    if not SERVER_TIMING:
+        return None
+    entries = [f"{s};dur={t * 1000:.1f}" for s, t, _ in stages]
+    entries.append(f"total;dur={elapsed * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def init_app(app):
+    """Attach per-request breakdowns, the optional Server-Timing header and /metrics to a Flask app."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_trace():
+        g.trace_token = _request_spans.set([])
+        g.trace_start = time.perf_counter()
+
+    @app.after_request
+    def _finish_trace(response):
+        spans = _request_spans.get()
+        if spans is None or "trace_start" not in g:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        header = _finish(request.method, route, time.perf_counter() - g.trace_start, spans)
+        if header:
+            response.headers["Server-Timing"] = header
+        return response
+
+    @app.teardown_request
+    def _reset_trace(_exc):
+        token = g.pop("trace_token", None)
+        if token is not None:
+            try:
+                _request_spans.reset(token)
+            except ValueError:
+                _request_spans.set(None)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+class ASGIMiddleware:
+    """The same per-request breakdown for ASGI routes (wrap each route, not a mounted Flask app)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = _request_spans.set([])
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                header = _finish(scope["method"], scope["path"], time.perf_counter() - start, _request_spans.get())
+                if header:
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_spans.reset(token)
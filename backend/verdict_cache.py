@@ -0,0 +1,109 @@
+"""
+Per-process negative cache of verification verdicts, plus per-code counters for hot counterfeits.
+
+Counterfeiters replay a handful of cloned QR / strip codes. Verdicts that can never change for a
+code (not issued, duplicate scan, product already used) are cached by (route, factor, code) for
+VERDICT_CACHE_TTL seconds, so a replay returns before any DB or chain call. Every counterfeit or
+duplicate verdict, cached or not, bumps a counter for its code; hot() ranks them for the
+/reports/hot-counterfeits endpoint. Nothing here writes to the DB; with several workers each one
+reports its own traffic.
+
+Env:
+  VERDICT_CACHE_ENABLED=0    disable caching (counters still run)
+  VERDICT_CACHE_SIZE=100000  max cached verdicts (LRU)
+  VERDICT_CACHE_TTL=600      seconds a cached verdict is reused
+  HOT_CODES_MAX=50000        max codes tracked by the counters
+"""
+import heapq
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+VERDICT_CACHE_ENABLED = os.getenv("VERDICT_CACHE_ENABLED", "1") != "0"
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "100000"))
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", "600"))
+HOT_CODES_MAX = int(os.getenv("HOT_CODES_MAX", "50000"))
+
+
+class VerdictCache:
+    def __init__(self, max_entries=VERDICT_CACHE_SIZE, ttl=VERDICT_CACHE_TTL, max_codes=HOT_CODES_MAX):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_codes = max_codes
+        self._entries = OrderedDict()   # (route, factor, code) -> (expires_at, verdict)
+        self._counters = {}             # (factor, code) -> [count, first_seen, last_seen, reason]
+        self._lock = threading.Lock()
+
+    def get(self, route, factor, code):
+        """Cached verdict for this code on this route, or None. A hit counts as a submission."""
+        if not VERDICT_CACHE_ENABLED or not code:
+            return None
+        key = (route, factor, code)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            verdict = entry[1]
+            self._count_locked(factor, code, verdict)
+        return verdict
+
+    def put(self, route, factor, code, verdict):
+        if not VERDICT_CACHE_ENABLED or not code:
+            return
+        with self._lock:
+            self._entries[(route, factor, code)] = (time.monotonic() + self.ttl, verdict)
+            self._entries.move_to_end((route, factor, code))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put_product(self, route, product_id, strip_code, verdict):
+        """Cache a verdict that holds for the whole product, whichever of its codes is scanned next."""
+        self.put(route, "qr", product_id, verdict)
+        self.put(route, "strip", (strip_code or "").strip().upper() or None, verdict)
+
+    def remember(self, route, factor, code, verdict):
+        """Cache a final verdict for the code, count it, and return it (for `return jsonify(...)`)."""
+        self.put(route, factor, code, verdict)
+        self.count(factor, code, verdict)
+        return verdict
+
+    def count(self, factor, code, verdict):
+        """Count a counterfeit/duplicate submission that is not cacheable (e.g. failed packaging check)."""
+        if not code:
+            return verdict
+        with self._lock:
+            self._count_locked(factor, code, verdict)
+        return verdict
+
+    def _count_locked(self, factor, code, verdict):
+        now = datetime.utcnow()
+        counter = self._counters.get((factor, code))
+        if counter is None:
+            if len(self._counters) >= self.max_codes:
+                # Forget the least-submitted tenth; hot codes survive
+                for key in heapq.nsmallest(self.max_codes // 10 or 1, self._counters,
+                                           key=lambda k: self._counters[k][0]):
+                    del self._counters[key]
+            counter = self._counters[(factor, code)] = [0, now, now, None]
+        counter[0] += 1
+        counter[2] = now
+        counter[3] = verdict.get("Flag") or verdict.get("Reason")
+
+    def hot(self, limit=50):
+        """The most-submitted counterfeit/duplicate codes, most frequent first."""
+        with self._lock:
+            top = heapq.nlargest(limit, self._counters.items(), key=lambda item: item[1][0])
+        return [
+            {"Factor": factor, "Code": code, "Count": count,
+             "First Seen": first_seen.isoformat(), "Last Seen": last_seen.isoformat(), "Reason": reason}
+            for (factor, code), (count, first_seen, last_seen, reason) in top
+        ]
+
+
+verdicts = VerdictCache()
@@ -0,0 +1,33 @@
+"""
+Production entry point.
+
+  python manage.py migrate                  # once per deploy
+  gunicorn -c gunicorn.conf.py wsgi:app     # see gunicorn.conf.py and README "Running in production"
+
+Importing this module builds the app and preloads read-only state (glyph bank, packaging
+template registry, issued-codes filter, QR signing public keys). With gunicorn's preload_app that happens once in the master and
+forked workers share the pages copy-on-write instead of each rebuilding them on their first request.
+"""
+import os
+
+from app import create_app
+
+
+def preload():
+    from bloom import issued
+    from extractor import get_glyph_bank
+    from qr_overlay import compositor
+    from qr_signing import keys
+    from template_registry import templates
+
+    get_glyph_bank()
+    issued.load()
+    keys.load()
+    templates.load()
+    for entry in templates.entries():
+        if os.path.exists(entry["path"]):
+            compositor.template(entry["path"])
+
+
+app = create_app()
+preload()
@@ -1,5 +1,6 @@
 import { useState } from "react";
 import ResultCard from "./ResultCard";
+import { downscaleImage } from "../utils/images";
 
 const API_BASE = "http://127.0.0.1:5000";
 
@@ -15,7 +16,7 @@ export default function ConsumerPanel() {
     setResult(null);
 
     const formData = new FormData();
-    formData.append("file", file);
+    formData.append("file", await downscaleImage(API_BASE, file));
 
     try {
       const res = await fetch(`${API_BASE}/consumer/verify`, {
@@ -0,0 +1,64 @@
+// Downscale scan images in the browser before upload, so multi-megabyte phone photos are not sent
+// (and decoded) at full size. The limit comes from the backend's GET /config.
+//
+// The strip code is hidden as +1 offsets in single colour channels: resizing uses nearest-neighbour
+// (pixel values are copied, never blended) and PNG input stays PNG, since a lossy re-encode erases it.
+// JPEG input has already lost the strip, so it is re-encoded as JPEG.
+//
+// Also used by frontend2 (imported as "@frontend/utils/images", see frontend2/vite.config.js).
+
+const DEFAULT_MAX_DIMENSION = 1600;
+
+let configPromise = null;
+
+function maxDimension(apiBase) {
+  if (!configPromise) {
+    configPromise = fetch(`${apiBase}/config`)
+      .then((res) => res.json())
+      .then((config) => config.max_image_dimension || DEFAULT_MAX_DIMENSION)
+      .catch(() => {
+        configPromise = null; // ask again next time
+        return DEFAULT_MAX_DIMENSION;
+      });
+  }
+  return configPromise;
+}
+
+// Resolves to a File no larger than the server limit on either side (the original if it already fits).
+export async function downscaleImage(apiBase, file) {
+  if (!file || !file.type.startsWith("image/")) return file;
+
+  let bitmap;
+  try {
+    bitmap = await createImageBitmap(file);
+  } catch {
+    return file; // let the backend report what it can read
+  }
+
+  try {
+    const limit = await maxDimension(apiBase);
+    const scale = limit / Math.max(bitmap.width, bitmap.height);
+    if (scale >= 1) return file;
+
+    const width = Math.max(1, Math.round(bitmap.width * scale));
+    const height = Math.max(1, Math.round(bitmap.height * scale));
+    const canvas = typeof OffscreenCanvas !== "undefined"
+      ? new OffscreenCanvas(width, height)
+      : Object.assign(document.createElement("canvas"), { width, height });
+    const ctx = canvas.getContext("2d");
+    ctx.imageSmoothingEnabled = false;
+    ctx.drawImage(bitmap, 0, 0, width, height);
+
+    const jpeg = file.type === "image/jpeg";
+    const type = jpeg ? "image/jpeg" : "image/png";
+    const blob = canvas.convertToBlob
+      ? await canvas.convertToBlob({ type, quality: 0.92 })
+      : await new Promise((resolve) => canvas.toBlob(resolve, type, 0.92));
+    if (!blob || blob.size >= file.size) return file;
+
+    const name = file.name.replace(/\.[^.]*$/, "") + (jpeg ? ".jpg" : ".png");
+    return new File([blob], name, { type });
+  } finally {
+    bitmap.close();
+  }
+}
@@ -1,5 +1,8 @@
 import { useState } from "react";
 import ResultCard from "./ResultCard";
+import { downscaleImage } from "@frontend/utils/images";
+
+const API_BASE = "http://127.0.0.1:5000";
 
 export default function ConsumerPanel() {
   const [file, setFile] = useState(null);
@@ -12,9 +15,9 @@ export default function ConsumerPanel() {
   setLoading(true);
 
   const formData = new FormData();
-  formData.append("file", file);
+  formData.append("file", await downscaleImage(API_BASE, file));
 
-  const res = await fetch("http://127.0.0.1:5000/consumer/verify", {
+  const res = await fetch(`${API_BASE}/consumer/verify`, {
     method: "POST",
     body: formData
   });
@@ -1,5 +1,8 @@
 import { useState } from "react";
 import ResultCard from "./ResultCard";
+import { downscaleImage } from "@frontend/utils/images";
+
+const API_BASE = "http://127.0.0.1:5000";
 
 export default function PharmacistPanel() {
   const [file, setFile] = useState(null);
@@ -12,10 +15,10 @@ export default function PharmacistPanel() {
     setLoading(true);
 
     const formData = new FormData();
-    formData.append("file", file);
+    formData.append("file", await downscaleImage(API_BASE, file));
 
     try {
-      const res = await fetch("http://127.0.0.1:5000/pharmacist/verify", {
+      const res = await fetch(`${API_BASE}/pharmacist/verify`, {
         method: "POST",
         body: formData
       });
@@ -1,5 +1,6 @@
 import { useState } from "react";
 import ResultCard from "../components/ResultCard";
+import { verifyScan } from "../utils/scan";
 import "../styles/manufacturer.css";
 
 const API_BASE = "http://127.0.0.1:5000";
@@ -15,17 +16,12 @@ export default function Consumer() {
       return;
     }
 
-    const formData = new FormData();
-    formData.append("file", file);
-
     setLoading(true);
     setResult(null);
 
     try {
-      const res = await fetch(`${API_BASE}/consumer/verify`, {
-        method: "POST",
-        body: formData,
-      });
+      // QR decoded in the browser when possible; otherwise the image is uploaded
+      const res = await verifyScan(API_BASE, "consumer", file);
 
       const data = await res.json();
       setResult(data);
@@ -0,0 +1,62 @@
+// Verify a scan by sending the QR code decoded in the browser instead of the whole image.
+// BarcodeDetector exists in Chromium browsers (Chrome / Edge, Android); elsewhere, and for strip
+// codes (read by the backend's own decoder), the image is uploaded, downscaled first by the stable
+// UI's utils/images.js (the "@frontend" alias in vite.config.js).
+
+import { downscaleImage } from "@frontend/utils/images";
+
+// Same threshold as the backend (_is_likely_qr_or_strip_only): smaller images are QR/strip crops,
+// larger ones are full-pack photos that the pharmacist packaging check still needs.
+const FULL_PACK_MIN_SIDE = 400;
+
+async function decodeQr(file) {
+  if (!("BarcodeDetector" in window)) return null;
+
+  try {
+    const formats = await window.BarcodeDetector.getSupportedFormats();
+    if (!formats.includes("qr_code")) return null;
+
+    const bitmap = await createImageBitmap(file);
+    try {
+      const detector = new window.BarcodeDetector({ formats: ["qr_code"] });
+      const code = (await detector.detect(bitmap))
+        .map((c) => c.rawValue.trim())
+        .find((value) => value.startsWith("MEDICINEX-"));
+      if (!code) return null;
+
+      return {
+        qr: code,
+        fullPack: Math.min(bitmap.width, bitmap.height) >= FULL_PACK_MIN_SIDE,
+      };
+    } finally {
+      bitmap.close();
+    }
+  } catch {
+    return null;
+  }
+}
+
+// role: "consumer" or "pharmacist". Resolves to the fetch Response.
+export async function verifyScan(apiBase, role, file) {
+  const decoded = await decodeQr(file);
+
+  if (decoded && role === "pharmacist" && decoded.fullPack) {
+    // Code plus the pack image for the packaging check; the backend skips decoding
+    const formData = new FormData();
+    formData.append("qr", decoded.qr);
+    formData.append("file", await downscaleImage(apiBase, file));
+    return fetch(`${apiBase}/pharmacist/verify/code`, { method: "POST", body: formData });
+  }
+
+  if (decoded) {
+    return fetch(`${apiBase}/${role}/verify/code`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ qr: decoded.qr }),
+    });
+  }
+
+  const formData = new FormData();
+  formData.append("file", await downscaleImage(apiBase, file));
+  return fetch(`${apiBase}/${role}/verify`, { method: "POST", body: formData });
+}
@@ -1,7 +1,17 @@
-import { defineConfig } from 'vite'
+import { fileURLToPath } from 'node:url'
+import { defineConfig, searchForWorkspaceRoot } from 'vite'
 import react from '@vitejs/plugin-react'
 
+// Helpers shared with the stable UI (e.g. utils/images.js) live in ../frontend/src
+const stableSrc = fileURLToPath(new URL('../frontend/src', import.meta.url))
+
 // https://vite.dev/config/
 export default defineConfig({
   plugins: [react()],
+  resolve: {
+    alias: { '@frontend': stableSrc },
+  },
+  server: {
+    fs: { allow: [searchForWorkspaceRoot(process.cwd()), stableSrc] },
+  },
 })